@@ -0,0 +1 @@
+"""Load-test / benchmark suite: seed SQLite stand-in databases, start the four services, measure, compare."""
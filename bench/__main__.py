@@ -0,0 +1,110 @@
+"""Benchmark CLI (run from the repository root).
+
+    python -m bench seed --users 100000 --products 10000 --orders 1000000
+    python -m bench run --scenarios list_orders,create_order --concurrency 32 --duration 30
+    python -m bench compare bench/results/<base>.json bench/results/<new>.json
+
+``seed`` writes SQLite files to --data-dir (default bench/data) and records the
+scale next to them; ``run`` starts the four services on those files (gunicorn
+by default, --server dev for the Flask dev server), runs each scenario in turn,
+prints a table and saves JSON to --out. ``compare`` exits with status 1 when a
+scenario's throughput or p50/p95/p99 got worse than --threshold.
+"""
+import argparse
+import json
+import os
+import sys
+
+from bench.stack import ROOT, Stack, service_env
+
+DEFAULT_DATA_DIR = os.path.join(ROOT, "bench", "data")
+DEFAULT_OUT_DIR = os.path.join(ROOT, "bench", "results")
+SCALE_FILE = "scale.json"
+
+
+def cmd_seed(args):
+    os.makedirs(args.data_dir, exist_ok=True)
+    os.environ.update(service_env(args.data_dir))
+    from bench.seed import seed
+    scale = seed(users=args.users, products=args.products, orders=args.orders,
+                 payments=args.payments, days=args.days, chunk=args.chunk, rng_seed=args.seed)
+    with open(os.path.join(args.data_dir, SCALE_FILE), "w", encoding="utf-8") as f:
+        json.dump(scale, f)
+    print(f"seeded {scale} into {args.data_dir}")
+
+
+def cmd_run(args):
+    from bench import load, report
+    scale_path = os.path.join(args.data_dir, SCALE_FILE)
+    if not os.path.exists(scale_path):
+        sys.exit(f"{scale_path} not found: run `python -m bench seed` first")
+    with open(scale_path, encoding="utf-8") as f:
+        scale = json.load(f)
+    names = args.scenarios.split(",") if args.scenarios else list(load.SCENARIOS)
+    unknown = [n for n in names if n not in load.SCENARIOS]
+    if unknown:
+        sys.exit(f"unknown scenario(s): {', '.join(unknown)} (known: {', '.join(load.SCENARIOS)})")
+
+    results = {}
+    with Stack(args.data_dir, server=args.server, workers=args.workers, threads=args.threads) as stack:
+        print(f"services up (logs in {stack.log_dir})")
+        for name in names:
+            results[name] = load.run_scenario(name, scale, concurrency=args.concurrency,
+                                              duration=args.duration, warmup=args.warmup)
+            print(f"{name}: {results[name]['throughput_rps']} req/s, p99 {results[name]['p99_ms']} ms")
+
+    settings = {"server": args.server, "workers": args.workers, "threads": args.threads,
+                "concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup}
+    result = report.build_result(scale, settings, results)
+    print(report.format_table(results))
+    print(f"saved {report.save(result, args.out)}")
+
+
+def cmd_compare(args):
+    from bench import report
+    lines, regressions = report.compare(report.load(args.base), report.load(args.new), args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("seed", help="create and fill the SQLite databases")
+    p.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    p.add_argument("--users", type=int, default=100_000)
+    p.add_argument("--products", type=int, default=10_000)
+    p.add_argument("--orders", type=int, default=1_000_000)
+    p.add_argument("--payments", type=int, default=100_000)
+    p.add_argument("--days", type=int, default=365, help="orders are dated over the last N days")
+    p.add_argument("--chunk", type=int, default=5000, help="rows per multi-row INSERT")
+    p.add_argument("--seed", type=int, default=42, help="random seed (same seed = same data)")
+    p.set_defaults(func=cmd_seed)
+
+    p = sub.add_parser("run", help="start the services and run scenarios")
+    p.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    p.add_argument("--out", default=DEFAULT_OUT_DIR)
+    p.add_argument("--scenarios", default="", help="comma-separated (default: all)")
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--duration", type=float, default=30.0)
+    p.add_argument("--warmup", type=float, default=3.0)
+    p.add_argument("--server", choices=("gunicorn", "dev"), default="gunicorn")
+    p.add_argument("--workers", type=int, default=2)
+    p.add_argument("--threads", type=int, default=4)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("compare", help="diff two saved runs")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown as a fraction")
+    p.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
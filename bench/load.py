@@ -0,0 +1,123 @@
+"""Closed-loop load generator and the benchmark scenarios.
+
+Each scenario runs on its own: ``concurrency`` threads send requests back to
+back for ``duration`` seconds (after ``warmup`` seconds that are not measured).
+"""
+import random
+import threading
+import time
+
+import requests
+
+from bench.seed import WORDS
+from bench.stack import base_url
+
+
+# ---- Scenarios: (rng, scale) -> (method, url, json body or None) ----
+def list_orders(rng, scale):
+    # Keyset page somewhere in the table: order_view read + enrichment fields
+    after = rng.randint(0, max(scale["orders"] - 50, 0))
+    return "GET", f"{base_url('orders')}/orders/?limit=50&after={after}", None
+
+
+def get_order(rng, scale):
+    return "GET", f"{base_url('orders')}/orders/{rng.randint(1, scale['orders'])}/", None
+
+
+def create_order(rng, scale):
+    # Write path with user/product lookups (the enrichment fan-out)
+    body = {"user_id": rng.randint(1, scale["users"]),
+            "product_ids": [rng.randint(1, scale["products"]) for _ in range(rng.randint(1, 5))]}
+    return "POST", f"{base_url('orders')}/orders/", body
+
+
+def create_payment(rng, scale):
+    body = {"order_id": rng.randint(1, scale["orders"]), "method": rng.choice(("Cash", "Card", "Momo"))}
+    return "POST", f"{base_url('payments')}/payments", body
+
+
+def search_users(rng, scale):
+    return "GET", f"{base_url('users')}/users/?search=user{rng.randint(1, scale['users'])}&limit=20", None
+
+
+def search_products(rng, scale):
+    return "GET", f"{base_url('products')}/products/?search={rng.choice(WORDS)}&limit=20", None
+
+
+def batch_users(rng, scale):
+    ids = ",".join(str(rng.randint(1, scale["users"])) for _ in range(50))
+    return "GET", f"{base_url('users')}/users/?ids={ids}", None
+
+
+SCENARIOS = {
+    "list_orders": list_orders,
+    "get_order": get_order,
+    "create_order": create_order,
+    "create_payment": create_payment,
+    "search_users": search_users,
+    "search_products": search_products,
+    "batch_users": batch_users,
+}
+
+
+# ---- Runner ----
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None  # noqa: E731
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+
+def run_scenario(name, scale, concurrency=16, duration=30.0, warmup=3.0, rng_seed=1):
+    build = SCENARIOS[name]
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+    measure_from = time.monotonic() + warmup
+    stop_at = measure_from + duration
+
+    def worker(idx):
+        rng = random.Random(rng_seed * 1000 + idx)
+        session = requests.Session()
+        local, local_errors = [], 0
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            method, url, body = build(rng, scale)
+            started = time.perf_counter()
+            try:
+                ok = session.request(method, url, json=body, timeout=30).status_code < 400
+            except requests.RequestException:
+                ok = False
+            took = time.perf_counter() - started
+            if now >= measure_from:
+                local.append(took)
+                local_errors += not ok
+        session.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors[0], duration)
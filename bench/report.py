@@ -0,0 +1,83 @@
+"""Save benchmark results as JSON and compare two runs."""
+import json
+import os
+import platform
+import subprocess
+import time
+
+from bench.stack import ROOT
+
+# metric -> +1 if higher is better, -1 if lower is better
+COMPARED = {"throughput_rps": +1, "p50_ms": -1, "p95_ms": -1, "p99_ms": -1}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def build_result(scale, settings, scenarios):
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": scale,
+            "settings": settings,
+        },
+        "scenarios": scenarios,
+    }
+
+
+def save(result, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(out_dir, f"{stamp}-{result['meta']['git'] or 'nogit'}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def format_table(scenarios):
+    header = f"{'scenario':<16} {'req':>8} {'err':>6} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    lines = [header, "-" * len(header)]
+    for name, s in scenarios.items():
+        lines.append(f"{name:<16} {s['requests']:>8} {s['errors']:>6} {s['throughput_rps']:>9} "
+                     f"{s['p50_ms'] or '-':>9} {s['p95_ms'] or '-':>9} {s['p99_ms'] or '-':>9}")
+    return "\n".join(lines)
+
+
+def compare(base, new, threshold=0.10):
+    """Return (report lines, regressions) for scenarios present in both runs.
+
+    A regression is a compared metric that got worse by more than ``threshold``
+    (a fraction: 0.10 = 10 %).
+    """
+    lines, regressions = [], []
+    if base["meta"].get("scale") != new["meta"].get("scale"):
+        lines.append(f"warning: different data scale {base['meta'].get('scale')} vs {new['meta'].get('scale')}")
+    lines.append(f"{'scenario':<16} {'metric':<15} {'base':>10} {'new':>10} {'change':>8}")
+    for name in base["scenarios"]:
+        if name not in new["scenarios"]:
+            continue
+        for metric, direction in COMPARED.items():
+            old_value = base["scenarios"][name].get(metric)
+            new_value = new["scenarios"][name].get(metric)
+            if not old_value or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value
+            worse = -change * direction > threshold
+            flag = "  REGRESSION" if worse else ""
+            lines.append(f"{name:<16} {metric:<15} {old_value:>10} {new_value:>10} {change:>+8.1%}{flag}")
+            if worse:
+                regressions.append((name, metric, old_value, new_value))
+    return lines, regressions
@@ -0,0 +1,115 @@
+"""Bulk-load deterministic data straight into the services' databases.
+
+Rows go in with multi-row INSERTs through the services' own table definitions
+(no HTTP, no ORM objects), so 1M orders take minutes, not hours. Orders are
+dated across the last ``days`` days in id order (payments a little after
+their order), so the analytics time series has data in every window.
+"""
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from bench.stack import SERVICES, import_service
+
+STATUSES = ("Pending", "Delivering", "Completed")
+METHODS = ("Cash", "Card", "Momo")
+WORDS = ("pho", "banh mi", "bun cha", "com tam", "tra sua", "ca phe", "goi cuon", "lau", "xoi", "che")
+
+
+def _chunks(total, size):
+    for start in range(1, total + 1, size):
+        yield start, min(start + size, total + 1)
+
+
+def _insert(engine, table, rows):
+    with engine.begin() as conn:
+        conn.execute(table.insert(), rows)
+
+
+def product_name(pid):
+    return f"{WORDS[pid % len(WORDS)].title()} #{pid}"
+
+
+def product_price(pid):
+    return round(10 + (pid * 7919 % 9000) / 100, 2)
+
+
+def seed(users=100_000, products=10_000, orders=1_000_000, payments=100_000,
+         max_lines=5, days=365, chunk=5000, rng_seed=42, echo=print):
+    mods = {name: import_service(name) for name in SERVICES}
+    for mod in mods.values():
+        mod.Base.metadata.drop_all(mod.engine)
+        mod.Base.metadata.create_all(mod.engine)
+    rng = random.Random(rng_seed)
+
+    started = time.perf_counter()
+    u = mods["users"]
+    for lo, hi in _chunks(users, chunk):
+        _insert(u.engine, u.User.__table__,
+                [{"id": i, "name": f"User {i}", "email": f"user{i}@example.com"} for i in range(lo, hi)])
+    echo(f"users: {users} rows ({time.perf_counter() - started:.1f}s)")
+
+    p = mods["products"]
+    for lo, hi in _chunks(products, chunk):
+        _insert(p.engine, p.Product.__table__,
+                [{"id": i, "name": product_name(i), "price": product_price(i)} for i in range(lo, hi)])
+    echo(f"products: {products} rows ({time.perf_counter() - started:.1f}s)")
+
+    # ?search= goes through the n-gram index, which bulk INSERTs bypass
+    for mod, index in ((u, u.user_search), (p, p.product_search)):
+        session = mod.Session()
+        try:
+            index.rebuild(session)
+        finally:
+            session.close()
+    echo(f"search index: done ({time.perf_counter() - started:.1f}s)")
+
+    o = mods["orders"]
+    item_id = 0
+    totals = {}
+    # naive UTC, like the services' created_at default; dates are relative to now, the rest follows rng_seed
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    start, span = now - timedelta(days=days), timedelta(days=days) / orders
+    for lo, hi in _chunks(orders, chunk):
+        order_rows, item_rows, view_rows = [], [], []
+        for oid in range(lo, hi):
+            uid = rng.randint(1, users)
+            pids = [rng.randint(1, products) for _ in range(rng.randint(1, max_lines))]
+            lines = {}
+            for pid in pids:
+                lines[pid] = lines.get(pid, 0) + 1
+            total = round(sum(product_price(pid) * qty for pid, qty in lines.items()), 2)
+            status = rng.choice(STATUSES)
+            created_at = start + span * (oid - rng.random())  # increasing with id, the last one just before now
+            csv = ",".join(map(str, pids))
+            order_rows.append({"id": oid, "user_id": uid, "product_ids": csv, "total": total, "status": status,
+                               "created_at": created_at})
+            for pid, qty in lines.items():
+                item_id += 1
+                item_rows.append({"id": item_id, "order_id": oid, "product_id": pid, "quantity": qty,
+                                  "unit_price": product_price(pid), "product_name": product_name(pid)})
+            product_list = [{"id": pid, "name": product_name(pid), "price": product_price(pid)}
+                            for pid, qty in lines.items() for _ in range(qty)]
+            view_rows.append({"id": oid, "user_id": uid, "user_name": f"User {uid}", "product_ids": csv,
+                              "product_list": json.dumps(product_list), "total": total, "status": status})
+            if oid <= payments:
+                totals[oid] = (total, created_at)
+        _insert(o.engine, o.Order.__table__, order_rows)
+        _insert(o.engine, o.OrderItem.__table__, item_rows)
+        _insert(o.engine, o.OrderView.__table__, view_rows)
+        if hi - 1 == orders or (hi - 1) % (chunk * 20) == 0:
+            echo(f"orders: {hi - 1}/{orders} ({time.perf_counter() - started:.1f}s)")
+
+    pay = mods["payments"]
+    for lo, hi in _chunks(min(payments, orders), chunk):
+        _insert(pay.engine, pay.Payment.__table__,
+                [{"id": i, "order_id": i, "amount": totals[i][0], "method": rng.choice(METHODS),
+                  "status": rng.choice(("Pending", "Paid")),
+                  "created_at": min(now, totals[i][1] + timedelta(seconds=rng.randint(60, 3600)))}
+                 for i in range(lo, hi)])
+    echo(f"payments: {min(payments, orders)} rows ({time.perf_counter() - started:.1f}s)")
+
+    for mod in mods.values():
+        mod.engine.dispose()
+    return {"users": users, "products": products, "orders": orders, "payments": min(payments, orders)}
@@ -0,0 +1,116 @@
+"""Start / stop the four services as local processes on SQLite stand-in databases."""
+import importlib
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# name -> (port, DB env var); start order matters (orders needs users/products, payments needs orders)
+SERVICES = {
+    "users": (18001, "USERS_DB"),
+    "products": (18002, "PRODUCTS_DB"),
+    "orders": (18003, "ORDERS_DB"),
+    "payments": (18004, "PAYMENTS_DB"),
+}
+
+
+def base_url(name):
+    return f"http://127.0.0.1:{SERVICES[name][0]}"
+
+
+def service_env(data_dir):
+    """Environment shared by the seeding process and the spawned services."""
+    env = {
+        "DB_BACKEND": "sqlite",
+        "SQLITE_DIR": os.path.abspath(data_dir),
+        "USERS_BASE": base_url("users"),
+        "PRODUCTS_BASE": base_url("products"),
+        "ORDERS_BASE": base_url("orders"),
+        "EVENT_SUBSCRIBERS": f"{base_url('orders')}/events",
+        "TRACE_EXPORT": os.getenv("TRACE_EXPORT", "off"),
+        "FLASK_DEBUG": "0",
+    }
+    for name, (_port, db_var) in SERVICES.items():
+        env[db_var] = f"bench_{name}"
+    return env
+
+
+def import_service(name):
+    """Import a service module in this process (used for its table definitions)."""
+    for path in (ROOT, os.path.join(ROOT, name)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return importlib.import_module(name)
+
+
+class Stack:
+    """The services running as subprocesses (gunicorn, or the dev server with server="dev")."""
+
+    def __init__(self, data_dir, server="gunicorn", workers=2, threads=4, log_dir=None):
+        self.data_dir = data_dir
+        self.server = server
+        self.workers = workers
+        self.threads = threads
+        self.log_dir = log_dir or tempfile.mkdtemp(prefix="bench-logs-")
+        self.procs = {}
+
+    def _command(self, name, port):
+        if self.server == "dev":
+            return [sys.executable, f"{name}.py"]
+        return [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "common", "gunicorn_conf.py"),
+                "--bind", f"127.0.0.1:{port}", f"{name}:app"]
+
+    def start(self, timeout=60):
+        base_env = dict(os.environ, **service_env(self.data_dir))
+        base_env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, base_env.get("PYTHONPATH")]))
+        for name, (port, _db_var) in SERVICES.items():
+            env = dict(base_env,
+                       **{f"{name.upper()}_PORT": str(port),
+                          "GUNICORN_WORKERS": str(self.workers),
+                          "GUNICORN_THREADS": str(self.threads),
+                          "PROMETHEUS_MULTIPROC_DIR": tempfile.mkdtemp(prefix=f"bench-prom-{name}-")})
+            log = open(os.path.join(self.log_dir, f"{name}.log"), "w")
+            self.procs[name] = subprocess.Popen(self._command(name, port), cwd=os.path.join(ROOT, name),
+                                                env=env, stdout=log, stderr=subprocess.STDOUT)
+            self._wait_ready(name, timeout)
+
+    def _wait_ready(self, name, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.procs[name].poll() is not None:
+                raise RuntimeError(f"{name} exited during startup, see {self.log_dir}/{name}.log")
+            try:
+                if requests.get(f"{base_url(name)}/readyz", timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{name} not ready after {timeout}s, see {self.log_dir}/{name}.log")
+
+    def stop(self):
+        for proc in self.procs.values():
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self.procs.clear()
+
+    def __enter__(self):
+        try:
+            self.start()
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
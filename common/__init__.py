@@ -0,0 +1 @@
+"""Shared building blocks for the users, products, orders and payments services."""
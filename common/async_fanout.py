@@ -0,0 +1,162 @@
+"""Shared asyncio event loop + per-upstream async HTTP clients for fan-out calls.
+
+Sync Flask handlers hand a coroutine to ``run(coro, timeout)``; it executes on a
+single background event loop, so many outstanding HTTP calls cost no OS threads.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+
+import aiohttp
+
+from common import tracing
+from common.breaker import CircuitOpenError
+from common.http_client import ETagStore
+from common.metrics import observe_upstream
+
+
+async def _in_context(ctx, coro):
+    # Tasks start from the loop thread's context: adopt the caller's values
+    # (trace / request id) so they follow the coroutine and its child tasks.
+    for var, value in ctx.items():
+        var.set(value)
+    return await coro
+
+
+class LoopThread:
+    """An asyncio event loop running forever in a daemon thread."""
+
+    def __init__(self, name="fanout-loop"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout=None):
+        """Run ``coro`` on the loop and block the calling thread for its result."""
+        future = asyncio.run_coroutine_threadsafe(
+            _in_context(contextvars.copy_context(), coro), self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+
+_loop_thread = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+def get_loop_thread():
+    """Process-wide loop, created on first use (and re-created after a fork)."""
+    global _loop_thread, _loop_pid
+    if _loop_thread is None or _loop_pid != os.getpid():
+        with _loop_lock:
+            if _loop_thread is None or _loop_pid != os.getpid():
+                _loop_thread = LoopThread()
+                _loop_pid = os.getpid()
+    return _loop_thread
+
+def run(coro, timeout=None):
+    return get_loop_thread().run(coro, timeout)
+
+
+class AsyncUpstream:
+    """aiohttp client for one upstream with a cap on in-flight requests.
+
+    With a ``breaker``, calls raise CircuitOpenError while the upstream is down;
+    connection errors, timeouts and 5xx responses count as failures.
+    ``get_json(..., conditional=True)`` revalidates with the last ETag (see
+    http_client.ETagStore); a 304 returns (200, stored JSON).
+    """
+
+    def __init__(self, name, base_url, timeout=2.0, connect_timeout=0.5,
+                 max_in_flight=32, pool_size=20, breaker=None):
+        self.name = name
+        self.breaker = breaker
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.max_in_flight = max_in_flight
+        self.pool_size = pool_size
+        self._session = None
+        self._semaphore = None
+        self.etags = ETagStore()
+
+    def _ensure_session(self):
+        # Session and semaphore must be created on the loop that uses them.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._session
+
+    async def get_json(self, path, params=None, headers=None, conditional=False):
+        """GET base_url/path; return (status, parsed JSON or None)."""
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpenError(self.breaker.name)
+        try:
+            result = await self._get_json(path, params, headers, conditional)
+        except Exception:
+            # Bad JSON included: the upstream answered wrong
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled (ENRICH_DEADLINE, shutdown): says nothing about the upstream,
+            # but a half-open probe must still give its slot back
+            if self.breaker is not None:
+                self.breaker.release()
+            raise
+        if self.breaker is not None:
+            if result[0] >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        return result
+
+    async def _get_json(self, path, params, headers, conditional):
+        session = self._ensure_session()
+        key = ETagStore.key(path, params) if conditional else None
+        etag = self.etags.etag(key) if conditional else None
+        if etag:
+            headers = dict(headers or {}, **{"If-None-Match": etag})
+        started = None
+        try:
+            async with self._semaphore:
+                # Timed from acquiring a slot, so the histogram shows upstream latency, not local queueing
+                started = time.perf_counter()
+                with tracing.span(f"GET {self.name}", kind="client", upstream=self.name, path=path) as span:
+                    span["status"] = "error"
+                    async with session.get(f"{self.base_url}/{path.lstrip('/')}", params=params,
+                                           headers=tracing.outbound_headers(headers)) as resp:
+                        span["status"] = resp.status
+                        stored = self.etags.hit(key) if resp.status == 304 and etag else None
+                        if stored is not None:
+                            result = 200, stored
+                        elif resp.status != 200:
+                            result = resp.status, None
+                        else:
+                            result = resp.status, await resp.json()
+                            if conditional:
+                                self.etags.store(key, resp.headers.get("ETag"), result[1])
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if started is not None:
+                observe_upstream(self.name, "GET", "error", time.perf_counter() - started)
+            raise
+        observe_upstream(self.name, "GET", result[0], time.perf_counter() - started)
+        return result
+
+
+def async_upstream_from_env(name, default_base, breaker=None):
+    """Build an AsyncUpstream configured by <NAME>_BASE / _TIMEOUT / _CONNECT_TIMEOUT / _MAX_IN_FLIGHT / _POOL_SIZE."""
+    prefix = name.upper()
+    return AsyncUpstream(
+        name,
+        os.getenv(f"{prefix}_BASE", default_base),
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", 2.0)),
+        connect_timeout=float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", 0.5)),
+        max_in_flight=int(os.getenv(f"{prefix}_MAX_IN_FLIGHT", 32)),
+        pool_size=int(os.getenv(f"{prefix}_POOL_SIZE", 20)),
+        breaker=breaker,
+    )
@@ -0,0 +1,128 @@
+"""Per-upstream circuit breaker (closed -> open -> half-open -> closed)."""
+import os
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, name):
+        super().__init__(f"circuit '{name}' is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures.
+
+    While open, calls fail fast. After ``recovery_timeout`` seconds the breaker
+    goes half-open and lets up to ``half_open_max_calls`` probe calls through:
+    a successful probe closes it, a failed one re-opens it. A call that ends
+    without an outcome (cancelled) gives its slot back with ``release()``; a
+    probe that never reports back at all (caller killed between allow() and
+    record_*) frees its slot after ``probe_timeout`` seconds (default:
+    ``recovery_timeout``).
+
+    State is per process: each gunicorn worker / replica trips on its own
+    failures, which is fine for fail-fast (an outage trips all of them within
+    ``failure_threshold`` calls each) and needs no shared store.
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=10.0, half_open_max_calls=1,
+                 probe_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.probe_timeout = recovery_timeout if probe_timeout is None else probe_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_started = 0.0
+        self._rejected = 0
+        self._transitions = {}
+        self._lock = threading.Lock()
+
+    def _set_state(self, new_state):
+        """Caller holds the lock."""
+        if new_state == self._state:
+            return
+        key = f"{self._state}->{new_state}"
+        self._transitions[key] = self._transitions.get(key, 0) + 1
+        self._state = new_state
+        if new_state == OPEN:
+            self._opened_at = time.monotonic()
+        self._probes = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                self._set_state(HALF_OPEN)
+            return self._state
+
+    def allow(self):
+        """Return True if a call may go to the upstream now."""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    self._rejected += 1
+                    return False
+                self._set_state(HALF_OPEN)
+            if self._state == HALF_OPEN:
+                now = time.monotonic()
+                if self._probes >= self.half_open_max_calls:
+                    if now - self._probe_started < self.probe_timeout:
+                        self._rejected += 1
+                        return False
+                    self._probes = 0  # the outstanding probes are lost: hand out new ones
+                self._probes += 1
+                self._probe_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._set_state(CLOSED)
+
+    def release(self):
+        """The call allowed last ended without saying anything about the upstream (cancelled)."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._set_state(OPEN)
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": state,
+                "consecutive_failures": self._failures,
+                "rejected": self._rejected,
+                "transitions": dict(self._transitions),
+                "failure_threshold": self.failure_threshold,
+                "recovery_timeout": self.recovery_timeout,
+            }
+
+
+def breaker_from_env(name):
+    """Build a CircuitBreaker configured by <NAME>_BREAKER_FAILURES / _BREAKER_RESET / _BREAKER_PROBES / _BREAKER_PROBE_TIMEOUT."""
+    prefix = name.upper()
+    return CircuitBreaker(
+        name,
+        failure_threshold=int(os.getenv(f"{prefix}_BREAKER_FAILURES", 5)),
+        recovery_timeout=float(os.getenv(f"{prefix}_BREAKER_RESET", 10)),
+        half_open_max_calls=int(os.getenv(f"{prefix}_BREAKER_PROBES", 1)),
+        probe_timeout=float(os.getenv(f"{prefix}_BREAKER_PROBE_TIMEOUT", os.getenv(f"{prefix}_BREAKER_RESET", 10))),
+    )
@@ -0,0 +1,195 @@
+"""Streaming bulk import: an NDJSON or CSV request body in, a per-row report out.
+
+- The body is read line by line (never held whole). NDJSON: one JSON object
+  per line; CSV: a header row naming the columns. Picked from Content-Type
+  (application/x-ndjson, text/csv) or ?format=ndjson|csv.
+- The service validates each row; valid rows are inserted IMPORT_CHUNK_SIZE
+  (1000) at a time, one multi-row INSERT and one transaction per chunk.
+- A chunk that violates a constraint (duplicate id / email) is split in
+  halves until the offending rows are isolated, so the rest still gets in.
+- Memory stays bounded by one chunk plus MAX_REPORTED_ERRORS error entries.
+
+Chunks already committed stay committed if a later one fails for another
+reason (database down): the report says how far the import got.
+"""
+import csv
+import json
+import logging
+import os
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+from common.db import identity_insert
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 1000))
+MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", 1000))
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+CSV_TYPES = ("text/csv",)
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+class ImportFormatError(ValueError):
+    """The body is neither NDJSON nor CSV (answered with 415)."""
+
+
+# ---- Reading ----
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def _lines(stream):
+    # Block reads split here: much cheaper than readline() per row on the WSGI stream
+    tail = b""
+    while True:
+        block = stream.read(READ_BLOCK_SIZE)
+        if not block:
+            break
+        lines = (tail + block).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if tail:
+        yield tail
+
+
+def _ndjson_records(stream):
+    for line_no, raw in enumerate(_lines(stream), 1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            record = _loads(raw)
+        except ValueError:
+            yield line_no, None, "Invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "Each line must be a JSON object"
+            continue
+        yield line_no, record, None
+
+
+def _csv_records(stream):
+    # utf-8-sig: Excel puts a BOM in front of the header
+    lines = (raw.decode("utf-8-sig") for raw in _lines(stream))
+    reader = csv.DictReader(lines)
+    try:
+        for record in reader:
+            if None in record:
+                yield reader.line_num, None, "Too many columns"
+                continue
+            yield reader.line_num, record, None
+    except csv.Error as e:
+        yield reader.line_num, None, f"Invalid CSV: {e}"
+
+
+def read_records(req):
+    """(line number, record dict or None, error or None) for each row of the body."""
+    fmt = (req.args.get("format") or "").lower()
+    mimetype = req.mimetype
+    if fmt == "ndjson" or (not fmt and mimetype in NDJSON_TYPES):
+        return _ndjson_records(req.stream)
+    if fmt == "csv" or (not fmt and mimetype in CSV_TYPES):
+        return _csv_records(req.stream)
+    raise ImportFormatError("Body must be NDJSON (application/x-ndjson) or CSV (text/csv)")
+
+
+# ---- Writing ----
+def insert_rows(session, model, rows, returning):
+    """Multi-row INSERT of ``rows`` (dicts); returns their ``returning`` columns.
+
+    Rows with an explicit "id" go in a second statement, with identity insert.
+    """
+    # Core insert on the table: executemany / multi-row VALUES without ORM bookkeeping
+    stmt = insert(model.__table__).returning(*returning)
+    generated = [row for row in rows if "id" not in row]
+    explicit = [row for row in rows if "id" in row]
+    inserted = session.execute(stmt, generated).all() if generated else []
+    if explicit:
+        with identity_insert(session, model.__tablename__):
+            inserted += session.execute(stmt, explicit).all()
+    return inserted
+
+
+class ImportReport:
+    def __init__(self, max_errors=MAX_REPORTED_ERRORS):
+        self.max_errors = max_errors
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.aborted = None
+
+    def fail(self, line, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "error": message})
+
+    def to_dict(self):
+        result = {"imported": self.imported, "failed": self.failed, "errors": self.errors,
+                  "errors_truncated": self.failed > len(self.errors)}
+        if self.aborted:
+            result["aborted"] = self.aborted
+        return result
+
+
+def run_import(Session, records, validate, write_chunk, describe_conflict,
+               after_commit=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import ``records`` (from ``read_records``); returns an ImportReport.
+
+    ``validate(record)`` returns the values to insert or raises ValueError
+    with the message for the report. ``write_chunk(session, values_list)``
+    inserts them (no commit) and returns the inserted rows, handed to
+    ``after_commit(rows)`` once committed. ``describe_conflict(error)`` turns
+    an IntegrityError of a single row into its report message.
+    """
+    report = ImportReport()
+    session = Session()
+
+    def flush(chunk):
+        try:
+            rows = write_chunk(session, [values for _line, values in chunk])
+            session.commit()
+        except IntegrityError as e:
+            session.rollback()
+            if len(chunk) == 1:
+                report.fail(chunk[0][0], describe_conflict(e))
+                return
+            # Halve until the conflicting rows are alone; the others are retried in smaller chunks
+            middle = len(chunk) // 2
+            flush(chunk[:middle])
+            flush(chunk[middle:])
+            return
+        report.imported += len(chunk)
+        if after_commit is not None:
+            after_commit(rows)
+
+    try:
+        chunk = []
+        for line, record, error in records:
+            if error is None:
+                try:
+                    chunk.append((line, validate(record)))
+                except (ValueError, TypeError) as e:
+                    error = str(e) or "Invalid data format"
+            if error is not None:
+                report.fail(line, error)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    except DBAPIError as e:
+        session.rollback()
+        logger.warning("bulk import aborted", exc_info=True)
+        report.aborted = str(getattr(e, "orig", e))
+    finally:
+        session.close()
+    return report
@@ -0,0 +1,219 @@
+"""Bounded, thread-safe LRU cache with TTL, negative caching and single-flight loads."""
+import threading
+import time
+from collections import OrderedDict
+
+from common.metrics import count_cache
+
+MISSING = object()
+
+
+class _Flight:
+    """A load in progress for one key; other threads wait on it instead of refetching."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """LRU + TTL cache.
+
+    - ``maxsize`` bounds the number of entries; the least recently used entry is
+      evicted first.
+    - ``ttl`` applies to normal values, ``negative_ttl`` to ``None`` (not found).
+    - ``get_many`` deduplicates concurrent misses: if another thread is already
+      loading a key, the caller waits for that result instead of calling the
+      loader again.
+    - ``get_stale`` returns the last known value even after it expired, for
+      degraded responses when the source is unavailable.
+    """
+
+    def __init__(self, maxsize=10000, ttl=30, negative_ttl=10, name="cache"):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()  # key -> (expiry, value)
+        self._inflight = {}         # key -> _Flight
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._coalesced = 0
+        self._stale_hits = 0
+
+    # ---- basic operations ----
+    def _lookup(self, key, now):
+        """Return the cached value or MISSING. Caller holds the lock."""
+        entry = self._data.get(key)
+        if entry is None:
+            return MISSING
+        expiry, value = entry
+        if now > expiry:
+            # Expired entries are kept until evicted or refreshed so that
+            # get_stale() can still serve them while an upstream is down.
+            self._expirations += 1
+            count_cache(self.name, "expiration")
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _store(self, key, value, ttl, now):
+        """Insert/replace an entry and evict LRU entries. Caller holds the lock."""
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        self._data[key] = (now + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self._evictions += 1
+            count_cache(self.name, "eviction")
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key, time.monotonic())
+            if value is MISSING:
+                self._misses += 1
+                count_cache(self.name, "miss")
+                return default
+            self._hits += 1
+            count_cache(self.name, "hit")
+            return value
+
+    def get_stale(self, key, default=None):
+        """Return the cached value ignoring expiry (``default`` if never cached)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            self._stale_hits += 1
+            count_cache(self.name, "stale")
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl, time.monotonic())
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    # ---- batch load with single-flight ----
+    def get_many(self, keys, loader, timeout=None):
+        """Return {key: value} for ``keys``.
+
+        Missing keys owned by this call are passed to ``loader(list_of_keys)``,
+        which returns a dict; keys absent from that dict are cached as ``None``.
+        Keys already being loaded by another thread are awaited instead.
+        """
+        result, owned, pending = self.reserve(keys)
+
+        if owned:
+            try:
+                loaded = loader(list(owned)) or {}
+            except BaseException as e:
+                self.abandon(owned, e)
+                raise
+            self.fulfil(owned, loaded)
+            for key in owned:
+                result[key] = loaded.get(key)
+
+        result.update(self.wait(pending, timeout))
+        return result
+
+    # The three steps of get_many are public so callers that load on their own
+    # (e.g. an asyncio fan-out) keep the same single-flight guarantees.
+    def reserve(self, keys):
+        """Split keys into (hits, keys this caller must load, flights to wait on).
+
+        Every key returned as "owned" must later be passed to ``fulfil`` or
+        ``abandon``, otherwise other callers wait on it forever.
+        """
+        hits, owned, pending = {}, [], {}
+        misses = 0
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if key in hits or key in pending or key in owned:
+                    continue
+                value = self._lookup(key, now)
+                if value is not MISSING:
+                    self._hits += 1
+                    hits[key] = value
+                    continue
+                self._misses += 1
+                misses += 1
+                flight = self._inflight.get(key)
+                if flight is not None:
+                    self._coalesced += 1
+                    pending[key] = flight
+                else:
+                    self._inflight[key] = _Flight()
+                    owned.append(key)
+        count_cache(self.name, "hit", len(hits))
+        count_cache(self.name, "miss", misses)
+        count_cache(self.name, "coalesced", len(pending))
+        return hits, owned, pending
+
+    def fulfil(self, owned, loaded):
+        """Cache loaded values for owned keys (absent -> None) and wake waiters."""
+        now = time.monotonic()
+        with self._lock:
+            for key in owned:
+                value = loaded.get(key)
+                self._store(key, value, None, now)
+                flight = self._inflight.pop(key, None)
+                if flight is not None:
+                    flight.value = value
+                    flight.event.set()
+
+    def abandon(self, owned, error):
+        """Release owned keys without caching; waiters receive ``error``."""
+        with self._lock:
+            for key in owned:
+                flight = self._inflight.pop(key, None)
+                if flight is not None:
+                    flight.error = error
+                    flight.event.set()
+
+    def wait(self, pending, timeout=None):
+        """Wait for flights returned by ``reserve``; return {key: value}."""
+        result = {}
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for key, flight in pending.items():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not flight.event.wait(remaining):
+                raise TimeoutError(f"{self.name}: timed out waiting for {key!r}")
+            if flight.error is not None:
+                raise flight.error
+            result[key] = flight.value
+        return result
+
+    # ---- monitoring ----
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "negative_ttl": self.negative_ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "coalesced": self._coalesced,
+                "stale_hits": self._stale_hits,
+                "inflight": len(self._inflight),
+            }
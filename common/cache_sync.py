@@ -0,0 +1,101 @@
+"""Keep per-process caches in step across gunicorn workers and replicas.
+
+A change event is delivered to a single process (one worker of one replica
+behind the load balancer). That process records the new value in a table of
+the service's own database; every process polls the table and applies rows it
+has not seen yet to its local caches, so all of them converge within
+``interval`` seconds. Only the newest ``keep_rows`` rows are kept.
+
+Best effort, like the events themselves: a row missed by a poll (DB error,
+commit reordering) is still bounded by the caches' TTL.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import func
+
+logger = logging.getLogger(__name__)
+
+
+class CacheSync:
+    def __init__(self, Session, model, caches, interval=1.0, keep_rows=10000, batch=500, after_poll=None):
+        # model: table with id (autoincrement), cache (name in ``caches``), entity_id, value (JSON or NULL)
+        # after_poll: optional callable run by the poller thread after each poll (housekeeping)
+        self.Session = Session
+        self.model = model
+        self.caches = caches
+        self.interval = interval
+        self.keep_rows = keep_rows
+        self.batch = batch
+        self.after_poll = after_poll
+        self.last_id = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.applied = 0
+        self.errors = 0
+
+    def record(self, session, cache_name, entity_id, value):
+        """Apply a change here and queue it for the other processes (committed with ``session``)."""
+        self.caches[cache_name].set(entity_id, value)
+        session.add(self.model(cache=cache_name, entity_id=entity_id,
+                               value=None if value is None else json.dumps(value)))
+
+    def ensure_started(self):
+        # Started lazily so each (forked) worker process polls for itself.
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self.last_id = None
+                    self._thread = threading.Thread(target=self._run, name="cache-sync", daemon=True)
+                    self._pid = os.getpid()
+                    self._thread.start()
+
+    def init_app(self, app):
+        app.before_request(self.ensure_started)
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                self.errors += 1
+                logger.warning("cache sync poll failed", exc_info=True)
+            if self.after_poll is not None:
+                try:
+                    self.after_poll()
+                except Exception:
+                    logger.warning("cache sync after_poll hook failed", exc_info=True)
+            time.sleep(self.interval)
+
+    def poll(self):
+        """Apply rows newer than the last one seen; returns how many were applied."""
+        m = self.model
+        session = self.Session()
+        try:
+            if self.last_id is None:
+                # New process: its caches are empty, only later changes matter
+                self.last_id = session.query(func.max(m.id)).scalar() or 0
+                return 0
+            rows = (session.query(m.id, m.cache, m.entity_id, m.value)
+                    .filter(m.id > self.last_id).order_by(m.id).limit(self.batch).all())
+            for row in rows:
+                cache = self.caches.get(row.cache)
+                if cache is not None:
+                    cache.set(row.entity_id, json.loads(row.value) if row.value is not None else None)
+                self.last_id = row.id
+            self.applied += len(rows)
+            if rows and self.last_id % self.keep_rows < len(rows):
+                # Roughly once per keep_rows changes: drop rows every process has long applied
+                session.query(m).filter(m.id <= self.last_id - self.keep_rows).delete(synchronize_session=False)
+                session.commit()
+            return len(rows)
+        finally:
+            session.close()
+
+    def stats(self):
+        return {"last_id": self.last_id, "applied": self.applied, "errors": self.errors,
+                "interval": self.interval}
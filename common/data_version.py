@@ -0,0 +1,47 @@
+"""A version number for a service's data, shared by every process through one table row.
+
+Writes call ``bump(session)`` inside their own transaction, so the version
+moves exactly when the change is committed. ``responses.init_app(...,
+version=data_version.current)`` turns it into the ETag (and X-Data-Version
+header) of every cached GET: a client revalidating with If-None-Match gets a
+304 after a single-row read while nothing was written, and the gateway puts
+the version in its cache key, so after a write nobody is served the old entry.
+
+The row is a hot spot on purpose: concurrent writers queue on it for the
+length of their transaction, which suits low-rate data such as the catalog.
+"""
+from sqlalchemy.exc import IntegrityError
+
+
+class DataVersion:
+    def __init__(self, Session, model, name):
+        # model: table with name (primary key) and version (integer)
+        self.Session = Session
+        self.model = model
+        self.name = name
+
+    def ensure(self, session):
+        """Create the row if it is missing (run by `flask migrate`)."""
+        m = self.model
+        if session.query(m.version).filter(m.name == self.name).first() is not None:
+            return
+        session.add(m(name=self.name, version=0))
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()  # another replica created it first
+
+    def bump(self, session):
+        """Advance the version; committed (or rolled back) with the caller's write."""
+        m = self.model
+        updated = (session.query(m).filter(m.name == self.name)
+                   .update({m.version: m.version + 1}, synchronize_session=False))
+        if not updated:
+            session.add(m(name=self.name, version=1))
+
+    def current(self):
+        session = self.Session()
+        try:
+            return session.query(self.model.version).filter(self.model.name == self.name).scalar() or 0
+        finally:
+            session.close()
@@ -0,0 +1,314 @@
+"""Database bootstrap and a tunable, instrumented connection pool shared by all services.
+
+Backend: DB_BACKEND=mssql (default, DB_USER / DB_PASSWORD / DB_HOST / DB_PORT)
+or DB_BACKEND=sqlite (one <db name>.db file per service in SQLITE_DIR, WAL
+mode); DB_URL_TEMPLATE ("sqlite:////data/{database}.db") overrides both.
+
+Pool settings come from the environment (SQL Server / SQLite defaults):
+  DB_POOL_SIZE (5 / 8), DB_MAX_OVERFLOW (10 / 0), DB_POOL_RECYCLE (1800 s / off),
+  DB_POOL_TIMEOUT (30 s), DB_POOL_PRE_PING (true / false), DB_CONNECT_TIMEOUT (5 s)
+
+SQLite pragmas set on every new connection:
+  SQLITE_JOURNAL_MODE (WAL), SQLITE_SYNCHRONOUS (NORMAL), SQLITE_BUSY_TIMEOUT (5000 ms),
+  SQLITE_CACHE_KB (65536), SQLITE_MMAP_SIZE (256 MiB), temp_store=MEMORY
+
+Importing a service only builds its engine (no connection is opened).
+Creating the database and tables is a separate step: `flask --app <service> migrate`.
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event, inspect, text, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
+from sqlalchemy.schema import CreateColumn
+
+from common import tracing
+from common.metrics import instrument_engine
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def pool_settings_from_env(dialect="mssql"):
+    # A local SQLite file has no server-side idle timeout or dropped sockets, and
+    # only one writer at a time: no recycling, no pings, no overflow connections.
+    sqlite = dialect == "sqlite"
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 8 if sqlite else 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 0 if sqlite else 10)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", -1 if sqlite else 1800)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", not sqlite),
+    }
+
+
+def sqlite_pragmas():
+    return {
+        "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)),
+        "cache_size": -int(os.getenv("SQLITE_CACHE_KB", 65536)),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+        "temp_store": "MEMORY",
+    }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.checkout_timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                if waited > self.wait_max:
+                    self.wait_max = waited
+
+
+def pool_stats(engine):
+    """Pool occupancy and checkout wait times for monitoring endpoints."""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        # e.g. StaticPool / NullPool: no size or overflow to report
+        return {"pool_class": type(pool).__name__}
+    size = pool.size()
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    capacity = size + max(max_overflow, 0)
+    checked_out = pool.checkedout()
+    stats = {
+        "pool_class": type(pool).__name__,
+        "pool_size": size,
+        "max_overflow": max_overflow,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "saturation": round(checked_out / capacity, 4) if capacity else None,
+    }
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            stats.update({
+                "checkouts": pool.checkouts,
+                "checkout_timeouts": pool.checkout_timeouts,
+                "checkout_wait_avg_ms": round(pool.wait_total / pool.checkouts * 1000, 3) if pool.checkouts else 0.0,
+                "checkout_wait_max_ms": round(pool.wait_max * 1000, 3),
+            })
+    return stats
+
+
+def server_url(database):
+    user = os.getenv("DB_USER")
+    password = os.getenv("DB_PASSWORD")
+    host = os.getenv("DB_HOST")
+    port = os.getenv("DB_PORT")
+    return f"mssql+pymssql://{user}:{password}@{host}:{port}/{database}"
+
+
+def connect_args():
+    # Fail fast instead of pymssql's 60 s default login timeout.
+    return {"login_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", 5))}
+
+
+def ensure_database(db_name, timeout=None):
+    """CREATE DATABASE if missing, retrying with capped exponential backoff while SQL Server starts.
+
+    Delays go 0.5 s, 1 s, 2 s ... up to DB_BOOTSTRAP_MAX_DELAY (10 s), with
+    jitter; gives up after DB_BOOTSTRAP_TIMEOUT (120 s) in total.
+    """
+    timeout = timeout if timeout is not None else float(os.getenv("DB_BOOTSTRAP_TIMEOUT", 120))
+    base_delay = float(os.getenv("DB_BOOTSTRAP_BASE_DELAY", 0.5))
+    max_delay = float(os.getenv("DB_BOOTSTRAP_MAX_DELAY", 10))
+    deadline = time.monotonic() + timeout
+
+    master_engine = create_engine(server_url("master"), isolation_level="AUTOCOMMIT",
+                                  connect_args=connect_args(), poolclass=NullPool)
+    attempt = 0
+    try:
+        while True:
+            attempt += 1
+            try:
+                with master_engine.connect() as conn:
+                    conn.execute(text(f"IF NOT EXISTS (SELECT name FROM sys.databases WHERE name = N'{db_name}') CREATE DATABASE [{db_name}]"))
+                print(f"Database '{db_name}' is ready.")
+                return
+            except exc.SQLAlchemyError as e:
+                delay = min(max_delay, base_delay * (2 ** (attempt - 1)))
+                delay = random.uniform(delay / 2, delay)
+                if time.monotonic() + delay > deadline:
+                    raise Exception(f"Không thể tạo hoặc kết nối đến database {db_name}") from e
+                print(f"Error creating database (hoặc DB chưa sẵn sàng) [attempt {attempt}, retry in {delay:.1f}s]: {e}")
+                time.sleep(delay)
+    finally:
+        master_engine.dispose()
+
+
+_engines = []
+
+def database_url(db_name):
+    template = os.getenv("DB_URL_TEMPLATE")
+    if template:
+        return template.format(database=db_name)
+    if os.getenv("DB_BACKEND", "mssql").lower() == "sqlite":
+        directory = os.path.abspath(os.getenv("SQLITE_DIR", "."))
+        return "sqlite:///" + os.path.join(directory, f"{db_name}.db")
+    return server_url(db_name)
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _sqlite_on_connect(engine):
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def make_engine(db_name):
+    """Engine for the service database with the pool configured from the environment.
+
+    Lazy: no connection is opened until first use.
+    """
+    url = make_url(database_url(db_name))
+    backend = url.get_backend_name()
+    if _is_memory_sqlite(url):
+        # one shared connection, otherwise every connection sees its own empty database
+        engine = create_engine(url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    else:
+        kwargs = pool_settings_from_env(backend)
+        if backend == "mssql":
+            kwargs["connect_args"] = connect_args()
+        elif backend == "sqlite":
+            kwargs["connect_args"] = {"check_same_thread": False}
+        engine = create_engine(url, poolclass=TimedQueuePool, **kwargs)
+    if backend == "sqlite":
+        _sqlite_on_connect(engine)
+    instrument_engine(engine)
+    tracing.instrument_engine(engine)
+    _engines.append(engine)
+    return engine
+
+
+def dispose_engines():
+    """Give a freshly forked worker its own empty pools.
+
+    close=False leaves the parent's connections alone (they belong to the
+    master process); the child simply forgets them and opens its own.
+    """
+    for engine in _engines:
+        engine.dispose(close=False)
+
+
+def migrate(engine, db_name, metadata):
+    """Create the database (if needed), any missing tables, and columns / indexes added to existing tables."""
+    if engine.dialect.name == "mssql":
+        ensure_database(db_name)
+    elif engine.dialect.name == "sqlite" and not _is_memory_sqlite(engine.url):
+        os.makedirs(os.path.dirname(os.path.abspath(engine.url.database)), exist_ok=True)
+    try:
+        metadata.create_all(engine)
+    except exc.DBAPIError:
+        # Replicas migrate at the same time: another one created a table between check and CREATE
+        metadata.create_all(engine)
+    add_missing_columns(engine, metadata)
+    # create_all skips tables that already exist, so indexes declared later are added here.
+    # A unique index over duplicate data fails: the error names the index.
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except exc.DBAPIError:
+                index.create(engine, checkfirst=True)  # same race as above
+
+
+def add_missing_columns(engine, metadata):
+    """ALTER TABLE ... ADD for nullable columns declared after their table was created.
+
+    Existing rows get NULL. Anything else (NOT NULL, server defaults, type
+    changes) needs a hand-written migration.
+    """
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable or column.server_default is not None:
+                continue
+            ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            try:
+                with engine.begin() as connection:
+                    # "ADD <column>" (no COLUMN keyword) is valid on both SQL Server and SQLite
+                    connection.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD {ddl}"))
+            except exc.DBAPIError:
+                # Another replica added it first
+                if column.name not in {c["name"] for c in inspect(engine).get_columns(table.name)}:
+                    raise
+
+
+def violated_constraint(error, *names):
+    """First of ``names`` (index / constraint name or table.column) an IntegrityError mentions.
+
+    SQL Server reports the index name ("... unique index 'uq_users_email'"),
+    SQLite the column ("UNIQUE constraint failed: users.email").
+    """
+    message = str(getattr(error, "orig", error))
+    for name in names:
+        if name in message:
+            return name
+    return None
+
+
+@contextmanager
+def identity_insert(session, table):
+    """Let the session insert explicit ids into ``table``'s identity column.
+
+    SQL Server needs SET IDENTITY_INSERT around the INSERT (flushed inside the
+    block); SQLite accepts explicit ids as is. The caller commits.
+    """
+    if session.get_bind().dialect.name != "mssql":
+        yield
+        session.flush()
+        return
+    connection = session.connection()
+    session.execute(text(f"SET IDENTITY_INSERT {table} ON"))
+    try:
+        yield
+        session.flush()
+    except BaseException:
+        # The setting is per connection and survives a rollback: don't hand
+        # this connection back to the pool with it still ON.
+        connection.invalidate()
+        raise
+    session.execute(text(f"SET IDENTITY_INSERT {table} OFF"))
@@ -0,0 +1,80 @@
+"""Fire-and-forget change notifications between services.
+
+A service publishes small JSON events (e.g. {"type": "user.upserted", ...});
+a background thread POSTs them to every URL listed in EVENT_SUBSCRIBERS.
+Publishing never blocks or fails the request that triggered it.
+"""
+import os
+import queue
+import threading
+
+import requests
+
+from common import tracing
+
+
+class EventPublisher:
+    def __init__(self, subscribers, max_queue=10000, timeout=2.0, retries=2):
+        self.subscribers = [url for url in subscribers if url]
+        self.timeout = timeout
+        self.retries = retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._session = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _ensure_worker(self):
+        # Started lazily so each (forked) worker process gets its own thread.
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._session = requests.Session()
+                    self._thread = threading.Thread(target=self._run, name="event-publisher", daemon=True)
+                    self._pid = os.getpid()
+                    self._thread.start()
+
+    def publish(self, event):
+        if not self.subscribers:
+            return
+        self._ensure_worker()
+        try:
+            # Headers captured now: the delivery thread has no request context
+            self._queue.put_nowait((event, tracing.outbound_headers()))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            event, headers = self._queue.get()
+            for url in self.subscribers:
+                self._deliver(url, event, headers)
+            self.published += 1
+
+    def _deliver(self, url, event, headers=None):
+        for _attempt in range(self.retries + 1):
+            try:
+                resp = self._session.post(url, json=event, headers=headers, timeout=self.timeout)
+                if resp.status_code < 500:
+                    return
+            except requests.RequestException:
+                pass
+        self.failed += 1
+
+    def stats(self):
+        return {
+            "subscribers": self.subscribers,
+            "queued": self._queue.qsize(),
+            "published": self.published,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+def publisher_from_env():
+    """Subscribers come from EVENT_SUBSCRIBERS (comma-separated URLs)."""
+    urls = [u.strip() for u in os.getenv("EVENT_SUBSCRIBERS", "").split(",")]
+    return EventPublisher(urls)
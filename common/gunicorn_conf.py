@@ -0,0 +1,59 @@
+"""Production serving settings shared by all services.
+
+    gunicorn -c common/gunicorn_conf.py --bind 0.0.0.0:5001 users:app
+
+Environment:
+  GUNICORN_WORKERS (2 * CPU + 1), GUNICORN_THREADS (4), GUNICORN_TIMEOUT (30 s),
+  GUNICORN_GRACEFUL_TIMEOUT (30 s), GUNICORN_KEEPALIVE (5 s), GUNICORN_BACKLOG (2048),
+  GUNICORN_MAX_REQUESTS (0 = never recycle workers)
+
+The app is imported once in the master (preload_app) and forked; post_fork
+throws away any pool inherited from the master so every worker opens its own
+DB connections. With PROMETHEUS_MULTIPROC_DIR set, the directory is emptied
+when the master starts and a dead worker's live gauges are dropped.
+
+Reload:
+  kill -HUP <master>   re-read this config, start new workers, stop old ones
+                       gracefully (in-flight requests finish). With preload the
+                       application code is NOT re-imported.
+  kill -USR2 <master>  start a new master + workers from the current code, then
+                       kill -QUIT the old master: zero-downtime code deploy.
+"""
+import glob
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+backlog = int(os.getenv("GUNICORN_BACKLOG", 2048))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    from common.db import dispose_engines
+    dispose_engines()
+    server.log.info("worker %s: DB pools reset after fork", worker.pid)
+
+
+def on_starting(server):
+    # Stale files from a previous run would be summed into the new counters
+    metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
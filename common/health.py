@@ -0,0 +1,50 @@
+"""Liveness / readiness checks.
+
+/healthz only says the process is up. /readyz says the service can take
+traffic: the database answers and the pool already holds warm connections.
+"""
+import os
+import threading
+
+from sqlalchemy import text
+
+from common.db import pool_stats
+
+
+class Readiness:
+    def __init__(self, engine, warm_connections=None):
+        self.engine = engine
+        self.warm_connections = warm_connections if warm_connections is not None else int(os.getenv("DB_POOL_WARM", 2))
+        self._warmed_pool = None
+        self._lock = threading.Lock()
+
+    def _warm(self):
+        """Open (then return) a few connections so the first requests don't pay for logins."""
+        pool = self.engine.pool
+        if self._warmed_pool is pool:
+            return
+        with self._lock:
+            if self._warmed_pool is pool:
+                return
+            n = self.warm_connections
+            if hasattr(pool, "size"):
+                n = min(n, pool.size())
+            conns = []
+            try:
+                for _ in range(n):
+                    conns.append(self.engine.connect())
+            finally:
+                for conn in conns:
+                    conn.close()
+            # engine.dispose() (e.g. after a worker fork) replaces the pool -> warm again
+            self._warmed_pool = pool
+
+    def check(self):
+        """Return (ready, details)."""
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            self._warm()
+        except Exception as e:
+            return False, {"status": "unavailable", "database": str(e)}
+        return True, {"status": "ready", "pool": pool_stats(self.engine)}
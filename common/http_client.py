@@ -0,0 +1,235 @@
+"""Pooled keep-alive HTTP clients for inter-service calls."""
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common import tracing
+from common.breaker import CircuitOpenError
+from common.metrics import observe_upstream
+
+RETRY_STATUSES = {502, 503, 504}
+ETAG_STORE_SIZE = int(os.getenv("HTTP_ETAG_STORE_SIZE", 2048))
+
+
+class ETagStore:
+    """Last ETag and payload per request (path + params), bounded LRU.
+
+    A conditional GET sends the stored ETag as If-None-Match; on 304 the
+    caller gets the stored payload back without the body crossing the wire.
+    """
+
+    def __init__(self, maxsize=ETAG_STORE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (etag, payload)
+        self._lock = threading.Lock()
+        self.revalidated = 0
+        self.refetched = 0
+
+    @staticmethod
+    def key(path, params):
+        return path, tuple(sorted((params or {}).items()))
+
+    def etag(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[0] if entry else None
+
+    def hit(self, key):
+        """Payload for a 304 answer (None if it was evicted meanwhile)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            self.revalidated += 1
+            return entry[1]
+
+    def store(self, key, etag, payload):
+        with self._lock:
+            self.refetched += 1
+            if not etag:
+                self._data.pop(key, None)
+                return
+            self._data[key] = (etag, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "maxsize": self.maxsize,
+                    "revalidated": self.revalidated, "refetched": self.refetched}
+
+
+class ServiceClient:
+    """HTTP client bound to one upstream service.
+
+    Keeps a long-lived ``requests.Session`` so TCP connections are reused, and
+    retries idempotent GETs on connection errors / 502-504 with jittered
+    exponential backoff. With a ``breaker``, calls fail fast with
+    CircuitOpenError while the upstream is considered down.
+    ``get(..., conditional=True)`` revalidates with the last ETag seen for the
+    same path + params (If-None-Match); a 304 returns the stored response.
+    """
+
+    def __init__(self, name, base_url, timeout=2.0, connect_timeout=0.5,
+                 retries=2, backoff=0.05, max_backoff=0.5, pool_size=20, breaker=None):
+        self.name = name
+        self.breaker = breaker
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.etags = ETagStore()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _sleep_before_retry(self, attempt):
+        # "Full jitter": random delay in [0, backoff * 2^attempt], capped.
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt))))
+
+    def _check_breaker(self):
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpenError(self.breaker.name)
+
+    def _record(self, resp):
+        if self.breaker is None:
+            return
+        if resp is None or resp.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _guarded(self, call):
+        # Every outcome is recorded, whatever the exception (decode errors,
+        # ChunkedEncodingError...): a half-open probe must always give its slot
+        # back. Interrupts say nothing about the upstream: slot back, no failure.
+        self._check_breaker()
+        try:
+            resp = call()
+        except Exception:
+            self._record(None)
+            raise
+        except BaseException:
+            if self.breaker is not None:
+                self.breaker.release()
+            raise
+        self._record(resp)
+        return resp
+
+    def get(self, path, params=None, headers=None, timeout=None, conditional=False):
+        if not conditional:
+            return self._guarded(lambda: self._get(path, params, headers, timeout))
+        key = ETagStore.key(path, params)
+        etag = self.etags.etag(key)
+        if etag:
+            headers = dict(headers or {}, **{"If-None-Match": etag})
+        resp = self._guarded(lambda: self._get(path, params, headers, timeout))
+        if resp.status_code == 304:
+            stored = self.etags.hit(key)
+            if stored is not None:
+                return stored
+            # Stored copy evicted in between: fetch the body unconditionally
+            return self._guarded(lambda: self._get(path, params, None, timeout))
+        if resp.status_code == 200:
+            self.etags.store(key, resp.headers.get("ETag"), resp)
+        return resp
+
+    def _get(self, path, params, headers, timeout):
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._sleep_before_retry(attempt - 1)
+            with tracing.span(f"GET {self.name}", kind="client", upstream=self.name,
+                              path=path, attempt=attempt) as span:
+                started = time.perf_counter()
+                try:
+                    resp = self.session.get(self.url(path), params=params,
+                                            headers=tracing.outbound_headers(headers),
+                                            timeout=timeout or self.timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    observe_upstream(self.name, "GET", "error", time.perf_counter() - started)
+                    span["status"] = "error"
+                    last_error = e
+                    continue
+                observe_upstream(self.name, "GET", resp.status_code, time.perf_counter() - started)
+                span["status"] = resp.status_code
+            if resp.status_code in RETRY_STATUSES and attempt < self.retries:
+                continue
+            return resp
+        raise last_error
+
+    def post(self, path, json=None, headers=None, timeout=None):
+        # Non-idempotent: never retried.
+        return self._guarded(lambda: self._post(path, json, headers, timeout))
+
+    def _post(self, path, json, headers, timeout):
+        with tracing.span(f"POST {self.name}", kind="client", upstream=self.name, path=path) as span:
+            started = time.perf_counter()
+            try:
+                resp = self.session.post(self.url(path), json=json,
+                                         headers=tracing.outbound_headers(headers),
+                                         timeout=timeout or self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                observe_upstream(self.name, "POST", "error", time.perf_counter() - started)
+                raise
+            observe_upstream(self.name, "POST", resp.status_code, time.perf_counter() - started)
+            span["status"] = resp.status_code
+        return resp
+
+    def close(self):
+        self.session.close()
+
+
+def client_from_env(name, default_base, breaker=None):
+    """Build a ServiceClient configured by <NAME>_BASE / _TIMEOUT / _CONNECT_TIMEOUT / _RETRIES / _POOL_SIZE."""
+    prefix = name.upper()
+    return ServiceClient(
+        name,
+        os.getenv(f"{prefix}_BASE", default_base),
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", 2.0)),
+        connect_timeout=float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", 0.5)),
+        retries=int(os.getenv(f"{prefix}_RETRIES", 2)),
+        pool_size=int(os.getenv(f"{prefix}_POOL_SIZE", 20)),
+        breaker=breaker,
+    )
+
+
+# ---- Shared executor for fan-out calls ----
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """Runs each task in a copy of the submitter's contextvars (keeps the trace / request id)."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Process-wide thread pool, created on first use (again after any worker fork)."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor_pid = os.getpid()
+                _executor = ContextThreadPoolExecutor(
+                    max_workers=int(os.getenv("HTTP_EXECUTOR_WORKERS", 16)),
+                    thread_name_prefix="http-fanout",
+                )
+    return _executor
@@ -0,0 +1,127 @@
+"""Prometheus metrics shared by all services, served by each service at GET /metrics.
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+(must be set before this module is imported); /metrics then aggregates the
+files of all workers, so any worker can answer a scrape. Without the variable
+(dev server) the default in-process registry is used.
+"""
+import os
+import re
+import time
+
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter,
+                               Gauge, Histogram, generate_latest, multiprocess)
+from sqlalchemy import event
+
+# Request latencies are mostly a few ms; upstream / SQL buckets go lower.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Inbound HTTP requests.", ["method", "route", "status"])
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Inbound request latency (until the response headers).",
+    ["method", "route"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being handled.", multiprocess_mode="livesum")
+
+SQL_LATENCY = Histogram(
+    "db_statement_duration_seconds", "SQL statement execution time.",
+    ["operation"], buckets=FAST_BUCKETS)
+
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Outbound HTTP call time per upstream service.",
+    ["upstream", "method", "status"], buckets=FAST_BUCKETS)
+
+CACHE_EVENTS = Counter(
+    "cache_events_total", "Cache lookups and maintenance (hit, miss, coalesced, stale, eviction, expiration).",
+    ["cache", "event"])
+
+_SQL_VERB = re.compile(r"^\s*(\w+)")
+
+
+# ---- Inbound requests ----
+def instrument_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def _route_label():
+    # The URL rule ("/orders/<int:id>/"), not the raw path: keeps label cardinality bounded.
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+def _before_request():
+    g._metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+
+def _observe_request(status):
+    started = g.pop("_metrics_started", None)
+    if started is None:
+        return
+    HTTP_IN_FLIGHT.dec()
+    route = _route_label()
+    HTTP_LATENCY.labels(request.method, route).observe(time.perf_counter() - started)
+    HTTP_REQUESTS.labels(request.method, route, str(status)).inc()
+
+
+def _after_request(response):
+    _observe_request(response.status_code)
+    return response
+
+
+def _teardown_request(error=None):
+    # Only still pending when the view raised (after_request was skipped)
+    _observe_request(500)
+
+
+# ---- SQL ----
+def instrument_engine(engine):
+    """Time every statement executed through ``engine``."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("_query_started")
+        if not stack:
+            return
+        match = _SQL_VERB.match(statement)
+        operation = match.group(1).upper() if match else "OTHER"
+        SQL_LATENCY.labels(operation).observe(time.perf_counter() - stack.pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        # Failed statements never reach after_cursor_execute
+        conn = context.connection
+        if conn is not None and conn.info.get("_query_started"):
+            conn.info["_query_started"].pop()
+
+    return engine
+
+
+# ---- Outbound HTTP ----
+def observe_upstream(upstream, method, status, seconds):
+    """``status``: HTTP status code, or "error" for connection failures / timeouts."""
+    UPSTREAM_LATENCY.labels(upstream, method, str(status)).observe(seconds)
+
+
+# ---- Cache ----
+def count_cache(cache, event_name, amount=1):
+    if amount:
+        CACHE_EVENTS.labels(cache, event_name).inc(amount)
+
+
+# ---- Exposition ----
+def metrics_response():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,95 @@
+"""Keyset (cursor) pagination and streamed JSON arrays for list endpoints.
+
+List routes accept:
+  ?limit=N&after=<id>  -> {"items": [...], "next_cursor": <id or null>}
+  ?stream=1            -> a JSON array written row by row from a server-side cursor
+Without these parameters the routes keep returning a plain JSON array.
+"""
+from collections import namedtuple
+
+from flask import Response
+
+from common.responses import dumps_bytes
+
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+PageArgs = namedtuple("PageArgs", ["limit", "after", "stream"])
+
+
+def parse_page_args(args, max_limit=MAX_PAGE_SIZE):
+    """Read limit/after/stream from request.args. Raises ValueError on bad input."""
+    limit = args.get("limit")
+    after = args.get("after")
+    stream = args.get("stream", "").lower() in ("1", "true", "yes")
+
+    if limit is not None:
+        limit = int(limit)
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+        limit = min(limit, max_limit)
+    if after is not None and after != "":
+        after = int(after)
+    else:
+        after = None
+    return PageArgs(limit, after, stream)
+
+
+def is_paginated(page):
+    return page.limit is not None or page.after is not None
+
+
+def apply_keyset(query, id_column, page, probe=True):
+    """Order by id and skip to the cursor.
+
+    With ``probe`` one extra row is fetched so page_payload can tell whether
+    there is a next page; streams pass ``probe=False``.
+    """
+    if page.after is not None:
+        query = query.filter(id_column > page.after)
+    query = query.order_by(id_column)
+    if page.limit is not None:
+        query = query.limit(page.limit + 1 if probe else page.limit)
+    return query
+
+
+def page_payload(rows, page, serialize, id_attr="id"):
+    """Build {"items", "next_cursor"} from rows fetched with apply_keyset.
+
+    ``serialize`` turns a list of rows into a list of dicts (so callers can
+    enrich a whole page at once).
+    """
+    next_cursor = None
+    if page.limit is not None and len(rows) > page.limit:
+        rows = rows[:page.limit]
+        next_cursor = getattr(rows[-1], id_attr)
+    return {"items": serialize(rows), "next_cursor": next_cursor}
+
+
+def stream_json_array(Session, build_query, serialize, batch_size=STREAM_BATCH_SIZE):
+    """Stream a JSON array; memory stays bounded by ``batch_size`` rows.
+
+    ``build_query(session)`` returns the (already filtered and ordered) query;
+    it is executed with ``yield_per`` so rows come from a server-side cursor.
+    The session lives as long as the response body is being written.
+    """
+    def generate():
+        session = Session()
+        try:
+            yield b"["
+            first = True
+            batch = []
+            for row in build_query(session).yield_per(batch_size):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    # one chunk per batch: fewer, larger writes (and compressor calls)
+                    yield (b"" if first else b",") + b",".join(dumps_bytes(item) for item in serialize(batch))
+                    first = False
+                    batch = []
+            if batch:
+                yield (b"" if first else b",") + b",".join(dumps_bytes(item) for item in serialize(batch))
+            yield b"]"
+        finally:
+            session.close()
+
+    return Response(generate(), mimetype="application/json")
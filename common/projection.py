@@ -0,0 +1,32 @@
+"""Sparse fieldsets: ?fields=id,total,status on list and get endpoints."""
+
+
+def parse_fields(args, allowed):
+    """Return the requested fields (in ``allowed`` order) or ``allowed`` if none were asked for.
+
+    Raises ValueError naming unknown fields.
+    """
+    raw = args.get("fields")
+    if raw is None or not raw.strip():
+        return tuple(allowed)
+    requested = {f.strip() for f in raw.split(",") if f.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    return tuple(f for f in allowed if f in requested)
+
+
+def select_columns(query, model, fields):
+    """Select the columns backing ``fields`` (plus the primary key) as plain rows, not ORM objects.
+
+    Rows allow attribute access (``row.id``), so ``pick`` and keyset pagination
+    work on them unchanged, while object construction and identity-map
+    bookkeeping are skipped entirely.
+    """
+    names = list(fields) + [c.name for c in model.__table__.primary_key.columns if c.name not in fields]
+    return query.with_entities(*(getattr(model, name) for name in names))
+
+
+def pick(obj, fields):
+    """{field: obj.field} for the requested fields only (never touches unloaded columns)."""
+    return {f: getattr(obj, f) for f in fields}
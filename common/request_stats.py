@@ -0,0 +1,84 @@
+"""Per-worker request counters: in-flight requests and time spent queued before a worker picked them up.
+
+nginx stamps proxied requests with `X-Request-Start: t=<epoch seconds>.<millis>`
+(its $msec); the gap between that stamp and before_request is time spent in
+the listen backlog / gunicorn accept queue. Each gunicorn worker keeps its own
+counters (the response carries the pid).
+"""
+import os
+import threading
+import time
+
+from flask import g, request
+
+REQUEST_START_HEADER = "X-Request-Start"
+
+
+def parse_request_start(value):
+    """Epoch seconds from an X-Request-Start value ("t=1700000000.123", ms or µs also accepted)."""
+    if not value:
+        return None
+    if value.startswith("t="):
+        value = value[2:]
+    try:
+        ts = float(value)
+    except ValueError:
+        return None
+    if ts > 1e14:      # microseconds
+        ts /= 1_000_000
+    elif ts > 1e11:    # milliseconds
+        ts /= 1000
+    return ts
+
+
+class RequestStats:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.in_flight_max = 0
+        self.requests = 0
+        self.queue_samples = 0
+        self.queue_total = 0.0
+        self.queue_max = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+
+    def _start(self):
+        queued = None
+        started = parse_request_start(request.headers.get(REQUEST_START_HEADER))
+        if started is not None:
+            queued = max(0.0, time.time() - started)
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            if self.in_flight > self.in_flight_max:
+                self.in_flight_max = self.in_flight
+            if queued is not None:
+                self.queue_samples += 1
+                self.queue_total += queued
+                if queued > self.queue_max:
+                    self.queue_max = queued
+        g._request_stats_counted = True
+
+    def _finish(self, _error=None):
+        # teardown also runs when an earlier before_request aborted the request
+        if not g.pop("_request_stats_counted", False):
+            return
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "in_flight": self.in_flight,
+                "in_flight_max": self.in_flight_max,
+                "requests": self.requests,
+                "queue_wait_samples": self.queue_samples,
+                "queue_wait_avg_ms": round(self.queue_total / self.queue_samples * 1000, 3) if self.queue_samples else 0.0,
+                "queue_wait_max_ms": round(self.queue_max * 1000, 3),
+            }
@@ -0,0 +1,204 @@
+"""Shared response layer: fast JSON encoding and negotiated compression.
+
+- ``app.json`` uses orjson when it is installed (stdlib json otherwise), so
+  ``jsonify`` and ``request.json`` get it without code changes.
+- Responses of COMPRESS_MIN_SIZE (1024) bytes or more are compressed with
+  brotli (if installed) or gzip, picked from Accept-Encoding; streamed JSON is
+  compressed on the fly.
+- ``raw_json`` embeds JSON already stored in a column without parsing it
+  (orjson >= 3.9), or with orjson's parser otherwise.
+- ``init_app(app, cache_paths=...)``: GET responses under those paths get an
+  ETag (304 on If-None-Match) and ``Cache-Control: public, max-age=...`` so the
+  gateway cache can keep them; writes and errors get ``no-store``.
+  HTTP_CACHE_MAX_AGE (5 s, 0 = always revalidate), HTTP_CACHE_STALE (30 s,
+  stale-while-revalidate). ``shared=False`` sends ``private`` instead (personal
+  data: browser only, never a shared cache). With ``version=`` (a callable,
+  see common/data_version.py) the ETag is that version, also sent as
+  X-Data-Version, and responses are ``no-cache``: clients revalidate on every
+  request and get a 304 before the route runs while the version is unchanged,
+  so a write shows up at once.
+"""
+import gzip
+import json
+import os
+import zlib
+from functools import partial
+
+from flask import current_app, g, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 4))
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", 5))
+HTTP_CACHE_STALE = int(os.getenv("HTTP_CACHE_STALE", 30))
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+_Fragment = getattr(orjson, "Fragment", None)
+
+
+def _default(obj):
+    # Anything orjson can't encode natively (Decimal, sets, ...) goes through Flask's rules
+    return DefaultJSONProvider.default(obj)
+
+
+def dumps_bytes(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def raw_json(text, empty=None):
+    """Value to put in a payload for JSON ``text`` stored in the database."""
+    if not text:
+        return [] if empty is None else empty
+    if _Fragment is not None:
+        return _Fragment(text)
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # bytes straight into the body: no str round trip
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+
+# ---- Compression ----
+def _accepted_encodings():
+    accepted = {}
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    return accepted
+
+
+def choose_encoding():
+    accepted = _accepted_encodings()
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def _compress_stream(chunks, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            out = compressor.process(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+            if out:
+                yield out
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 = gzip container
+        for chunk in chunks:
+            out = compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+            if out:
+                yield out
+        yield compressor.flush()
+
+
+def compress_response(response):
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        if encoding == "br":
+            response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        else:
+            response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    response.headers["Content-Encoding"] = encoding
+    # Same entity, different bytes: a strong validator no longer applies
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# ---- HTTP caching ----
+def cache_control_value(shared=True, versioned=False):
+    scope = "public" if shared else "private"
+    if versioned or HTTP_CACHE_MAX_AGE <= 0:
+        return f"{scope}, no-cache"
+    return f"{scope}, max-age={HTTP_CACHE_MAX_AGE}, stale-while-revalidate={HTTP_CACHE_STALE}"
+
+
+def version_check(paths, version):
+    """304 straight away when If-None-Match already holds the current data version."""
+    if request.method not in ("GET", "HEAD") or not request.path.startswith(paths):
+        return None
+    # Read before the route runs: a write committed meanwhile only makes the tag older, never newer than the data
+    g.data_version = f"v{version()}"
+    if request.if_none_match.contains_weak(g.data_version):
+        return current_app.response_class(status=304)
+    return None
+
+
+def cache_headers(paths, shared, response):
+    if not request.path.startswith(paths) or "Cache-Control" in response.headers:
+        return response
+    # Streamed exports are too big to keep at the gateway
+    if (request.method not in ("GET", "HEAD") or response.status_code not in (200, 304)
+            or response.is_streamed):
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    data_version = g.get("data_version")
+    if data_version is not None:
+        response.set_etag(data_version)
+        response.headers["X-Data-Version"] = data_version
+    elif response.status_code == 200 and response.get_etag()[0] is None:
+        response.add_etag()
+        response = response.make_conditional(request)
+    response.headers["Cache-Control"] = cache_control_value(shared, versioned=data_version is not None)
+    return response
+
+
+def init_app(app, cache_paths=(), shared=True, version=None):
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
+    if cache_paths:
+        # after_request runs in reverse order: ETag is computed before compression
+        app.after_request(partial(cache_headers, tuple(cache_paths), shared))
+        if version is not None:
+            app.before_request(partial(version_check, tuple(cache_paths), version))
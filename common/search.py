@@ -0,0 +1,364 @@
+"""Ranked substring search backed by an n-gram index (no LIKE '%term%' scans).
+
+Text is normalized (lowercase, accents folded: "Nguyễn Đức" -> "nguyen duc")
+and indexed as:
+  - trigrams of the whole value ("nguyen" -> ngu, guy, uye, yen)
+  - word-prefix grams "^n", "^ng" for each word: terms of 1-2 word
+    characters take this fast path and match words that start with them
+A term of 3+ characters matches rows holding all of its trigrams (rarest
+gram first), then candidates are checked against the real values and
+ranked: exact value > value prefix > word prefix > substring, then shorter
+first value, then id.
+Terms that give no grams (1-2 characters with punctuation: "@x", "b@", ".")
+fall back to a LIKE '%term%' scan, capped like the candidates, so they
+match as substrings the way plain LIKE search did. A blank term is not a
+search: callers treat ?search= of only spaces as no filter.
+
+SEARCH_BACKEND picks where the postings live:
+  sql     (default) a <table>_search (gram, entity_id) table in the service
+          DB, written in the same transaction as the row; shared by every
+          worker / replica; SQL Server and SQLite
+  memory  per-process dict gram -> ids, loaded from the table on first use,
+          updated after commit and caught up with rows inserted by other
+          processes (by id) before each search; renames done by another
+          process show up after `flask rebuild-search-index` / restart
+SEARCH_MAX_CANDIDATES (2000) caps the rows verified per search (ranking is
+exact within them), SEARCH_MAX_RESULTS (1000) the rows returned without ?limit.
+"""
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+from sqlalchemy import Integer, bindparam, event, exists, func, insert, or_, select
+from sqlalchemy.orm import aliased
+
+from common.cache import TTLCache
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "sql").lower()
+MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", 2000))
+MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 1000))
+CANDIDATES_PER_RESULT = 10   # with ?limit=N at most 10*N rows (>= 200) are verified
+MAX_FILTER_GRAMS = 8         # grams checked in SQL per term; the rest is verified on the rows
+DF_CAP = 2000                # posting sizes are counted up to this (picks the driving gram)
+IN_CHUNK_SIZE = 500
+WRITE_BATCH = 5000
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text):
+    text = (text or "").replace("đ", "d").replace("Đ", "D")
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return " ".join(text.lower().replace("^", " ").split())
+
+
+def text_grams(values):
+    """Grams stored for a row's (not yet normalized) values."""
+    grams = set()
+    for value in values:
+        value = normalize(value)
+        grams.update(value[i:i + 3] for i in range(len(value) - 2))
+        for word in _WORD.findall(value):
+            grams.update(("^" + word[:1], "^" + word[:2]))
+    return grams
+
+
+def term_grams(term):
+    """(grams a match must have, prefix_mode) for an already normalized term.
+
+    No grams for short terms with non-word characters: they need a LIKE scan.
+    """
+    if len(term) >= 3:
+        return {term[i:i + 3] for i in range(len(term) - 2)}, False
+    if not term.isalnum():  # letters / digits only: "_1", "@x" go to the LIKE scan
+        return set(), False
+    return {"^" + term}, True
+
+
+def like_pattern(term):
+    r"""'%term%' with the LIKE wildcards of SQL Server and SQLite escaped (ESCAPE '\')."""
+    for char in ("\\", "%", "_", "["):
+        term = term.replace(char, "\\" + char)
+    return f"%{term}%"
+
+
+def rank(term, values, prefix_mode=False):
+    """0 exact, 1 value prefix, 2 word prefix, 3 substring; None if no match."""
+    best = None
+    word_start = re.compile(r"(?<!\w)" + re.escape(term))
+    for value in values:
+        if value == term:
+            return 0
+        if value.startswith(term):
+            r = 1
+        elif word_start.search(value):
+            r = 2
+        elif not prefix_mode and term in value:
+            r = 3
+        else:
+            continue
+        best = r if best is None else min(best, r)
+    return best
+
+
+# ---- Postings stores ----
+class SqlPostings:
+    def __init__(self, gram_model):
+        self.model = gram_model
+        self._df = TTLCache(maxsize=20000, ttl=300, name=f"{gram_model.__tablename__}_df")
+        m = gram_model
+        capped = select(m.entity_id).where(m.gram == bindparam("gram")).limit(DF_CAP).subquery()
+        self._df_stmt = select(func.count()).select_from(capped)
+        self._candidate_stmts = {}
+
+    def add(self, session, items):
+        rows = [{"gram": g, "entity_id": entity_id} for entity_id, grams in items for g in grams]
+        for i in range(0, len(rows), WRITE_BATCH):
+            session.execute(insert(self.model.__table__), rows[i:i + WRITE_BATCH])  # Core executemany
+
+    def remove(self, session, entity_ids):
+        m = self.model
+        for i in range(0, len(entity_ids), IN_CHUNK_SIZE):
+            (session.query(m).filter(m.entity_id.in_(entity_ids[i:i + IN_CHUNK_SIZE]))
+             .delete(synchronize_session=False))
+
+    def clear(self, session):
+        session.query(self.model).delete(synchronize_session=False)
+
+    def doc_freq(self, session, gram):
+        df = self._df.get(gram)
+        if df is None:
+            df = session.execute(self._df_stmt, {"gram": gram}).scalar()
+            self._df.set(gram, df)
+        return df
+
+    def _candidate_stmt(self, k):
+        # Built once per gram count (statement construction dominates otherwise)
+        stmt = self._candidate_stmts.get(k)
+        if stmt is None:
+            m = self.model
+            stmt = select(m.entity_id).where(m.gram == bindparam("g0"))
+            for j in range(1, k):
+                other = aliased(m)
+                stmt = stmt.where(exists().where(other.gram == bindparam(f"g{j}"),
+                                                 other.entity_id == m.entity_id))
+            stmt = stmt.order_by(m.entity_id).limit(bindparam("n", type_=Integer, literal_execute=True))
+            self._candidate_stmts[k] = stmt
+        return stmt
+
+    def candidates(self, session, grams, limit):
+        # Rarest gram drives the lookup; sizes only order the grams (they may be
+        # up to 5 min old), never filter
+        grams = sorted(grams, key=lambda g: self.doc_freq(session, g))[:MAX_FILTER_GRAMS]
+        params = {f"g{j}": g for j, g in enumerate(grams)}
+        params["n"] = limit
+        return session.execute(self._candidate_stmt(len(grams)), params).scalars().all()
+
+
+class MemoryPostings:
+    def __init__(self, load):
+        # load(session, after_id) -> (id, values) rows with id > after_id, ordered by id
+        self._load = load
+        self._postings = defaultdict(set)
+        self._docs = {}
+        self._max_id = 0
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def _set(self, entity_id, grams):
+        self._unset(entity_id)
+        self._docs[entity_id] = grams
+        for g in grams:
+            self._postings[g].add(entity_id)
+        self._max_id = max(self._max_id, entity_id)
+
+    def _unset(self, entity_id):
+        for g in self._docs.pop(entity_id, ()):
+            ids = self._postings.get(g)
+            if ids is not None:
+                ids.discard(entity_id)
+                if not ids:
+                    del self._postings[g]
+
+    def apply(self, ops):
+        with self._lock:
+            for op, entity_id, grams in ops:
+                if op == "set":
+                    self._set(entity_id, grams)
+                else:
+                    self._unset(entity_id)
+
+    def catch_up(self, session):
+        with self._lock:
+            for row in self._load(session, self._max_id if self._loaded else 0):
+                self._set(row[0], text_grams(row[1:]))
+            self._loaded = True
+
+    def __len__(self):
+        return len(self._docs)
+
+    def reset(self):
+        with self._lock:
+            self._postings.clear()
+            self._docs.clear()
+            self._max_id = 0
+            self._loaded = False
+
+    def candidates(self, session, grams, limit):
+        self.catch_up(session)
+        with self._lock:
+            postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+            if not postings:
+                return []
+            ids = set(postings[0])
+            for other in postings[1:]:
+                ids &= other
+                if not ids:
+                    break
+        return sorted(ids)[:limit]
+
+
+# ---- Index ----
+class SearchIndex:
+    """Search over ``fields`` of ``model`` (first field is the main one for ranking).
+
+    Writes: call ``index(session, row)`` / ``remove(session, id)`` next to the
+    row change, before the commit. The sql backend writes postings in the
+    same transaction; the memory backend applies them after the commit.
+    """
+
+    def __init__(self, Session, model, fields, gram_model, backend=None,
+                 max_candidates=MAX_CANDIDATES, max_results=MAX_RESULTS):
+        self.model = model
+        self.fields = tuple(fields)
+        self.backend = (backend or SEARCH_BACKEND).lower()
+        self.max_candidates = max_candidates
+        self.max_results = max_results
+        if self.backend == "memory":
+            self.store = MemoryPostings(self._load_rows)
+            self._pending_key = ("search", gram_model.__tablename__)
+            event.listen(Session, "after_commit", self._after_commit)
+            event.listen(Session, "after_rollback", self._after_rollback)
+        elif self.backend == "sql":
+            self.store = SqlPostings(gram_model)
+        else:
+            raise ValueError(f"SEARCH_BACKEND must be sql or memory, not {self.backend!r}")
+
+    def _load_rows(self, session, after_id, limit=None):
+        columns = [self.model.id] + [getattr(self.model, f) for f in self.fields]
+        query = session.query(*columns).filter(self.model.id > after_id).order_by(self.model.id)
+        return query.limit(limit).all() if limit else query.yield_per(WRITE_BATCH)
+
+    def _values(self, row):
+        return [getattr(row, f) for f in self.fields]
+
+    # memory backend: postings change only once the transaction is committed
+    def _after_commit(self, session):
+        ops = session.info.pop(self._pending_key, None)
+        if ops:
+            self.store.apply(ops)
+
+    def _after_rollback(self, session):
+        session.info.pop(self._pending_key, None)
+
+    def index_many(self, session, rows):
+        items = [(row.id, text_grams(self._values(row))) for row in rows]
+        if self.backend == "memory":
+            session.info.setdefault(self._pending_key, []).extend(("set", i, g) for i, g in items)
+            return
+        self.store.remove(session, [i for i, _g in items])
+        self.store.add(session, items)
+
+    def index(self, session, row):
+        self.index_many(session, [row])
+
+    def remove(self, session, entity_id):
+        if self.backend == "memory":
+            session.info.setdefault(self._pending_key, []).append(("del", entity_id, None))
+            return
+        self.store.remove(session, [entity_id])
+
+    def _verify(self, session, ids, term, prefix_mode, matched=False):
+        """((rank, length, id), row) for the candidates that really match.
+
+        matched: the ids already match (LIKE); ``rank`` only orders them.
+        """
+        ranked = []
+        for i in range(0, len(ids), IN_CHUNK_SIZE):
+            # plain rows with every column (cheaper than ORM objects), usable with pick()
+            for row in session.query(*self.model.__table__.columns).filter(self.model.id.in_(ids[i:i + IN_CHUNK_SIZE])):
+                values = [normalize(v) for v in self._values(row)]
+                r = rank(term, values, prefix_mode) if term else None
+                if r is None and matched:
+                    r = 3
+                if r is not None:
+                    ranked.append(((r, len(values[0]), row.id), row))
+        return ranked
+
+    def _like_candidates(self, session, raw_term, limit):
+        """Ids of rows with ``raw_term`` in one of the fields (a scan: only for terms without grams)."""
+        pattern = like_pattern(raw_term)
+        match = or_(*(getattr(self.model, f).like(pattern, escape="\\") for f in self.fields))
+        return [row.id for row in session.query(self.model.id).filter(match).order_by(self.model.id).limit(limit)]
+
+    def search(self, session, term, limit=None):
+        """Matching rows (all columns), best first (at most ``limit`` / max_results).
+
+        A blank ``term`` matches nothing; callers skip the search for it.
+        """
+        raw_term = (term or "").strip()
+        if not raw_term:
+            return []
+        term = normalize(raw_term)
+        grams, prefix_mode = term_grams(term)
+        want = limit or self.max_results
+        cap = self.max_candidates if limit is None else min(self.max_candidates, max(limit * CANDIDATES_PER_RESULT, 200))
+        if not grams:
+            ranked = self._verify(session, self._like_candidates(session, raw_term, cap), term, False, matched=True)
+            ranked.sort(key=lambda item: item[0])
+            return [row for _key, row in ranked[:want]]
+        ranked, seen = [], set()
+        first_word = _WORD.match(term)
+        if not prefix_mode and first_word:
+            # Pass 1: rows with a word starting like the term (ranks 0-2) usually fill the page
+            ids = self.store.candidates(session, grams | {"^" + first_word.group()[:2]}, cap)
+            ranked = self._verify(session, ids, term, prefix_mode)
+            seen.update(ids)
+            if sum(1 for key, _row in ranked if key[0] <= 2) < want:
+                ids = [i for i in self.store.candidates(session, grams, cap) if i not in seen]
+                ranked += self._verify(session, ids, term, prefix_mode)
+        else:
+            ranked = self._verify(session, self.store.candidates(session, grams, cap), term, prefix_mode)
+        ranked.sort(key=lambda item: item[0])
+        return [row for _key, row in ranked[:want]]
+
+    def ensure_built(self, session, echo=None):
+        """Build the sql index once for rows that existed before it (run by `flask migrate`)."""
+        if self.backend != "sql" or session.query(self.store.model.entity_id).first() is not None:
+            return 0
+        if session.query(self.model.id).first() is None:
+            return 0
+        return self.rebuild(session, echo=echo)
+
+    def rebuild(self, session, echo=None):
+        """Re-index every row; commits in batches. Returns the number of rows."""
+        if self.backend == "memory":
+            self.store.reset()
+            self.store.catch_up(session)
+            return len(self.store)
+        self.store.clear(session)
+        session.commit()
+        count = last_id = 0
+        while True:
+            # keyset pages: a commit would end a cursor left open across batches
+            rows = self._load_rows(session, last_id, limit=WRITE_BATCH)
+            if not rows:
+                return count
+            self.store.add(session, [(row[0], text_grams(row[1:])) for row in rows])
+            session.commit()
+            count += len(rows)
+            last_id = rows[-1][0]
+            if echo:
+                echo(f"indexed {count} rows")
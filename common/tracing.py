@@ -0,0 +1,241 @@
+"""Request IDs and lightweight tracing across services.
+
+nginx assigns every request an ``X-Request-ID`` and a W3C ``traceparent``
+(unless the client sent them). Each service:
+
+- opens a server span per inbound request, continuing the incoming trace;
+- records a span per SQL statement and per outbound HTTP call;
+- forwards ``X-Request-ID`` / ``traceparent`` on every call made through
+  ServiceClient, AsyncUpstream and the event publisher.
+
+Spans go to TRACE_EXPORT:
+  memory (default)  ring buffer of TRACE_BUFFER (2000) spans per process, GET /stats/traces
+  file              one JSON object per line appended to TRACE_FILE
+  off               nothing is recorded (headers are still propagated)
+TRACE_SAMPLE_RATE (1.0) applies to requests that arrive without a traceparent.
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+
+REQUEST_ID_HEADER = "X-Request-ID"
+TRACEPARENT_HEADER = "traceparent"
+MAX_STATEMENT_CHARS = 300
+
+TraceContext = namedtuple("TraceContext", "trace_id span_id request_id sampled")
+
+_current = contextvars.ContextVar("trace_context", default=None)
+
+
+def _new_id(nbytes):
+    return os.urandom(nbytes).hex()
+
+
+def parse_traceparent(value):
+    """Return (trace_id, parent_span_id, sampled) from a traceparent header, or None if invalid."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    version, trace_id, span_id, flags = parts
+    try:
+        int(trace_id, 16), int(span_id, 16)
+        sampled = bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+    if version == "ff" or trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id, span_id, sampled
+
+
+def current():
+    return _current.get()
+
+
+def outbound_headers(headers=None):
+    """``headers`` plus X-Request-ID / traceparent for the current span (unchanged outside a trace)."""
+    ctx = _current.get()
+    if ctx is None:
+        return headers
+    merged = dict(headers or {})
+    merged[TRACEPARENT_HEADER] = f"00-{ctx.trace_id}-{ctx.span_id}-{'01' if ctx.sampled else '00'}"
+    if ctx.request_id:
+        merged[REQUEST_ID_HEADER] = ctx.request_id
+    return merged
+
+
+# ---- Exporters ----
+class MemoryExporter:
+    def __init__(self, maxlen):
+        self.spans = deque(maxlen=maxlen)
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def find(self, trace_id=None, request_id=None, limit=200):
+        spans = list(self.spans)
+        if trace_id:
+            spans = [s for s in spans if s["trace_id"] == trace_id]
+        if request_id:
+            spans = [s for s in spans if s["request_id"] == request_id]
+        return spans[-limit:]
+
+
+class FileExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def find(self, trace_id=None, request_id=None, limit=200):
+        return []
+
+
+_service = "service"
+_exporter = None
+_sample_rate = 1.0
+
+
+def configure(service):
+    global _service, _exporter, _sample_rate
+    _service = service
+    _sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+    mode = os.getenv("TRACE_EXPORT", "memory").lower()
+    if mode == "file":
+        _exporter = FileExporter(os.getenv("TRACE_FILE", f"traces-{service}.jsonl"))
+    elif mode == "off":
+        _exporter = None
+    else:
+        _exporter = MemoryExporter(int(os.getenv("TRACE_BUFFER", 2000)))
+
+
+def find_spans(trace_id=None, request_id=None, limit=200):
+    if _exporter is None:
+        return []
+    return _exporter.find(trace_id=trace_id, request_id=request_id, limit=limit)
+
+
+def _record(ctx, parent_id, name, kind, started, duration, attrs, error=None):
+    if _exporter is None or not ctx.sampled:
+        return
+    span = {
+        "trace_id": ctx.trace_id,
+        "span_id": ctx.span_id,
+        "parent_id": parent_id,
+        "request_id": ctx.request_id,
+        "service": _service,
+        "name": name,
+        "kind": kind,
+        "start": round(started, 6),
+        "duration_ms": round(duration * 1000, 3),
+        "attributes": attrs,
+    }
+    if error is not None:
+        span["error"] = error
+    _exporter.export(span)
+
+
+@contextmanager
+def span(name, kind="internal", **attrs):
+    """Child span of the current one; yields its attribute dict (no-op outside a trace)."""
+    parent = _current.get()
+    if parent is None:
+        yield attrs
+        return
+    ctx = parent._replace(span_id=_new_id(8))
+    token = _current.set(ctx)
+    started, t0 = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        _current.reset(token)
+        _record(ctx, parent.span_id, name, kind, started, time.perf_counter() - t0, attrs, error)
+
+
+# ---- Inbound requests ----
+def init_app(app, service):
+    configure(service)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def _before_request():
+    incoming = parse_traceparent(request.headers.get(TRACEPARENT_HEADER))
+    if incoming is not None:
+        trace_id, parent_id, sampled = incoming
+    else:
+        trace_id, parent_id, sampled = _new_id(16), None, random.random() < _sample_rate
+    request_id = request.headers.get(REQUEST_ID_HEADER) or trace_id
+    ctx = TraceContext(trace_id, _new_id(8), request_id, sampled)
+    g._trace = (ctx, parent_id, _current.set(ctx), time.time(), time.perf_counter(), {})
+
+
+def _after_request(response):
+    state = g.get("_trace")
+    if state is not None:
+        ctx, _parent_id, _token, _started, _t0, attrs = state
+        attrs["status"] = response.status_code
+        response.headers[REQUEST_ID_HEADER] = ctx.request_id
+    return response
+
+
+def _teardown_request(error=None):
+    state = g.pop("_trace", None)
+    if state is None:
+        return
+    ctx, parent_id, token, started, t0, attrs = state
+    rule = request.url_rule
+    attrs.update(method=request.method, route=rule.rule if rule is not None else None, path=request.path)
+    _current.reset(token)
+    _record(ctx, parent_id, f"{request.method} {attrs['route'] or request.path}", "server",
+            started, time.perf_counter() - t0, attrs, repr(error) if error is not None else None)
+
+
+# ---- SQL ----
+def instrument_engine(engine):
+    """One span per SQL statement executed inside a traced request."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        ctx = _current.get()
+        conn.info.setdefault("_trace_started", []).append(
+            (ctx, time.time(), time.perf_counter()) if ctx is not None and ctx.sampled else None)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("_trace_started")
+        if not stack:
+            return
+        entry = stack.pop()
+        if entry is None:
+            return
+        ctx, started, t0 = entry
+        _record(ctx._replace(span_id=_new_id(8)), ctx.span_id, "sql", "db", started,
+                time.perf_counter() - t0, {"statement": statement[:MAX_STATEMENT_CHARS],
+                                           "executemany": executemany})
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        conn = context.connection
+        if conn is not None and conn.info.get("_trace_started"):
+            conn.info["_trace_started"].pop()
+
+    return engine
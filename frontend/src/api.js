@@ -10,6 +10,15 @@ const api = axios.create({
   timeout: 5000,
 });
 
+// Browser cache GET /users/ vài giây (Cache-Control: private của service).
+// Sau khi ghi thì đổi tham số v: URL mới nên lần đọc sau đi thẳng tới service
+// và thấy ngay thay đổi của chính mình. Products không cần: service trả no-cache
+// (revalidate mỗi lần) và gateway đổi key cache theo phiên bản catalog.
+const catalogVersion = { users: undefined };
+const bumpVersion = (name) => {
+  catalogVersion[name] = Date.now();
+};
+
 // Hàm xử lý lỗi chung
 const handleError = (error) => {
   if (error.response) {
@@ -26,15 +35,24 @@ const API = {
   // === Users ===
   getUsers: async (search = "") => {
     try {
-      const res = await api.get("/users/", { params: { search } });
+      const res = await api.get("/users/", { params: { search, v: catalogVersion.users } });
       return res.data;
     } catch (err) {
       handleError(err);
     }
   },
+  getUserCount: async () => {
+    try {
+      const res = await api.get("/users/count", { params: { v: catalogVersion.users } });
+      return res.data.count;
+    } catch (err) {
+      handleError(err);
+    }
+  },
   createUser: async (data) => {
     try {
       const res = await api.post("/users/", data);
+      bumpVersion("users");
       return res.data;
     } catch (err) {
       handleError(err);
@@ -43,6 +61,7 @@ const API = {
   updateUser: async (id, data) => {
     try {
       const res = await api.put(`/users/${id}/`, data);
+      bumpVersion("users");
       return res.data;
     } catch (err) {
       handleError(err);
@@ -51,6 +70,7 @@ const API = {
   deleteUser: async (id) => {
     try {
       const res = await api.delete(`/users/${id}/`);
+      bumpVersion("users");
       return res.data;
     } catch (err) {
       handleError(err);
@@ -66,6 +86,14 @@ const API = {
       handleError(err);
     }
   },
+  getProductCount: async () => {
+    try {
+      const res = await api.get("/products/count");
+      return res.data.count;
+    } catch (err) {
+      handleError(err);
+    }
+  },
   createProduct: async (data) => {
     try {
       const res = await api.post("/products/", data);
@@ -92,9 +120,19 @@ const API = {
   },
 
   // === Orders ===
-  getOrders: async (search = "") => {
+  // fields: optional projection, e.g. "id,total,status" (skips product_list)
+  getOrders: async (search = "", fields) => {
     try {
-      const res = await api.get("/orders/", { params: { search } });
+      const res = await api.get("/orders/", { params: { search, fields } });
+      return res.data;
+    } catch (err) {
+      handleError(err);
+    }
+  },
+  // Tổng hợp sẵn ở server (GROUP BY, cache vài giây): bucket = "day" | "week" | "month"
+  getOrderAnalytics: async (params = {}) => {
+    try {
+      const res = await api.get("/orders/analytics", { params });
       return res.data;
     } catch (err) {
       handleError(err);
@@ -134,6 +172,14 @@ const API = {
       handleError(err);
     }
   },
+  getPaymentAnalytics: async () => {
+    try {
+      const res = await api.get("/payments/analytics");
+      return res.data;
+    } catch (err) {
+      handleError(err);
+    }
+  },
   createPayment: async (data) => {
     try {
       const res = await api.post("/payments/", data);
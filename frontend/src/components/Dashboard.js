@@ -35,49 +35,38 @@ const Dashboard = () => {
 useEffect(() => {
   const fetchData = async () => {
     try {
-      // Gọi đồng thời cả 4 API
-      const [usersRes, productsRes, ordersRes, paymentsRes] = await Promise.all([
-        API.getUsers(),
-        API.getProducts(),
-        API.getOrders(),
-        API.getPayments()
+      // Chỉ lấy số liệu đã tổng hợp ở server: không tải toàn bộ danh sách về trình duyệt
+      const [userCount, productCount, orderStats, paymentStats] = await Promise.all([
+        API.getUserCount(),
+        API.getProductCount(),
+        API.getOrderAnalytics({ top: 5 }),
+        API.getPaymentAnalytics()
       ]);
 
-      const usersData = usersRes.data;
-      const productsData = productsRes.data;
-      const ordersData = ordersRes.data;
-      const paymentsData = paymentsRes.data;
+      const paymentsByStatus = Object.fromEntries(
+        paymentStats.by_status.map(s => [s.status, s])
+      );
 
-      // 1. Thống kê
-      const totalRevenue = paymentsData
-        .filter(p => p.status === 'Paid')
-        .reduce((sum, p) => sum + p.amount, 0);
-      
+      // 1. Thống kê (doanh thu = tổng các payment đã Paid)
       setStats({
-        revenue: totalRevenue,
-        orders: ordersData.length,
-        users: usersData.length,
-        products: productsData.length
+        revenue: paymentsByStatus.Paid ? paymentsByStatus.Paid.amount : 0,
+        orders: orderStats.totals.orders,
+        users: userCount,
+        products: productCount
       });
 
-      // 2. 5 đơn hàng gần nhất với tên User
-      const last5Orders = ordersData.slice(-5).reverse().map(order => {
-        const user = usersData.find(u => u.id === order.user_id);
-        return {
-          ...order,
-          userName: user ? user.name : `ID: ${order.user_id}`
-        };
-      });
-      setRecentOrders(last5Orders);
+      // 2. 5 đơn hàng gần nhất (đã có tên User)
+      setRecentOrders(orderStats.recent.map(order => ({
+        ...order,
+        userName: order.user_name || `ID: ${order.user_id}`
+      })));
 
       // 3. Thống kê tình trạng thanh toán
-      const statusCounts = paymentsData.reduce((acc, p) => {
-        if (p.status === 'Paid') acc.paid++;
-        else if (p.status === 'Pending') acc.pending++;
-        else if (p.status === 'Failed') acc.failed++;
-        return acc;
-      }, { pending: 0, paid: 0, failed: 0 });
-      setPaymentStatus(statusCounts);
+      setPaymentStatus({
+        pending: paymentsByStatus.Pending ? paymentsByStatus.Pending.payments : 0,
+        paid: paymentsByStatus.Paid ? paymentsByStatus.Paid.payments : 0,
+        failed: paymentsByStatus.Failed ? paymentsByStatus.Failed.payments : 0
+      });
 
     } catch (err) {
       console.error("Error fetching dashboard data:", err);
@@ -39,7 +39,8 @@ const Payments = () => {
   // ✅ SỬA: Dùng API.getOrders
   const fetchOrders = async () => {
     try {
-      const res = await API.getOrders();
+      // Dropdown only needs these columns
+      const res = await API.getOrders("", "id,user_id,user_name,total");
       setOrders(res.data);
     } catch (err) {
       console.error("Error fetching orders:", err);
@@ -1,61 +1,59 @@
 # orders_service.py
 from flask import Flask, request, jsonify
-from sqlalchemy import create_engine, Column, Integer, Float, String, text, exc
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import Column, Date, DateTime, Integer, Float, String, UnicodeText, case, cast, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import declarative_base, sessionmaker, object_session
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
-import requests
+import sys
+import asyncio
+import click
 import json
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
+from datetime import date, datetime, timedelta, timezone
+
+# Cho phép import package "common" khi chạy trực tiếp từ thư mục service
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import make_engine, migrate, pool_stats, identity_insert
+from common.health import Readiness
+from common.request_stats import RequestStats
+from common.metrics import instrument_app, metrics_response
+from common import tracing
+from common import responses
+from common.responses import raw_json
+from common.cache import TTLCache
+from common.cache_sync import CacheSync
+from common.http_client import client_from_env, get_executor
+from common import async_fanout
+from common.breaker import CircuitOpenError, breaker_from_env
+from common.pagination import parse_page_args, is_paginated, apply_keyset, page_payload, stream_json_array
+from common.projection import parse_fields, select_columns, pick
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:3000"])
+request_stats = RequestStats(app)
+instrument_app(app)
+tracing.init_app(app, "orders")
+responses.init_app(app)
 
-DB_USER = os.getenv("DB_USER")
-DB_PASS = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("ORDERS_DB") # Đọc ORDERS_DB
 ORDERS_PORT = int(os.getenv("ORDERS_PORT", 5003))
 
-USERS_BASE = os.getenv("USERS_BASE", "http://localhost:5001")
-PRODUCTS_BASE = os.getenv("PRODUCTS_BASE", "http://localhost:5002")
+# Pooled keep-alive clients; base URL / timeout / retries come from USERS_* and PRODUCTS_* env vars
+# One circuit breaker per upstream, shared by the sync and async clients
+users_breaker = breaker_from_env("users")
+products_breaker = breaker_from_env("products")
+users_client = client_from_env("users", "http://localhost:5001", breaker=users_breaker)
+products_client = client_from_env("products", "http://localhost:5002", breaker=products_breaker)
 
-# === LOGIC TỰ TẠO DATABASE ===
-def init_db():
-    master_engine = create_engine(
-        f"mssql+pymssql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/master",
-        isolation_level="AUTOCOMMIT"
-    )
-    
-    retries = 5
-    while retries > 0:
-        try:
-            with master_engine.connect() as conn:
-                conn.execute(text(f"IF NOT EXISTS (SELECT name FROM sys.databases WHERE name = N'{DB_NAME}') CREATE DATABASE [{DB_NAME}]"))
-            print(f"Database '{DB_NAME}' is ready.")
-            break # Thành công, thoát vòng lặp
-        except exc.SQLAlchemyError as e:
-            print(f"Error creating database (hoặc DB chưa sẵn sàng): {e}")
-            retries -= 1
-            time.sleep(5) # Chờ 5 giây rồi thử lại
-    
-    master_engine.dispose()
-    if retries == 0:
-        raise Exception(f"Không thể tạo hoặc kết nối đến database {DB_NAME}")
-
-    # 3. Bây giờ mới tạo engine chính kết nối đến database của service
-    db_engine = create_engine(f"mssql+pymssql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}", pool_pre_ping=True)
-    return db_engine
-# ===============================
-
-engine = init_db()
+engine = make_engine(DB_NAME) # Chưa kết nối DB; tạo DB + bảng bằng `flask migrate`
 Base = declarative_base()
 Session = sessionmaker(bind=engine)
+readiness = Readiness(engine)
 
 class Order(Base):
     __tablename__ = "orders"
@@ -65,147 +63,315 @@ class Order(Base):
     total = Column(Float)
     # --- THÊM TRẠNG THÁI ---
     status = Column(String(50), default="Pending") # Trạng thái: Pending, Delivering, Completed
+    # Thời điểm tạo (UTC) cho thống kê theo thời gian; đơn cũ trước khi có cột = NULL
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None), index=True)
+
+class OrderItem(Base):
+    """One line of an order, with the product name/price snapshotted at purchase time."""
+    __tablename__ = "order_items"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    order_id = Column(Integer, nullable=False, index=True)
+    product_id = Column(Integer, nullable=False, index=True)
+    quantity = Column(Integer, nullable=False, default=1)
+    unit_price = Column(Float)
+    product_name = Column(String(100))
 
-Base.metadata.create_all(engine)
+class OrderView(Base):
+    """Read model: orders already joined with user name and product lines (what GET /orders/ returns).
 
-# ---- Simple in-memory cache with TTL ----
-_cache = {}
-def cache_set(key, value, ttl=30):
-    _cache[key] = (time.time() + ttl, value)
+    Maintained on every order write and by user change events; can be
+    regenerated with `flask --app orders rebuild-order-view`. Rows written while
+    a lookup was failing carry stale_fields and are re-enriched in the background.
+    """
+    __tablename__ = "order_view"
+    id = Column(Integer, primary_key=True, autoincrement=False)  # = orders.id
+    user_id = Column(Integer, index=True)
+    user_name = Column(String(100))
+    product_ids = Column(UnicodeText)
+    product_list = Column(UnicodeText)  # JSON array
+    total = Column(Float)
+    status = Column(String(50))
+    stale_fields = Column(String(50), index=True)  # "user_name,product_list" from a degraded lookup; NULL = complete
 
-def cache_get(key):
-    v = _cache.get(key)
-    if not v:
-        return None
-    expiry, value = v
-    if time.time() > expiry:
-        del _cache[key]
-        return None
-    return value
+class CacheChange(Base):
+    """User/product cache updates from change events, replayed by every process (see common/cache_sync.py)."""
+    __tablename__ = "cache_changes"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cache = Column(String(20), nullable=False)  # "users" | "products"
+    entity_id = Column(Integer, nullable=False)
+    value = Column(UnicodeText)  # JSON; NULL = deleted
+
+
+# ---- Bounded LRU + TTL caches for remote lookups ----
+CACHE_MAX_ENTRIES = int(os.getenv("ORDERS_CACHE_MAX_ENTRIES", 10000))
+CACHE_TTL = float(os.getenv("ORDERS_CACHE_TTL", 30))
+CACHE_NEGATIVE_TTL = float(os.getenv("ORDERS_CACHE_NEGATIVE_TTL", 10))
+
+product_cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, negative_ttl=CACHE_NEGATIVE_TTL, name="products")
+user_cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, negative_ttl=CACHE_NEGATIVE_TTL, name="users")
+
+# Caches are per process: an event reaches one worker of one replica, the others
+# pick the change up from cache_changes within ORDERS_CACHE_SYNC_INTERVAL seconds.
+cache_sync = CacheSync(Session, CacheChange, {"users": user_cache, "products": product_cache},
+                       interval=float(os.getenv("ORDERS_CACHE_SYNC_INTERVAL", 1)),
+                       after_poll=lambda: maybe_repair_stale_views())
+cache_sync.init_app(app)
 
 # ---- Helper: fetch products in batch or parallel with timeout ----
-REQUEST_TIMEOUT = 2  # seconds for external service calls
-MAX_WORKERS = 8
+BATCH_IDS_PER_CALL = 500  # stay under the upstream MAX_BATCH_IDS
 
-def try_batch_fetch_products(ids):
-    """Try /products?ids=1,2,3 (if product service supports it). Return dict id->product or None."""
+def try_batch_fetch(client, path, ids):
+    """GET <path>?ids=... in chunks. Return dict id->item or None if the batch call failed.
+
+    Ids are sorted so the same set gives the same URL: an expired cache entry
+    is revalidated with its ETag (304, no body) instead of refetched.
+    """
+    result = {}
+    ids = sorted(ids)
     try:
-        ids_param = ",".join(map(str, ids))
-        url = f"{PRODUCTS_BASE}/products?ids={ids_param}"
-        resp = requests.get(url, timeout=REQUEST_TIMEOUT)
-        if resp.status_code == 200:
-            data = resp.json()
-            # expecting list of products [{id:.., price:.., ...}]
-            return {int(p['id']): p for p in data}
+        for i in range(0, len(ids), BATCH_IDS_PER_CALL):
+            ids_param = ",".join(map(str, ids[i:i + BATCH_IDS_PER_CALL]))
+            resp = client.get(path, params={"ids": ids_param}, conditional=True)
+            if resp.status_code != 200:
+                return None
+            for item in resp.json():
+                result[int(item['id'])] = item
     except Exception:
-        pass
-    return None
+        return None
+    return result
+
+class LookupFailed(Exception):
+    """Some ids could not be looked up (upstream down, breaker open, 5xx): unknown, not "not found"."""
 
-def fetch_product_by_id(pid):
+    def __init__(self, name, ids):
+        super().__init__(f"{name} lookup failed for {len(ids)} id(s)")
+        self.name = name
+        self.ids = sorted(ids)
+
+def fetch_by_id(client, path, item_id):
+    """(id, item or None, failed): None with failed=False only for a 404."""
     try:
-        url = f"{PRODUCTS_BASE}/products/{pid}"
-        resp = requests.get(url, timeout=REQUEST_TIMEOUT)
-        if resp.status_code == 200:
-            return int(pid), resp.json()
+        resp = client.get(f"{path}{item_id}/", conditional=True)
     except Exception:
-        pass
-    return int(pid), None
-
-def get_products_by_ids(ids):
-    """Return dict id -> product (product may be None if not found). Caches results for TTL."""
-    ids = list({int(i) for i in ids})  # unique
-    result = {}
-    # check cache first
-    to_fetch = []
-    for pid in ids:
-        cached = cache_get(f"product:{pid}")
-        if cached is not None:
-            result[pid] = cached
-        else:
-            to_fetch.append(pid)
+        return int(item_id), None, True
+    if resp.status_code == 200:
+        return int(item_id), resp.json(), False
+    return int(item_id), None, resp.status_code != 404
 
-    if not to_fetch:
-        return result
+def load_many(client, path, name, ids):
+    """Cache loader: batch endpoint first, parallel single fetches as fallback.
 
-    # try batch endpoint first
-    batch = try_batch_fetch_products(to_fetch)
+    Raises LookupFailed if any id could not be resolved: get_many then caches
+    nothing for this call (a failure must not be remembered as "not found").
+    """
+    batch = try_batch_fetch(client, path, ids)
     if batch is not None:
-        for pid in to_fetch:
-            prod = batch.get(pid)
-            result[pid] = prod
-            cache_set(f"product:{pid}", prod, ttl=30)
-        return result
-
-    # fallback to parallel single fetches
-    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(to_fetch))) as ex:
-        futures = {ex.submit(fetch_product_by_id, pid): pid for pid in to_fetch}
-        for fut in as_completed(futures):
-            pid = futures[fut]
-            try:
-                _pid, prod = fut.result()
-                result[pid] = prod
-                cache_set(f"product:{pid}", prod, ttl=30)
-            except Exception:
-                result[pid] = None
-                cache_set(f"product:{pid}", None, ttl=10)
+        return batch
+
+    result, failed = {}, []
+    ex = get_executor()
+    futures = [ex.submit(fetch_by_id, client, path, item_id) for item_id in ids]
+    for fut in as_completed(futures):
+        item_id, item, error = fut.result()
+        if error:
+            failed.append(item_id)
+        else:
+            result[item_id] = item
+    if failed:
+        raise LookupFailed(name, failed)
     return result
 
+def try_batch_fetch_products(ids):
+    """Try /products/?ids=1,2,3. Return dict id->product or None."""
+    return try_batch_fetch(products_client, "/products/", ids)
+
+def load_products(ids):
+    return load_many(products_client, "/products/", "products", ids)
+
+def get_products_by_ids(ids):
+    """Return dict id -> product (None if not found). Cached via product_cache.
+
+    Raises LookupFailed when the products service could not answer for some ids.
+    """
+    ids = list({int(i) for i in ids})  # unique
+    if not ids:
+        return {}
+    return product_cache.get_many(ids, load_products)
+
 # ---- Helper: fetch users in batch or parallel with timeout ----
 def try_batch_fetch_users(ids):
-    try:
-        ids_param = ",".join(map(str, ids))
-        url = f"{USERS_BASE}/users?ids={ids_param}"
-        resp = requests.get(url, timeout=REQUEST_TIMEOUT)
-        if resp.status_code == 200:
-            data = resp.json()
-            return {int(u['id']): u for u in data}
-    except Exception:
-        pass
-    return None
+    return try_batch_fetch(users_client, "/users/", ids)
 
-def fetch_user_by_id(uid):
-    try:
-        url = f"{USERS_BASE}/users/{uid}"
-        resp = requests.get(url, timeout=REQUEST_TIMEOUT)
-        if resp.status_code == 200:
-            return int(uid), resp.json()
-    except Exception:
-        pass
-    return int(uid), None
+def load_users(ids):
+    return load_many(users_client, "/users/", "users", ids)
 
 def get_users_by_ids(ids):
     ids = list({int(i) for i in ids})
+    if not ids:
+        return {}
+    return user_cache.get_many(ids, load_users)
+
+def lookup_unavailable(error):
+    # No order is written from a failed lookup: its lines would snapshot null names / prices
+    return jsonify({"error": f"{error.name} service unavailable, try again later",
+                    "unresolved_ids": error.ids[:50]}), 503
+
+# ---- Async enrichment: users + products resolved concurrently on one event loop ----
+ENRICH_DEADLINE = float(os.getenv("ENRICH_DEADLINE", 3))  # seconds, whole request
+
+users_async = async_fanout.async_upstream_from_env("users", "http://localhost:5001", breaker=users_breaker)
+products_async = async_fanout.async_upstream_from_env("products", "http://localhost:5002", breaker=products_breaker)
+
+async def fetch_many_async(upstream, path, ids):
+    """Batch endpoint first (chunked), concurrent per-id GETs as fallback.
+
+    Returns (dict id->item, set of ids that could not be fetched). Ids the
+    upstream reports as missing map to None and are not "failed".
+    """
     result = {}
-    to_fetch = []
-    for uid in ids:
-        cached = cache_get(f"user:{uid}")
-        if cached is not None:
-            result[uid] = cached
+    if not ids:
+        return result, set()
+    ids = sorted(ids)  # stable URLs: ETag revalidation (see try_batch_fetch)
+    try:
+        chunks = [ids[i:i + BATCH_IDS_PER_CALL] for i in range(0, len(ids), BATCH_IDS_PER_CALL)]
+        replies = await asyncio.gather(*(
+            upstream.get_json(path, params={"ids": ",".join(map(str, chunk))}, conditional=True)
+            for chunk in chunks
+        ))
+        if all(status == 200 for status, _ in replies):
+            for _status, items in replies:
+                for item in items:
+                    result[int(item['id'])] = item
+            return result, set()
+    except CircuitOpenError:
+        # Upstream is known to be down: don't fan out per-id calls.
+        return result, set(ids)
+    except Exception:
+        pass
+
+    async def fetch_one(item_id):
+        try:
+            status, item = await upstream.get_json(f"{path}{item_id}/", conditional=True)
+        except Exception:
+            return item_id, None, True
+        if status == 200:
+            return item_id, item, False
+        return item_id, None, status != 404
+
+    failed = set()
+    for item_id, item, error in await asyncio.gather(*(fetch_one(i) for i in ids)):
+        if error:
+            failed.add(item_id)
         else:
-            to_fetch.append(uid)
+            result[item_id] = item
+    return result, failed
+
+async def load_users_and_products(user_ids, product_ids):
+    return await asyncio.wait_for(
+        asyncio.gather(
+            fetch_many_async(users_async, "/users/", user_ids),
+            fetch_many_async(products_async, "/products/", product_ids),
+        ),
+        ENRICH_DEADLINE,
+    )
 
-    if not to_fetch:
-        return result
+def _settle(cache, owned, loaded, failed, error, values, stale):
+    """Cache what was loaded; serve last known (stale) values for what failed."""
+    ok = [key for key in owned if key not in failed]
+    bad = [key for key in owned if key in failed]
+    cache.fulfil(ok, loaded)
+    if bad:
+        cache.abandon(bad, error or CircuitOpenError(cache.name))
+    for key in ok:
+        values[key] = loaded.get(key)
+    for key in bad:
+        values[key] = cache.get_stale(key)
+        stale.add(key)
 
-    batch = try_batch_fetch_users(to_fetch)
-    if batch is not None:
-        for uid in to_fetch:
-            user = batch.get(uid)
-            result[uid] = user
-            cache_set(f"user:{uid}", user, ttl=30)
-        return result
-
-    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(to_fetch))) as ex:
-        futures = {ex.submit(fetch_user_by_id, uid): uid for uid in to_fetch}
-        for fut in as_completed(futures):
-            uid = futures[fut]
-            try:
-                _uid, user = fut.result()
-                result[uid] = user
-                cache_set(f"user:{uid}", user, ttl=30)
-            except Exception:
-                result[uid] = None
-                cache_set(f"user:{uid}", None, ttl=10)
+def _wait_or_stale(cache, pending, timeout, values, stale):
+    deadline = time.monotonic() + timeout
+    for key, flight in pending.items():
+        try:
+            values.update(cache.wait({key: flight}, max(0.0, deadline - time.monotonic())))
+        except Exception:
+            values[key] = cache.get_stale(key)
+            stale.add(key)
+
+def enrich(user_ids, product_ids):
+    """Return (users_map, products_map, stale_user_ids, stale_product_ids).
+
+    Both lookups are issued concurrently and go through the same caches (and
+    single-flight) as get_users_by_ids / get_products_by_ids. Ids whose lookup
+    failed, missed ENRICH_DEADLINE or hit an open circuit are served from the
+    last cached value (or None) and reported as stale; failures are not cached.
+    """
+    started = time.monotonic()
+    user_ids = list({int(i) for i in user_ids})
+    product_ids = list({int(i) for i in product_ids})
+
+    users_map, u_owned, u_pending = user_cache.reserve(user_ids)
+    products_map, p_owned, p_pending = product_cache.reserve(product_ids)
+    stale_users, stale_products = set(), set()
+
+    if u_owned or p_owned:
+        error = None
+        try:
+            (users_loaded, users_failed), (products_loaded, products_failed) = async_fanout.run(
+                load_users_and_products(u_owned, p_owned), timeout=ENRICH_DEADLINE + 1
+            )
+        except Exception as e:
+            error = e
+            users_loaded, users_failed = {}, set(u_owned)
+            products_loaded, products_failed = {}, set(p_owned)
+        _settle(user_cache, u_owned, users_loaded, users_failed, error, users_map, stale_users)
+        _settle(product_cache, p_owned, products_loaded, products_failed, error, products_map, stale_products)
+
+    remaining = max(0.0, ENRICH_DEADLINE - (time.monotonic() - started))
+    _wait_or_stale(user_cache, u_pending, remaining, users_map, stale_users)
+    _wait_or_stale(product_cache, p_pending, remaining, products_map, stale_products)
+    return users_map, products_map, stale_users, stale_products
+
+def order_to_dict(o, items, users_map, products_map, stale_users=(), stale_products=()):
+    """Enriched order shape; adds "stale_fields" when some data came from a degraded lookup.
+
+    product_list comes from the order_items snapshot when present; orders not
+    yet migrated fall back to products_map (remote lookup).
+    """
+    stale_fields = []
+    if items:
+        products_info = items_to_product_list(items)
+        product_ids_field = o.product_ids or product_list_to_field([p["id"] for p in products_info])
+    else:
+        pids = parse_product_ids_field(o.product_ids)
+        product_ids_field = o.product_ids
+        # build product objects (or minimal info)
+        products_info = []
+        for pid in pids:
+            prod = products_map.get(pid)
+            if prod:
+                products_info.append({"id": pid, "name": prod.get("name"), "price": prod.get("price")})
+            else:
+                products_info.append({"id": pid, "name": None, "price": None})
+        if any(pid in stale_products for pid in pids):
+            stale_fields.append("product_list")
+
+    u = users_map.get(o.user_id)
+    user_name = u.get("name") if u else "Unknown"
+    if o.user_id in stale_users:
+        stale_fields.insert(0, "user_name")
+
+    result = {
+        "id": o.id,
+        "user_id": o.user_id,
+        "user_name": user_name,
+        "product_ids": product_ids_field,
+        "product_list": products_info,
+        "total": o.total,
+        # --- SỬA: Thêm status
+        "status": o.status
+    }
+    if stale_fields:
+        result["stale_fields"] = stale_fields
     return result
 
 # ---- Utilities for parsing/storing product_ids ----
@@ -220,6 +386,160 @@ def parse_product_ids_field(field):
 def product_list_to_field(lst):
     return ",".join(map(str, lst))
 
+PRODUCT_IDS_FIELD_MAX = 1000  # length of the legacy orders.product_ids column
+
+def legacy_product_ids_field(lst):
+    """CSV kept in orders.product_ids for old readers; None when it would not fit (order_items is authoritative)."""
+    field = product_list_to_field(lst)
+    return field if len(field) <= PRODUCT_IDS_FIELD_MAX else None
+
+# ---- order_items helpers ----
+ITEMS_IN_CHUNK = 500
+
+def build_order_lines(product_ids, prods):
+    """Group product ids into (product_id, quantity, unit_price, name) lines, keeping first-seen order.
+
+    Returns (lines, total). Products without a valid price get unit_price None
+    and do not count toward the total.
+    """
+    lines = {}
+    for pid in product_ids:
+        if pid in lines:
+            lines[pid][1] += 1
+            continue
+        p = prods.get(pid)
+        price = None
+        name = None
+        if p:
+            name = p.get("name")
+            try:
+                price = float(p["price"]) if p.get("price") is not None else None
+            except Exception:
+                # if price invalid, skip
+                price = None
+        lines[pid] = [pid, 1, price, name]
+
+    total = sum(qty * price for _pid, qty, price, _name in lines.values() if price is not None)
+    return [tuple(line) for line in lines.values()], total
+
+def add_order_items(session, order_id, lines):
+    session.add_all([
+        OrderItem(order_id=order_id, product_id=pid, quantity=qty, unit_price=price, product_name=name)
+        for pid, qty, price, name in lines
+    ])
+
+def delete_order_items(session, order_id):
+    session.query(OrderItem).filter(OrderItem.order_id == order_id).delete(synchronize_session=False)
+
+def load_order_items(session, order_ids):
+    """Return {order_id: [OrderItem, ...]} using chunked IN (...) queries."""
+    order_ids = list(order_ids)
+    items_map = {}
+    for i in range(0, len(order_ids), ITEMS_IN_CHUNK):
+        chunk = order_ids[i:i + ITEMS_IN_CHUNK]
+        rows = session.query(OrderItem).filter(OrderItem.order_id.in_(chunk)).order_by(OrderItem.id).all()
+        for item in rows:
+            items_map.setdefault(item.order_id, []).append(item)
+    return items_map
+
+def items_to_product_list(items):
+    """Expand lines back to one entry per unit (the historical product_list shape)."""
+    products_info = []
+    for item in items:
+        entry = {"id": item.product_id, "name": item.product_name, "price": item.unit_price}
+        products_info.extend(dict(entry) for _ in range(item.quantity or 1))
+    return products_info
+
+# ---- order_view read model helpers ----
+def order_view_row(d):
+    return OrderView(
+        id=d["id"],
+        user_id=d["user_id"],
+        user_name=d["user_name"],
+        product_ids=d["product_ids"],
+        product_list=json.dumps(d["product_list"]),
+        total=d["total"],
+        status=d["status"],
+        stale_fields=",".join(d.get("stale_fields", ())) or None,
+    )
+
+def refresh_order_view(session, orders, enriched):
+    """Upsert the read-model rows for ``orders`` inside the caller's transaction.
+
+    ``enriched``: the enrich() result, fetched before the transaction started
+    (see enrich_for_write): no call to another service while it holds locks.
+    """
+    session.flush()
+    for d in serialize_orders(orders, enriched):
+        session.merge(order_view_row(d))
+
+def sync_order_view(session, batch_size=500, echo=None):
+    """Bring order_view in line with orders + order_items; commits in batches. Returns (rows written, orphans deleted).
+
+    Nothing is emptied first: each batch is upserted in its own transaction,
+    so reads keep seeing a complete view while this runs. Orders written
+    meanwhile bring their own view row (same transaction as the order).
+    """
+    written = last_id = 0
+    while True:
+        orders = (session.query(Order)
+                  .filter(Order.id > last_id)
+                  .order_by(Order.id)
+                  .limit(batch_size)
+                  .all())
+        if not orders:
+            break
+        last_id = orders[-1].id
+        # existing rows in one query: updated in place, the missing ones inserted
+        existing = {v.id: v for v in session.query(OrderView).filter(OrderView.id.in_([o.id for o in orders]))}
+        # one items query + one users/products fan-out per batch
+        for d in serialize_orders(orders):
+            row = order_view_row(d)
+            view = existing.get(row.id)
+            if view is None:
+                session.add(row)
+                continue
+            for column in OrderView.__table__.columns.keys():
+                setattr(view, column, getattr(row, column))
+        session.commit()
+        written += len(orders)
+        if echo:
+            echo(f"order_view: {written} orders written (last id {last_id})")
+    has_order = session.query(Order.id).filter(Order.id == OrderView.id).exists()
+    orphans = session.query(OrderView).filter(~has_order).delete(synchronize_session=False)
+    session.commit()
+    return written, orphans
+
+def ensure_order_view(session, echo=None):
+    """Build order_view once for orders that existed before it (run by `flask migrate`)."""
+    if session.query(OrderView.id).first() is not None or session.query(Order.id).first() is None:
+        return 0
+    written, _orphans = sync_order_view(session, echo=echo)
+    return written
+
+def delete_order_view(session, order_id):
+    session.query(OrderView).filter(OrderView.id == order_id).delete(synchronize_session=False)
+
+ORDER_FIELDS = ("id", "user_id", "user_name", "product_ids", "product_list", "total", "status")
+
+def select_view_columns(query, fields):
+    """select_columns for order_view reads: stale_fields always comes along."""
+    return select_columns(query, OrderView, fields + ("stale_fields",))
+
+def view_to_dict(v, fields=ORDER_FIELDS):
+    d = pick(v, fields)
+    if "product_list" in d:
+        # stored JSON goes into the response as is (no parse / re-encode round trip when orjson allows)
+        d["product_list"] = raw_json(v.product_list)
+    # same shape as order_to_dict; only the requested fields are reported
+    stale = [f for f in (v.stale_fields or "").split(",") if f in fields]
+    if stale:
+        d["stale_fields"] = stale
+    return d
+
+def serialize_views(views, fields=ORDER_FIELDS):
+    return [view_to_dict(v, fields) for v in views]
+
 # ---- Routes ----
 
 @app.route("/orders/", methods=["POST"])
@@ -240,26 +560,13 @@ def create_order():
             return jsonify({"error": "Please select at least one product"}), 400
 
         product_ids = [int(x) for x in product_ids]
-        # Fetch product details in batch (fast) and compute total
+        # Fetch product details in batch (fast), snapshot them per line and compute total
         prods = get_products_by_ids(product_ids)
-        total = 0.0
-        missing = []
-        for pid in product_ids:
-            p = prods.get(pid)
-            if p and 'price' in p and p['price'] is not None:
-                try:
-                    total += float(p['price'])
-                except Exception:
-                    # if price invalid, skip
-                    pass
-            else:
-                missing.append(pid)
-
-        if missing:
-            pass
+        lines, total = build_order_lines(product_ids, prods)
 
-        product_ids_str = product_list_to_field(product_ids)
+        product_ids_str = legacy_product_ids_field(product_ids)
         custom_id = data.get("id")
+        enriched = enrich_for_write([int(user_id)])
 
         if custom_id:
             custom_id = int(custom_id)
@@ -268,27 +575,27 @@ def create_order():
             existing = session.query(Order).filter(Order.id == custom_id).first()
             if existing:
                 return jsonify({"error": "ID already exists"}), 409
-            try:
-                session.execute(text("SET IDENTITY_INSERT orders ON"))
+            with identity_insert(session, "orders"):
                 # --- SỬA: Thêm status="Pending"
                 order = Order(id=custom_id, user_id=int(user_id), product_ids=product_ids_str, total=total, status="Pending")
                 session.add(order)
-                session.commit()
-                session.execute(text("SET IDENTITY_INSERT orders OFF"))
-                session.commit()
-                return jsonify({"message": "Order created with custom ID", "id": order.id, "total": total}), 201
-            except Exception as e:
-                session.rollback()
-                session.execute(text("SET IDENTITY_INSERT orders OFF"))
-                session.commit()
-                return jsonify({"error": str(e)}), 500
+                add_order_items(session, custom_id, lines)
+                refresh_order_view(session, [order], enriched)
+            session.commit()
+            return jsonify({"message": "Order created with custom ID", "id": order.id, "total": total}), 201
         else:
             # --- SỬA: Thêm status="Pending"
             order = Order(user_id=int(user_id), product_ids=product_ids_str, total=total, status="Pending")
             session.add(order)
+            session.flush()  # assigns order.id for the line items
+            add_order_items(session, order.id, lines)
+            refresh_order_view(session, [order], enriched)
             session.commit()
             return jsonify({"message": "Order created", "id": order.id, "total": total}), 201
 
+    except LookupFailed as e:
+        session.rollback()
+        return lookup_unavailable(e)
     except ValueError:
         return jsonify({"error": "Invalid data format"}), 400
     except Exception as e:
@@ -297,95 +604,212 @@ def create_order():
     finally:
         session.close()
 
-@app.route("/orders/", methods=["GET"])
-def list_orders():
+# ---- Bulk create ----
+MAX_BULK_ORDERS = int(os.getenv("ORDERS_MAX_BULK", 500))
+
+def parse_bulk_order(data):
+    """(user_id, product_ids, custom_id or None) for one entry of POST /orders/bulk; ValueError if invalid."""
+    if not isinstance(data, dict):
+        raise ValueError("Each order must be an object")
+    try:
+        user_id = int(data.get("user_id") or 0)
+        product_ids = data.get("product_ids", [])
+        if isinstance(product_ids, str):
+            product_ids = parse_product_ids_field(product_ids)
+        product_ids = [int(x) for x in product_ids]
+        custom_id = int(data["id"]) if data.get("id") else None
+    except (TypeError, ValueError):
+        raise ValueError("Invalid data format")
+    if user_id <= 0:
+        raise ValueError("User ID must be positive")
+    if not product_ids:
+        raise ValueError("Please select at least one product")
+    if custom_id is not None and custom_id <= 0:
+        raise ValueError("ID must be positive")
+    return user_id, product_ids, custom_id
+
+@app.route("/orders/bulk", methods=["POST"])
+def create_orders_bulk():
+    """Create many orders: one product lookup for all of them, one transaction.
+
+    Body: {"orders": [{"user_id", "product_ids", "id"?}, ...]} (or the bare list).
+    Invalid entries are reported in "results" (same messages as POST /orders/)
+    and skipped; the valid ones are created together.
+    """
+    data = request.json
+    entries = data.get("orders") if isinstance(data, dict) else data
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"error": "orders must be a non-empty list"}), 400
+    if len(entries) > MAX_BULK_ORDERS:
+        return jsonify({"error": f"Too many orders (max {MAX_BULK_ORDERS})"}), 400
+
+    results = [None] * len(entries)
+    parsed = []
+    for index, entry in enumerate(entries):
+        try:
+            parsed.append((index, *parse_bulk_order(entry)))
+        except ValueError as e:
+            results[index] = {"index": index, "status": 400, "error": str(e)}
+
     session = Session()
     try:
-        search = request.args.get('search', '').strip()
-        query = session.query(Order)
-        if search:
-            try:
-                search_id = int(search)
-                query = query.filter((Order.id == search_id) | (Order.user_id == search_id))
-            except ValueError:
-                pass
+        # Custom ids: one IN (...) for those already taken, plus repeats inside the batch
+        custom_ids = [cid for _i, _u, _p, cid in parsed if cid is not None]
+        taken = set()
+        for i in range(0, len(custom_ids), ITEMS_IN_CHUNK):
+            chunk = custom_ids[i:i + ITEMS_IN_CHUNK]
+            taken.update(row.id for row in session.query(Order.id).filter(Order.id.in_(chunk)))
+        valid = []
+        for index, user_id, product_ids, custom_id in parsed:
+            if custom_id is not None and custom_id in taken:
+                results[index] = {"index": index, "status": 409, "error": "ID already exists"}
+                continue
+            if custom_id is not None:
+                taken.add(custom_id)
+            valid.append((index, user_id, product_ids, custom_id))
 
-        orders = query.all()
-        if not orders:
-            return jsonify([])
+        # One (cached, batched) lookup for the union of every order's products
+        prods = get_products_by_ids({pid for _i, _u, product_ids, _c in valid for pid in product_ids})
+
+        enriched = enrich_for_write({user_id for _i, user_id, _p, _c in valid})
 
-        # gather unique user_ids and product_ids across all orders
-        user_ids = set()
-        product_ids = set()
-        for o in orders:
-            user_ids.add(o.user_id)
+        generated, explicit = [], []
+        for index, user_id, product_ids, custom_id in valid:
+            lines, total = build_order_lines(product_ids, prods)
+            order = Order(id=custom_id, user_id=user_id, product_ids=legacy_product_ids_field(product_ids),
+                          total=total, status="Pending")
+            (explicit if custom_id is not None else generated).append((index, order, lines))
+
+        # Explicit ids first: the identity then continues after them, so a custom id
+        # equal to the next generated value cannot collide with this batch's own rows
+        if explicit:
+            with identity_insert(session, "orders"):
+                session.add_all([order for _i, order, _l in explicit])
+        session.add_all([order for _i, order, _l in generated])
+        session.flush()  # one multi-row INSERT; assigns the ids
+        created = explicit + generated
+        for _index, order, lines in created:
+            add_order_items(session, order.id, lines)
+        session.flush()
+        # New ids: plain inserts into order_view (merge would SELECT each row first)
+        session.add_all([order_view_row(d) for d in serialize_orders([order for _i, order, _l in created], enriched)])
+        session.commit()
+
+        for index, order, _lines in created:
+            results[index] = {"index": index, "status": 201, "id": order.id, "total": order.total}
+        # Nothing created: 409 when every entry failed on its id, 400 otherwise
+        failures = {r["status"] for r in results if r["status"] != 201}
+        status = 201 if created else (409 if failures == {409} else 400)
+        return jsonify({
+            "created": len(created),
+            "failed": len(entries) - len(created),
+            "results": results,
+        }), status
+    except IntegrityError:
+        # A custom id taken by a concurrent request after the check: nothing was created
+        session.rollback()
+        return jsonify({"error": "ID already exists"}), 409
+    except LookupFailed as e:
+        session.rollback()
+        return lookup_unavailable(e)
+    except Exception as e:
+        session.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        session.close()
+
+def search_orders_query(session, search):
+    query = session.query(OrderView)
+    if search:
+        try:
+            search_id = int(search)
+            query = query.filter((OrderView.id == search_id) | (OrderView.user_id == search_id))
+        except ValueError:
+            pass
+    return query
+
+def enrich_for_write(user_ids, legacy_product_ids=()):
+    """enrich() for orders about to be written, called before the first write of the transaction.
+
+    New order lines carry their product snapshot, so only users are looked
+    up, plus the products of a legacy order that keeps no order_items.
+    """
+    return enrich(user_ids, legacy_product_ids)
+
+def serialize_orders(orders, enriched=None):
+    """Build order dicts for a batch: line items in one query, users (and legacy products) in one fan-out.
+
+    ``enriched``: an enrich() result fetched beforehand; write paths pass it so
+    the fan-out never runs inside their transaction.
+    """
+    if not orders:
+        return []
+
+    items_map = load_order_items(object_session(orders[0]), [o.id for o in orders])
+
+    # gather unique user_ids, and product_ids of orders without order_items
+    user_ids = set()
+    product_ids = set()
+    for o in orders:
+        user_ids.add(o.user_id)
+        if o.id not in items_map:
             for pid in parse_product_ids_field(o.product_ids):
                 product_ids.add(pid)
 
-        users_map = get_users_by_ids(list(user_ids)) if user_ids else {}
-        products_map = get_products_by_ids(list(product_ids)) if product_ids else {}
-
-        result = []
-        for o in orders:
-            pids = parse_product_ids_field(o.product_ids)
-            # build product objects (or minimal info)
-            products_info = []
-            for pid in pids:
-                prod = products_map.get(pid)
-                if prod:
-                    products_info.append({"id": pid, "name": prod.get("name"), "price": prod.get("price")})
-                else:
-                    products_info.append({"id": pid, "name": None, "price": None})
-
-            u = users_map.get(o.user_id)
-            user_name = u.get("name") if u else "Unknown"
-
-            result.append({
-                "id": o.id,
-                "user_id": o.user_id,
-                "user_name": user_name,
-                "product_ids": o.product_ids,
-                "product_list": products_info,
-                "total": o.total,
-                # --- SỬA: Thêm status
-                "status": o.status
-            })
-        return jsonify(result)
+    if enriched is None:
+        enriched = enrich(user_ids, product_ids)
+    users_map, products_map, stale_users, stale_products = enriched
+    return [
+        order_to_dict(o, items_map.get(o.id), users_map, products_map, stale_users, stale_products)
+        for o in orders
+    ]
+
+@app.route("/orders/", methods=["GET"])
+def list_orders():
+    """Served from the order_view read model: one local query, no calls to other services."""
+    try:
+        page = parse_page_args(request.args)
+    except ValueError:
+        return jsonify({"error": "limit and after must be integers (limit > 0)"}), 400
+    try:
+        fields = parse_fields(request.args, ORDER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    search = request.args.get('search', '').strip()
+    # e.g. fields=id,total,status skips loading and parsing product_list entirely
+    serialize = lambda rows: serialize_views(rows, fields)
+
+    if page.stream:
+        return stream_json_array(
+            Session,
+            lambda s: apply_keyset(select_view_columns(search_orders_query(s, search), fields), OrderView.id, page, probe=False),
+            serialize,
+        )
+
+    session = Session()
+    try:
+        query = select_view_columns(search_orders_query(session, search), fields)
+        if is_paginated(page):
+            rows = apply_keyset(query, OrderView.id, page).all()
+            return jsonify(page_payload(rows, page, serialize))
+
+        views = query.all()
+        return jsonify(serialize(views))
     finally:
         session.close()
 
 @app.route("/orders/<int:id>/", methods=["GET"])
 def get_order(id):
+    try:
+        fields = parse_fields(request.args, ORDER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     session = Session()
     try:
-        order = session.query(Order).filter(Order.id == id).first()
-        if not order:
+        view = select_view_columns(session.query(OrderView), fields).filter(OrderView.id == id).first()
+        if not view:
             return jsonify({"error": "Order not found"}), 404
-
-        pids = parse_product_ids_field(order.product_ids)
-        products_map = get_products_by_ids(pids) if pids else {}
-        products_info = []
-        for pid in pids:
-            prod = products_map.get(pid)
-            if prod:
-                products_info.append({"id": pid, "name": prod.get("name"), "price": prod.get("price")})
-            else:
-                products_info.append({"id": pid, "name": None, "price": None})
-
-        users_map = get_users_by_ids([order.user_id])
-        u = users_map.get(order.user_id)
-        user_name = u.get("name") if u else "Unknown"
-
-        return jsonify({
-            "id": order.id,
-            "user_id": order.user_id,
-            "user_name": user_name,
-            "product_ids": order.product_ids,
-            "product_list": products_info,
-            "total": order.total,
-            # --- SỬA: Thêm status
-            "status": order.status
-        })
+        return jsonify(view_to_dict(view, fields))
     finally:
         session.close()
 
@@ -409,84 +833,89 @@ def update_order(id):
 
             # Preserve other fields if not provided
             new_user_id = int(data.get("user_id", order.user_id))
-            new_product_ids_field = data.get("product_ids", order.product_ids)
-            if isinstance(new_product_ids_field, list):
-                new_product_ids = new_product_ids_field
+            old_items = load_order_items(session, [id]).get(id, [])
+            if "product_ids" in data or not old_items:
+                new_product_ids_field = data.get("product_ids", order.product_ids)
+                if isinstance(new_product_ids_field, list):
+                    new_product_ids = [int(x) for x in new_product_ids_field]
+                else:
+                    new_product_ids = parse_product_ids_field(new_product_ids_field)
+                # recalc total
+                prods = get_products_by_ids(new_product_ids) if new_product_ids else {} # Chỉ tính nếu có product_ids
+                lines, total = build_order_lines(new_product_ids, prods)
             else:
-                new_product_ids = parse_product_ids_field(new_product_ids_field)
-
-            # recalc total
-            total = 0.0
-            if new_product_ids: # Chỉ tính nếu có product_ids
-                prods = get_products_by_ids(new_product_ids)
-                for pid in new_product_ids:
-                    p = prods.get(pid)
-                    if p and p.get("price") is not None:
-                        try:
-                            total += float(p["price"])
-                        except Exception:
-                            pass # Bỏ qua nếu giá bị lỗi
+                # keep the purchase-time snapshot
+                lines = [(it.product_id, it.quantity, it.unit_price, it.product_name) for it in old_items]
+                new_product_ids = [p["id"] for p in items_to_product_list(old_items)]
+                total = order.total
+
+            enriched = enrich_for_write([new_user_id])
 
             # SỬA: Lấy status cũ (Dòng 429 của bạn)
             old_status = order.status
+            old_created_at = order.created_at  # đổi ID không đổi ngày tạo đơn
             
             # delete and re-insert with new id (since you're doing identity insert)
             session.delete(order)
-            session.commit()
-            try:
-                session.execute(text("SET IDENTITY_INSERT orders ON"))
+            delete_order_items(session, id)
+            delete_order_view(session, id)
+            session.flush()
+            for it in old_items:
+                # bulk-deleted above; SQLite may hand their row ids to the new lines
+                session.expunge(it)
+            with identity_insert(session, "orders"):
                 # SỬA: Thêm status
                 new_order = Order(
                     id=new_id, 
                     user_id=new_user_id, 
-                    product_ids=product_list_to_field(new_product_ids), 
+                    product_ids=legacy_product_ids_field(new_product_ids), 
                     total=total,
-                    status=data.get("status", old_status) # Thêm dòng này
+                    status=data.get("status", old_status), # Thêm dòng này
+                    created_at=old_created_at
                 )
                 session.add(new_order)
-                session.commit()
-                session.execute(text("SET IDENTITY_INSERT orders OFF"))
-                session.commit()
-                return jsonify({"message": "Order updated with new ID", "new_id": new_id}), 200
-            except Exception as e:
-                session.rollback()
-                session.execute(text("SET IDENTITY_INSERT orders OFF"))
-                session.commit()
-                return jsonify({"error": str(e)}), 500
+                add_order_items(session, new_id, lines)
+                refresh_order_view(session, [new_order], enriched)
+            session.commit()
+            return jsonify({"message": "Order updated with new ID", "new_id": new_id}), 200
         else:
-            # update without changing ID
+            # update without changing ID; lookups first, before anything is written
+            new_user_id = int(data["user_id"]) if "user_id" in data else order.user_id
+            legacy_pids = ()
+            if "product_ids" not in data and not load_order_items(session, [id]):
+                legacy_pids = parse_product_ids_field(order.product_ids)
+            enriched = enrich_for_write([new_user_id], legacy_pids)
+
             if "user_id" in data:
-                order.user_id = int(data["user_id"])
+                order.user_id = new_user_id
             
             # SỬA LỖI: Chỉ tính lại total KHI product_ids được cung cấp
             if "product_ids" in data:
                 product_ids_field = data["product_ids"]
                 if isinstance(product_ids_field, list):
-                    product_ids = product_ids_field
+                    product_ids = [int(x) for x in product_ids_field]
                 else:
                     product_ids = parse_product_ids_field(product_ids_field)
                 
-                total = 0.0
-                if product_ids: # Chỉ tính nếu có product_ids
-                    prods = get_products_by_ids(product_ids)
-                    for pid in product_ids:
-                        p = prods.get(pid)
-                        if p and p.get("price") is not None:
-                            try:
-                                total += float(p["price"])
-                            except Exception:
-                                pass
-                order.product_ids = product_list_to_field(product_ids)
+                prods = get_products_by_ids(product_ids) if product_ids else {} # Chỉ tính nếu có product_ids
+                lines, total = build_order_lines(product_ids, prods)
+                order.product_ids = legacy_product_ids_field(product_ids)
                 order.total = total
+                delete_order_items(session, id)
+                add_order_items(session, id, lines)
             
             # --- THÊM KHỐI NÀY ---
             if "status" in data:
                 order.status = data["status"]
             # ---------------------
                 
+            refresh_order_view(session, [order], enriched)
             session.commit()
             return jsonify({"message": "Order updated"}), 200
 
+    except LookupFailed as e:
+        session.rollback()
+        return lookup_unavailable(e)
     except ValueError:
         return jsonify({"error": "Invalid data format"}), 400
     except Exception as e:
@@ -503,6 +932,8 @@ def delete_order(id):
         if not order:
             return jsonify({"error": "Order not found"}), 404
         session.delete(order)
+        delete_order_items(session, id)
+        delete_order_view(session, id)
         session.commit()
         return jsonify({"message": "Order deleted"}), 200
     except Exception as e:
@@ -511,6 +942,350 @@ def delete_order(id):
     finally:
         session.close()
 
+# ---- Change events from the users / products services ----
+
+@app.route("/events", methods=["POST"])
+def handle_event():
+    """Keep the read model and caches current.
+
+    user.* events rewrite user_name in order_view. product.* events only refresh
+    the product cache: order_view holds purchase-time product snapshots, which
+    later catalog edits must not change. Cache updates also go to cache_changes
+    for the other worker processes / replicas.
+    """
+    event = request.json or {}
+    event_type = event.get("type")
+    try:
+        entity_id = int(event.get("id"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Event id is required"}), 400
+
+    if event_type == "user.upserted":
+        cache_name = "users"
+        value = {"id": entity_id, "name": event.get("name"), "email": event.get("email")}
+        user_name = value["name"]
+    elif event_type == "user.deleted":
+        cache_name, value, user_name = "users", None, "Unknown"
+    elif event_type == "product.upserted":
+        cache_name = "products"
+        value = {"id": entity_id, "name": event.get("name"), "price": event.get("price")}
+    elif event_type == "product.deleted":
+        cache_name, value = "products", None
+    else:
+        return jsonify({"error": f"Unknown event type: {event_type}"}), 400
+
+    session = Session()
+    try:
+        cache_sync.record(session, cache_name, entity_id, value)
+        result = {"message": "Event applied"}
+        if cache_name == "users":
+            # the event's name is authoritative: user_name is no longer stale on those rows
+            without_user = case(
+                (OrderView.stale_fields == "user_name", None),
+                (OrderView.stale_fields == "user_name,product_list", "product_list"),
+                else_=OrderView.stale_fields,
+            )
+            result["updated"] = (session.query(OrderView)
+                                 .filter(OrderView.user_id == entity_id)
+                                 .update({OrderView.user_name: user_name, OrderView.stale_fields: without_user},
+                                         synchronize_session=False))
+        session.commit()
+        return jsonify(result), 200
+    except Exception as e:
+        session.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        session.close()
+
+# ---- Re-enrichment of stale order_view rows ----
+VIEW_REPAIR_INTERVAL = float(os.getenv("ORDERS_VIEW_REPAIR_INTERVAL", 30))
+VIEW_REPAIR_BATCH = 200
+
+view_repair = {"runs": 0, "repaired": 0, "last_run": 0.0}
+
+def repair_stale_views(batch_size=VIEW_REPAIR_BATCH):
+    """Enrich again up to ``batch_size`` rows that have stale_fields; returns (rows seen, rows now complete).
+
+    Only the enrichment columns are rewritten, and only while the row still
+    has the user / stale_fields that were read: an order write that landed in
+    between wins.
+    """
+    session = Session()
+    try:
+        rows = (session.query(OrderView.id, OrderView.user_id, OrderView.stale_fields)
+                .filter(OrderView.stale_fields.isnot(None))
+                .order_by(OrderView.id).limit(batch_size).all())
+        if not rows:
+            return 0, 0
+        orders = session.query(Order).filter(Order.id.in_([r.id for r in rows])).all()
+        fresh = {d["id"]: d for d in serialize_orders(orders)}
+        complete = 0
+        for row in rows:
+            d = fresh.get(row.id)
+            if d is None:
+                continue  # order deleted meanwhile (its view row went with it)
+            stale_fields = ",".join(d.get("stale_fields", ())) or None
+            updated = (session.query(OrderView)
+                       .filter(OrderView.id == row.id, OrderView.user_id == row.user_id,
+                               OrderView.stale_fields == row.stale_fields)
+                       .update({OrderView.user_name: d["user_name"],
+                                OrderView.product_list: json.dumps(d["product_list"]),
+                                OrderView.stale_fields: stale_fields}, synchronize_session=False))
+            if updated and stale_fields is None:
+                complete += 1
+        session.commit()
+        return len(rows), complete
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def maybe_repair_stale_views():
+    """Run by the cache_sync poller: every VIEW_REPAIR_INTERVAL seconds, repair batches while they all succeed."""
+    now = time.monotonic()
+    if now - view_repair["last_run"] < VIEW_REPAIR_INTERVAL:
+        return
+    view_repair["last_run"] = now
+    view_repair["runs"] += 1
+    while True:
+        seen, complete = repair_stale_views()
+        view_repair["repaired"] += complete
+        if seen < VIEW_REPAIR_BATCH or complete < seen:
+            break  # nothing left, or upstreams still failing: try again next interval
+
+# ---- Analytics (Dashboard) ----
+ANALYTICS_TTL = float(os.getenv("ANALYTICS_TTL", 10))
+ANALYTICS_BUCKETS = ("day", "week", "month")
+MAX_ANALYTICS_DAYS = 366
+MAX_ANALYTICS_TOP = 100
+RECENT_ORDERS = 5
+
+analytics_cache = TTLCache(maxsize=64, ttl=ANALYTICS_TTL, name="analytics")
+
+def day_of(column):
+    """Calendar day of a DateTime column, computed in SQL."""
+    if engine.dialect.name == "sqlite":
+        return func.date(column)  # 'YYYY-MM-DD'; CAST AS DATE would give the year
+    return cast(column, Date)
+
+def period_of(day, bucket):
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    if bucket == "week":
+        day -= timedelta(days=day.weekday())  # Monday
+    elif bucket == "month":
+        day = day.replace(day=1)
+    return day.isoformat()
+
+def money(value):
+    return round(value or 0.0, 2)
+
+def compute_order_analytics(session, bucket, days, top):
+    """Every figure is a GROUP BY in the database: cost follows the number of groups, not of orders."""
+    by_status = [
+        {"status": status, "orders": count, "revenue": money(revenue)}
+        for status, count, revenue in session.query(Order.status, func.count(Order.id), func.sum(Order.total))
+        .group_by(Order.status).order_by(Order.status)
+    ]
+
+    user_revenue = func.sum(OrderView.total)
+    by_user = [
+        {"user_id": user_id, "user_name": user_name, "orders": count, "revenue": money(revenue)}
+        for user_id, user_name, count, revenue in session.query(
+            OrderView.user_id, func.max(OrderView.user_name), func.count(OrderView.id), user_revenue)
+        .group_by(OrderView.user_id).order_by(user_revenue.desc(), OrderView.user_id).limit(top)
+    ]
+
+    # From the order_items snapshots (orders not yet split into items: `flask migrate-order-items`)
+    product_revenue = func.sum(OrderItem.quantity * OrderItem.unit_price)
+    by_product = [
+        {"product_id": product_id, "product_name": name, "orders": count, "units": units or 0,
+         "revenue": money(revenue)}
+        for product_id, name, count, units, revenue in session.query(
+            OrderItem.product_id, func.max(OrderItem.product_name), func.count(OrderItem.id),
+            func.sum(OrderItem.quantity), product_revenue)
+        .group_by(OrderItem.product_id).order_by(product_revenue.desc(), OrderItem.product_id).limit(top)
+    ]
+
+    # Per day in SQL (at most `days` rows), rolled up to weeks / months here
+    today = datetime.now(timezone.utc).date()
+    since = datetime.combine(today - timedelta(days=days - 1), datetime.min.time())
+    day = day_of(Order.created_at)
+    series = {}
+    for day_value, count, revenue in (session.query(day, func.count(Order.id), func.sum(Order.total))
+                                      .filter(Order.created_at >= since).group_by(day)):
+        entry = series.setdefault(period_of(day_value, bucket), {"orders": 0, "revenue": 0.0})
+        entry["orders"] += count
+        entry["revenue"] += revenue or 0.0
+    by_time = [{"period": period, "orders": entry["orders"], "revenue": money(entry["revenue"])}
+               for period, entry in sorted(series.items())]
+
+    recent = [
+        {"id": row.id, "user_id": row.user_id, "user_name": row.user_name, "total": row.total, "status": row.status}
+        for row in session.query(OrderView.id, OrderView.user_id, OrderView.user_name, OrderView.total, OrderView.status)
+        .order_by(OrderView.id.desc()).limit(RECENT_ORDERS)
+    ]
+
+    return {
+        "totals": {"orders": sum(s["orders"] for s in by_status),
+                   "revenue": money(sum(s["revenue"] for s in by_status))},
+        "by_status": by_status,
+        "by_user": by_user,
+        "by_product": by_product,
+        "by_time": {"bucket": bucket, "days": days, "since": since.date().isoformat(), "series": by_time},
+        "recent": recent,
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+@app.route("/orders/analytics", methods=["GET"])
+def order_analytics():
+    """Revenue / order counts by status, user, product and time bucket (cached ANALYTICS_TTL seconds).
+
+    ?bucket=day|week|month (day), ?days=N window for the time series (30, max 366),
+    ?top=N users / products (10, max 100).
+    """
+    bucket = request.args.get("bucket", "day")
+    if bucket not in ANALYTICS_BUCKETS:
+        return jsonify({"error": f"bucket must be one of {', '.join(ANALYTICS_BUCKETS)}"}), 400
+    try:
+        days = int(request.args.get("days", 30))
+        top = int(request.args.get("top", 10))
+    except ValueError:
+        return jsonify({"error": "days and top must be integers"}), 400
+    if not 1 <= days <= MAX_ANALYTICS_DAYS or not 1 <= top <= MAX_ANALYTICS_TOP:
+        return jsonify({"error": f"days must be 1-{MAX_ANALYTICS_DAYS}, top 1-{MAX_ANALYTICS_TOP}"}), 400
+
+    def load(keys):
+        session = Session()
+        try:
+            return {key: compute_order_analytics(session, bucket, days, top) for key in keys}
+        finally:
+            session.close()
+
+    # get_many: concurrent misses for the same key share one computation
+    key = (bucket, days, top)
+    return jsonify(analytics_cache.get_many([key], load)[key])
+
+# ---- Monitoring ----
+
+@app.route("/stats/cache", methods=["GET"])
+def cache_stats():
+    return jsonify({"products": product_cache.stats(), "users": user_cache.stats(), "sync": cache_sync.stats(),
+                    "view_repair": {"interval": VIEW_REPAIR_INTERVAL, "runs": view_repair["runs"],
+                                    "repaired": view_repair["repaired"]},
+                    "analytics": analytics_cache.stats(),
+                    "etags": {"products": products_client.etags.stats(), "users": users_client.etags.stats(),
+                              "products_async": products_async.etags.stats(), "users_async": users_async.etags.stats()}})
+
+# ---- Health ----
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # Liveness: the process answers; never touches the database
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # Readiness: database reachable and pool warmed
+    ready, detail = readiness.check()
+    return jsonify(detail), (200 if ready else 503)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Prometheus scrape endpoint (aggregates all gunicorn workers)
+    return metrics_response()
+
+@app.route("/stats/traces", methods=["GET"])
+def trace_stats():
+    # Spans kept by this process (TRACE_EXPORT=memory); filter with ?trace_id= or ?request_id=
+    return jsonify(tracing.find_spans(trace_id=request.args.get("trace_id"),
+                                      request_id=request.args.get("request_id"),
+                                      limit=request.args.get("limit", 200, type=int)))
+
+@app.route("/stats/pool", methods=["GET"])
+def db_pool_stats():
+    return jsonify(pool_stats(engine))
+
+@app.route("/stats/requests", methods=["GET"])
+def serving_stats():
+    # Counters of the worker process that answers this request
+    return jsonify(request_stats.stats())
+
+@app.route("/stats/breakers", methods=["GET"])
+def breaker_stats():
+    return jsonify({"products": products_breaker.stats(), "users": users_breaker.stats()})
+
+# ---- CLI ----
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Create the database and tables (run before starting the server)."""
+    migrate(engine, DB_NAME, Base.metadata)
+    session = Session()
+    try:
+        built = ensure_order_view(session, echo=click.echo)  # đơn hàng có sẵn trước khi có order_view
+    finally:
+        session.close()
+    if built:
+        click.echo(f"order_view built for {built} orders")
+    click.echo(f"schema for {DB_NAME} is up to date")
+
+@app.cli.command("migrate-order-items")
+@click.option("--batch-size", default=500, show_default=True)
+def migrate_order_items(batch_size):
+    """Backfill order_items from the legacy comma-separated orders.product_ids column.
+
+    Idempotent: only orders without any order_items row are touched. Price and
+    name snapshots use the products service's current data (the purchase-time
+    values were never stored).
+    """
+    session = Session()
+    migrated = 0
+    last_id = 0
+    try:
+        while True:
+            orders = (session.query(Order)
+                      .filter(Order.id > last_id)
+                      .order_by(Order.id)
+                      .limit(batch_size)
+                      .all())
+            if not orders:
+                break
+            last_id = orders[-1].id
+
+            has_items = load_order_items(session, [o.id for o in orders])
+            pending = [o for o in orders if o.id not in has_items and o.product_ids]
+            if not pending:
+                continue
+
+            pids = {pid for o in pending for pid in parse_product_ids_field(o.product_ids)}
+            try:
+                prods = get_products_by_ids(pids)
+            except LookupFailed as e:
+                # Stop rather than snapshot null names / prices; rerunning resumes (done orders are skipped)
+                raise click.ClickException(f"{e}; {migrated} orders migrated so far, run again later")
+            for o in pending:
+                lines, _total = build_order_lines(parse_product_ids_field(o.product_ids), prods)
+                add_order_items(session, o.id, lines)
+            session.commit()
+            migrated += len(pending)
+            click.echo(f"migrated {migrated} orders (last id {last_id})")
+    finally:
+        session.close()
+    click.echo(f"done: {migrated} orders migrated to order_items")
+
+@app.cli.command("rebuild-order-view")
+@click.option("--batch-size", default=500, show_default=True)
+def rebuild_order_view(batch_size):
+    """Regenerate the order_view read model from orders + order_items in bulk (safe while serving)."""
+    session = Session()
+    try:
+        written, orphans = sync_order_view(session, batch_size, echo=click.echo)
+    finally:
+        session.close()
+    click.echo(f"done: order_view holds {written} orders ({orphans} orphan rows deleted)")
+
 if __name__ == "__main__":
-    # debug True OK for dev; in prod use gunicorn/uwsgi
-    app.run(host="0.0.0.0", port=ORDERS_PORT, debug=True)
\ No newline at end of file
+    # Dev server only (FLASK_DEBUG=0 to turn off the reloader); production: gunicorn -c common/gunicorn_conf.py
+    app.run(host="0.0.0.0", port=ORDERS_PORT, debug=os.getenv("FLASK_DEBUG", "1") == "1")
\ No newline at end of file
@@ -1,48 +1,46 @@
 from flask import Flask, request, jsonify
-from sqlalchemy import create_engine, Column, Integer, Float, String, text, exc
+from sqlalchemy import Column, DateTime, Integer, Float, String, func
 from sqlalchemy.orm import declarative_base, sessionmaker
 from flask_cors import CORS
 from dotenv import load_dotenv
+import click
 import os
-import requests
-import time
+import sys
+from datetime import datetime, timezone
+
+# Cho phép import package "common" khi chạy trực tiếp từ thư mục service
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import make_engine, migrate, pool_stats, identity_insert
+from common.health import Readiness
+from common.request_stats import RequestStats
+from common.metrics import instrument_app, metrics_response
+from common import tracing
+from common import responses
+from common.http_client import client_from_env
+from common.cache import TTLCache
+from common.breaker import CircuitOpenError, breaker_from_env
+from common.pagination import parse_page_args, is_paginated, apply_keyset, page_payload, stream_json_array
+from common.projection import parse_fields, select_columns, pick
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:3000"])
+request_stats = RequestStats(app)
+instrument_app(app)
+tracing.init_app(app, "payments")
+responses.init_app(app)
 
-DB_USER = os.getenv("DB_USER")
-DB_PASS = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("PAYMENTS_DB") # Đọc PAYMENTS_DB
 
-# === LOGIC TỰ TẠO DATABASE ===
-def init_db():
-    master_engine = create_engine(
-        f"mssql+pymssql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/master",
-        isolation_level="AUTOCOMMIT"
-    )
-    
-    try:
-        with master_engine.connect() as conn:
-            conn.execute(text(f"IF NOT EXISTS (SELECT name FROM sys.databases WHERE name = N'{DB_NAME}') CREATE DATABASE [{DB_NAME}]"))
-        print(f"Database '{DB_NAME}' is ready.")
-    except exc.SQLAlchemyError as e:
-        print(f"Error creating database: {e}")
-        time.sleep(5)
-        init_db()
-    finally:
-        master_engine.dispose()
+# Pooled keep-alive client; base URL / timeout / retries come from ORDERS_* env vars
+orders_breaker = breaker_from_env("orders")
+orders_client = client_from_env("orders", "http://localhost:5003", breaker=orders_breaker)
 
-    db_engine = create_engine(f"mssql+pymssql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
-    return db_engine
-# ===============================
-
-engine = init_db()
+engine = make_engine(DB_NAME) # Chưa kết nối DB; tạo DB + bảng bằng `flask migrate`
 Base = declarative_base()
 Session = sessionmaker(bind=engine)
+readiness = Readiness(engine)
 
 class Payment(Base):
     __tablename__ = "payments"
@@ -51,20 +49,24 @@ class Payment(Base):
     amount = Column(Float)
     method = Column(String(50))
     status = Column(String(50))
+    # Thời điểm tạo (UTC); payment cũ trước khi có cột = NULL
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None), index=True)
 
-Base.metadata.create_all(engine)
 
 def get_order_total(order_id):
-    """Fetch order total from Orders service"""
+    """Fetch order total from Orders service (None if the service is unavailable)"""
     try:
-        # Sửa: Dùng tên service 'orders' thay vì 'localhost'
-        response = requests.get(f"http://orders:5003/orders/{order_id}")
+        response = orders_client.get(f"/orders/{order_id}/", params={"fields": "total"})
         if response.status_code == 200:
             order = response.json()
             return order.get('total', 0)
+        if response.status_code >= 500:
+            return None
         return 0
+    except CircuitOpenError:
+        return None
     except:
-        return 0
+        return None
 
 @app.route("/payments", methods=["POST"])
 def make_payment():
@@ -83,6 +85,8 @@ def make_payment():
         
         # Get amount from order
         amount = get_order_total(order_id)
+        if amount is None:
+            return jsonify({"error": "Orders service unavailable, try again later"}), 503
         if amount <= 0:
             return jsonify({"error": "Invalid order or order total is 0"}), 400
         
@@ -97,24 +101,16 @@ def make_payment():
             if existing:
                 return jsonify({"error": "ID already exists"}), 409
             
-            try:
-                session.execute(text("SET IDENTITY_INSERT payments ON"))
+            with identity_insert(session, "payments"):
                 payment = Payment(id=custom_id, order_id=order_id, amount=amount, method=method, status=status)
                 session.add(payment)
-                session.commit()
-                session.execute(text("SET IDENTITY_INSERT payments OFF"))
-                session.commit()
-                return jsonify({
-                    "message": "Payment created with custom ID",
-                    "id": payment.id,
-                    "amount": amount,
-                    "status": status
-                }), 201
-            except Exception as e:
-                session.rollback()
-                session.execute(text("SET IDENTITY_INSERT payments OFF"))
-                session.commit()
-                raise e
+            session.commit()
+            return jsonify({
+                "message": "Payment created with custom ID",
+                "id": payment.id,
+                "amount": amount,
+                "status": status
+            }), 201
         else:
             payment = Payment(order_id=order_id, amount=amount, method=method, status=status)
             session.add(payment)
@@ -134,31 +130,56 @@ def make_payment():
     finally:
         session.close()
 
+PAYMENT_FIELDS = ("id", "order_id", "amount", "method", "status")
+
+def payment_to_dict(p, fields=PAYMENT_FIELDS):
+    return pick(p, fields)
+
+def serialize_payments(payments, fields=PAYMENT_FIELDS):
+    return [payment_to_dict(p, fields) for p in payments]
+
+def search_payments_query(session, search):
+    query = session.query(Payment)
+    if search:
+        try:
+            search_id = int(search)
+            query = query.filter((Payment.id == search_id) | (Payment.order_id == search_id))
+        except ValueError:
+            query = query.filter(
+                (Payment.method.like(f"%{search}%")) | 
+                (Payment.status.like(f"%{search}%"))
+            )
+    return query
+
 @app.route("/payments", methods=["GET"])
 def list_payments():
+    try:
+        page = parse_page_args(request.args)
+    except ValueError:
+        return jsonify({"error": "limit and after must be integers (limit > 0)"}), 400
+    try:
+        fields = parse_fields(request.args, PAYMENT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    search = request.args.get('search', '').strip()
+    serialize = lambda rows: serialize_payments(rows, fields)
+
+    if page.stream:
+        return stream_json_array(
+            Session,
+            lambda s: apply_keyset(select_columns(search_payments_query(s, search), Payment, fields), Payment.id, page, probe=False),
+            serialize,
+        )
+
     session = Session()
     try:
-        search = request.args.get('search', '').strip()
-        query = session.query(Payment)
-        
-        if search:
-            try:
-                search_id = int(search)
-                query = query.filter((Payment.id == search_id) | (Payment.order_id == search_id))
-            except ValueError:
-                query = query.filter(
-                    (Payment.method.like(f"%{search}%")) | 
-                    (Payment.status.like(f"%{search}%"))
-                )
-        
+        query = select_columns(search_payments_query(session, search), Payment, fields)
+        if is_paginated(page):
+            rows = apply_keyset(query, Payment.id, page).all()
+            return jsonify(page_payload(rows, page, serialize))
+
         payments = query.all()
-        return jsonify([{
-            "id": p.id,
-            "order_id": p.order_id,
-            "amount": p.amount,
-            "method": p.method,
-            "status": p.status
-        } for p in payments])
+        return jsonify(serialize(payments))
     finally:
         session.close()
 
@@ -187,29 +208,23 @@ def update_payment(id):
             old_amount = payment.amount
             old_method = payment.method
             old_status = payment.status
+            old_created_at = payment.created_at  # đổi ID không đổi ngày tạo
             
             session.delete(payment)
-            session.commit()
+            session.flush()
             
-            try:
-                session.execute(text("SET IDENTITY_INSERT payments ON"))
+            with identity_insert(session, "payments"):
                 new_payment = Payment(
                     id=new_id,
                     order_id=data.get("order_id", old_order_id),
                     amount=data.get("amount", old_amount),
                     method=data.get("method", old_method),
-                    status=data.get("status", old_status)
+                    status=data.get("status", old_status),
+                    created_at=old_created_at
                 )
                 session.add(new_payment)
-                session.commit()
-                session.execute(text("SET IDENTITY_INSERT payments OFF"))
-                session.commit()
-                return jsonify({"message": "Payment updated with new ID", "new_id": new_id}), 200
-            except Exception as e:
-                session.rollback()
-                session.execute(text("SET IDENTITY_INSERT payments OFF"))
-                session.commit()
-                raise e
+            session.commit()
+            return jsonify({"message": "Payment updated with new ID", "new_id": new_id}), 200
         else:
             payment.order_id = data.get("order_id", payment.order_id)
             payment.amount = data.get("amount", payment.amount)
@@ -242,5 +257,88 @@ def delete_payment(id):
     finally:
         session.close()
 
+# ---- Analytics (Dashboard) ----
+ANALYTICS_TTL = float(os.getenv("ANALYTICS_TTL", 10))
+analytics_cache = TTLCache(maxsize=1, ttl=ANALYTICS_TTL, name="analytics")
+
+def sorted_groups(groups):
+    return [dict(entry, amount=round(entry["amount"], 2))
+            for _key, entry in sorted(groups.items(), key=lambda item: str(item[0]))]
+
+def compute_payment_analytics(session):
+    """One GROUP BY (method, status) in the database, rolled up per method and per status here."""
+    by_method, by_status = {}, {}
+    count_all, amount_all = 0, 0.0
+    for method, status, count, amount in (session.query(Payment.method, Payment.status,
+                                                        func.count(Payment.id), func.sum(Payment.amount))
+                                          .group_by(Payment.method, Payment.status)):
+        amount = amount or 0.0
+        for groups, key, name in ((by_method, method, "method"), (by_status, status, "status")):
+            entry = groups.setdefault(key, {name: key, "payments": 0, "amount": 0.0})
+            entry["payments"] += count
+            entry["amount"] += amount
+        count_all += count
+        amount_all += amount
+    return {
+        "totals": {"payments": count_all, "amount": round(amount_all, 2)},
+        "by_method": sorted_groups(by_method),
+        "by_status": sorted_groups(by_status),
+    }
+
+@app.route("/payments/analytics", methods=["GET"])
+def payment_analytics():
+    """Payment counts and amounts by method and by status (cached ANALYTICS_TTL seconds)."""
+    def load(keys):
+        session = Session()
+        try:
+            return {"all": compute_payment_analytics(session)}
+        finally:
+            session.close()
+
+    return jsonify(analytics_cache.get_many(["all"], load)["all"])
+
+# ---- Health ----
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # Liveness: the process answers; never touches the database
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # Readiness: database reachable and pool warmed
+    ready, detail = readiness.check()
+    return jsonify(detail), (200 if ready else 503)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Prometheus scrape endpoint (aggregates all gunicorn workers)
+    return metrics_response()
+
+@app.route("/stats/traces", methods=["GET"])
+def trace_stats():
+    # Spans kept by this process (TRACE_EXPORT=memory); filter with ?trace_id= or ?request_id=
+    return jsonify(tracing.find_spans(trace_id=request.args.get("trace_id"),
+                                      request_id=request.args.get("request_id"),
+                                      limit=request.args.get("limit", 200, type=int)))
+
+@app.route("/stats/pool", methods=["GET"])
+def db_pool_stats():
+    return jsonify(pool_stats(engine))
+
+@app.route("/stats/requests", methods=["GET"])
+def serving_stats():
+    # Counters of the worker process that answers this request
+    return jsonify(request_stats.stats())
+
+# ---- CLI ----
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Create the database and tables (run before starting the server)."""
+    migrate(engine, DB_NAME, Base.metadata)
+    click.echo(f"schema for {DB_NAME} is up to date")
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.getenv("PAYMENTS_PORT", 5004)), debug=True)
\ No newline at end of file
+    # Dev server only (FLASK_DEBUG=0 to turn off the reloader); production: gunicorn -c common/gunicorn_conf.py
+    app.run(host="0.0.0.0", port=int(os.getenv("PAYMENTS_PORT", 5004)), debug=os.getenv("FLASK_DEBUG", "1") == "1")
\ No newline at end of file
@@ -1,53 +1,44 @@
 from flask import Flask, request, jsonify
-from sqlalchemy import create_engine, Column, Integer, String, Float, text, exc
+from sqlalchemy import Column, Integer, String, Float, Unicode, func
 from sqlalchemy.orm import declarative_base, sessionmaker
 from flask_cors import CORS
 from dotenv import load_dotenv
+import click
+import math
 import os
-import time
+import sys
+
+# Cho phép import package "common" khi chạy trực tiếp từ thư mục service
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import make_engine, migrate, pool_stats, identity_insert
+from common.health import Readiness
+from common.request_stats import RequestStats
+from common.metrics import instrument_app, metrics_response
+from common import tracing
+from common import responses
+from common.pagination import parse_page_args, is_paginated, apply_keyset, page_payload, stream_json_array
+from common.projection import parse_fields, select_columns, pick
+from common.events import publisher_from_env
+from common.search import SearchIndex
+from common.bulk_import import ImportFormatError, read_records, insert_rows, run_import
+from common.data_version import DataVersion
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:3000"])
+request_stats = RequestStats(app)
+instrument_app(app)
+tracing.init_app(app, "products")
+# GET cache được ở gateway; key cache + ETag theo catalog_version nên ghi xong thấy ngay
+responses.init_app(app, cache_paths=("/products/",), version=lambda: catalog_version.current())
 
-DB_USER = os.getenv("DB_USER")
-DB_PASS = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("PRODUCTS_DB") # Đọc PRODUCTS_DB
 
-# === LOGIC TỰ TẠO DATABASE ===
-def init_db():
-    master_engine = create_engine(
-        f"mssql+pymssql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/master",
-        isolation_level="AUTOCOMMIT"
-    )
-    
-    # SỬA: Tăng số lần thử lên 15
-    retries = 50
-    while retries > 0:
-        try:
-            with master_engine.connect() as conn:
-                conn.execute(text(f"IF NOT EXISTS (SELECT name FROM sys.databases WHERE name = N'{DB_NAME}') CREATE DATABASE [{DB_NAME}]"))
-            print(f"Database '{DB_NAME}' is ready.")
-            break
-        except exc.SQLAlchemyError as e:
-            print(f"Error creating database (hoặc DB chưa sẵn sàng): {e}")
-            retries -= 1
-            time.sleep(5)
-    
-    master_engine.dispose()
-    if retries == 0:
-        raise Exception(f"Không thể tạo hoặc kết nối đến database {DB_NAME}")
-
-    db_engine = create_engine(f"mssql+pymssql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
-    return db_engine
-# ===============================
-
-engine = init_db()
+engine = make_engine(DB_NAME) # Chưa kết nối DB; tạo DB + bảng bằng `flask migrate`
 Base = declarative_base()
 Session = sessionmaker(bind=engine)
+readiness = Readiness(engine)
 
 class Product(Base):
     __tablename__ = "products"
@@ -55,7 +46,59 @@ class Product(Base):
     name = Column(String(100))
     price = Column(Float)
 
-Base.metadata.create_all(engine)
+class ProductSearchGram(Base):
+    """N-gram postings for name search (see common/search.py)."""
+    __tablename__ = "products_search"
+    gram = Column(Unicode(3), primary_key=True)
+    entity_id = Column(Integer, primary_key=True, index=True)  # = products.id
+
+class DataVersionRow(Base):
+    """Catalog version, advanced by every write (see common/data_version.py)."""
+    __tablename__ = "data_versions"
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+# SEARCH_BACKEND=sql (bảng products_search) hoặc memory (index trong process)
+product_search = SearchIndex(Session, Product, ("name",), ProductSearchGram)
+catalog_version = DataVersion(Session, DataVersionRow, "products")
+
+
+# ---- Batch lookup limits ----
+MAX_BATCH_IDS = 1000   # max ids accepted by GET /products/?ids=...
+IN_CHUNK_SIZE = 500    # ids per IN (...) clause (SQL Server allows ~2100 params)
+
+def parse_ids_param(raw):
+    """Parse "1,2,3" into a de-duplicated list of positive ints (order kept)."""
+    ids = []
+    seen = set()
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        value = int(part)
+        if value <= 0:
+            raise ValueError("ids must be positive")
+        if value not in seen:
+            seen.add(value)
+            ids.append(value)
+    return ids
+
+PRODUCT_FIELDS = ("id", "name", "price")
+
+def product_to_dict(p, fields=PRODUCT_FIELDS):
+    return pick(p, fields)
+
+# ---- Change notifications (consumed by the orders service) ----
+events = publisher_from_env()
+
+def publish_product_upserted(p):
+    events.publish({"type": "product.upserted", **product_to_dict(p)})
+
+def publish_product_deleted(product_id):
+    events.publish({"type": "product.deleted", "id": product_id})
+
+def serialize_products(products, fields=PRODUCT_FIELDS):
+    return [product_to_dict(p, fields) for p in products]
 
 # SỬA: Thêm dấu /
 @app.route("/products/", methods=["POST"])
@@ -81,23 +124,22 @@ def create_product():
             if existing:
                 return jsonify({"error": "ID already exists"}), 409
             
-            try:
-                session.execute(text("SET IDENTITY_INSERT products ON"))
+            with identity_insert(session, "products"):
                 product = Product(id=custom_id, name=data["name"], price=price)
                 session.add(product)
-                session.commit()
-                session.execute(text("SET IDENTITY_INSERT products OFF"))
-                session.commit()
-                return jsonify({"message": "Product created with custom ID", "id": product.id}), 201
-            except Exception as e:
-                session.rollback()
-                session.execute(text("SET IDENTITY_INSERT products OFF"))
-                session.commit()
-                raise e
+            product_search.index(session, product)
+            catalog_version.bump(session)
+            session.commit()
+            publish_product_upserted(product)
+            return jsonify({"message": "Product created with custom ID", "id": product.id}), 201
         else:
             product = Product(name=data["name"], price=price)
             session.add(product)
+            session.flush()  # id cho search index
+            product_search.index(session, product)
+            catalog_version.bump(session)
             session.commit()
+            publish_product_upserted(product)
             return jsonify({"message": "Product created", "id": product.id}), 201
             
     except ValueError:
@@ -111,16 +153,86 @@ def create_product():
 # SỬA: Thêm dấu /
 @app.route("/products/", methods=["GET"])
 def list_products():
+    try:
+        page = parse_page_args(request.args)
+    except ValueError:
+        return jsonify({"error": "limit and after must be integers (limit > 0)"}), 400
+    try:
+        fields = parse_fields(request.args, PRODUCT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # ?search= rỗng hoặc chỉ có khoảng trắng = không lọc (trả cả danh sách, như trước khi có search index)
+    search = request.args.get('search', '').strip()
+    serialize = lambda rows: serialize_products(rows, fields)
+    if search and page.after is not None:
+        return jsonify({"error": "after is not supported with search (results are ranked)"}), 400
+
+    if page.stream and not search and request.args.get('ids') is None:
+        return stream_json_array(
+            Session,
+            lambda s: apply_keyset(select_columns(s.query(Product), Product, fields), Product.id, page, probe=False),
+            serialize,
+        )
+
     session = Session()
     try:
-        search = request.args.get('search', '').strip()
-        query = session.query(Product)
-        
+        ids_param = request.args.get('ids')
+        if ids_param is not None:
+            # Batch lookup: GET /products/?ids=1,2,3 (used by the orders service)
+            try:
+                ids = parse_ids_param(ids_param)
+            except ValueError:
+                return jsonify({"error": "ids must be a comma-separated list of positive integers"}), 400
+            if len(ids) > MAX_BATCH_IDS:
+                return jsonify({"error": f"Too many ids (max {MAX_BATCH_IDS})"}), 400
+
+            products = []
+            for i in range(0, len(ids), IN_CHUNK_SIZE):
+                chunk = ids[i:i + IN_CHUNK_SIZE]
+                products.extend(select_columns(session.query(Product), Product, fields).filter(Product.id.in_(chunk)).order_by(Product.id).all())
+            return jsonify(serialize(products))  # ETag / 304: catalog version (responses.version_check)
+
         if search:
-            query = query.filter(Product.name.like(f"%{search}%"))
-        
+            # Ranked n-gram search: best matches first, ?limit=N keeps the top N
+            products = serialize(product_search.search(session, search, limit=page.limit))
+            return jsonify({"items": products, "next_cursor": None} if page.limit is not None else products)
+
+        query = select_columns(session.query(Product), Product, fields)
+        if is_paginated(page):
+            rows = apply_keyset(query, Product.id, page).all()
+            return jsonify(page_payload(rows, page, serialize))
+
         products = query.all()
-        return jsonify([{"id": p.id, "name": p.name, "price": p.price} for p in products])
+        return jsonify(serialize(products))
+    finally:
+        session.close()
+
+@app.route("/products/version", methods=["GET"])
+def get_catalog_version():
+    """Catalog version, also in X-Data-Version: the gateway reads it for its cache key (nginx.conf)."""
+    return jsonify({"version": catalog_version.current()})
+
+@app.route("/products/count", methods=["GET"])
+def count_products():
+    # Dashboard: COUNT(*) thay vì tải cả danh sách (GET cache ở gateway vài giây)
+    session = Session()
+    try:
+        return jsonify({"count": session.query(func.count(Product.id)).scalar()})
+    finally:
+        session.close()
+
+@app.route("/products/<int:id>/", methods=["GET"])
+def get_product(id):
+    try:
+        fields = parse_fields(request.args, PRODUCT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    session = Session()
+    try:
+        product = select_columns(session.query(Product), Product, fields).filter(Product.id == id).first()
+        if not product:
+            return jsonify({"error": "Product not found"}), 404
+        return jsonify(product_to_dict(product, fields))
     finally:
         session.close()
 
@@ -156,30 +268,30 @@ def update_product(id):
             old_price = product.price
             
             session.delete(product)
-            session.commit()
+            session.flush()
             
-            try:
-                session.execute(text("SET IDENTITY_INSERT products ON"))
+            with identity_insert(session, "products"):
                 new_product = Product(
                     id=new_id,
                     name=data.get("name", old_name),
                     price=data.get("price", old_price)
                 )
                 session.add(new_product)
-                session.commit()
-                session.execute(text("SET IDENTITY_INSERT products OFF"))
-                session.commit()
-                return jsonify({"message": "Product updated with new ID", "new_id": new_id}), 200
-            except Exception as e:
-                session.rollback()
-                session.execute(text("SET IDENTITY_INSERT products OFF"))
-                session.commit()
-                raise e
+            product_search.remove(session, id)
+            product_search.index(session, new_product)
+            catalog_version.bump(session)
+            session.commit()
+            publish_product_deleted(id)
+            publish_product_upserted(new_product)
+            return jsonify({"message": "Product updated with new ID", "new_id": new_id}), 200
         else:
             product.name = data.get("name", product.name)
             if "price" in data:
                  product.price = data["price"] # Sửa lỗi gõ sai
+            product_search.index(session, product)
+            catalog_version.bump(session)
             session.commit()
+            publish_product_upserted(product)
             return jsonify({"message": "Product updated"}), 200
             
     except ValueError:
@@ -199,7 +311,10 @@ def delete_product(id):
         if not product:
             return jsonify({"error": "Product not found"}), 404
         session.delete(product)
+        product_search.remove(session, id)
+        catalog_version.bump(session)
         session.commit()
+        publish_product_deleted(id)
         return jsonify({"message": "Product deleted"}), 200
     except Exception as e:
         session.rollback()
@@ -207,5 +322,120 @@ def delete_product(id):
     finally:
         session.close()
 
+# ---- Bulk import ----
+
+def validate_import_row(record):
+    """Values to insert for one import row (same rules as POST /products/)."""
+    name = record.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("name is required")
+    if len(name) > 100:
+        raise ValueError("name must be at most 100 characters")
+    try:
+        price = float(record.get("price", 0))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid price format")
+    if not math.isfinite(price) or price <= 0:
+        raise ValueError("Price must be greater than 0")
+    values = {"name": name, "price": price}
+    custom_id = record.get("id")
+    if custom_id not in (None, ""):
+        try:
+            values["id"] = int(custom_id)
+        except (TypeError, ValueError):
+            raise ValueError("ID must be a positive integer")
+        if values["id"] <= 0:
+            raise ValueError("ID must be a positive integer")
+    return values
+
+def write_import_chunk(session, rows):
+    products = insert_rows(session, Product, rows, (Product.id, Product.name, Product.price))
+    product_search.index_many(session, products)
+    catalog_version.bump(session)
+    # Event chỉ cho id tự chọn (có thể là id đã xoá, còn trong cache của orders);
+    # id autoincrement mới chưa nằm trong cache nào
+    explicit = {row["id"] for row in rows if "id" in row}
+    return [product for product in products if product.id in explicit]
+
+def publish_imported(products):
+    for product in products:
+        publish_product_upserted(product)
+
+@app.route("/products/import", methods=["POST"])
+def import_products():
+    """Bulk create from an NDJSON / CSV body (name, price, optional id); per-row error report."""
+    try:
+        records = read_records(request)
+    except ImportFormatError as e:
+        return jsonify({"error": str(e)}), 415
+    report = run_import(Session, records, validate_import_row, write_import_chunk,
+                        lambda error: "ID already exists", after_commit=publish_imported)
+    return jsonify(report.to_dict()), (500 if report.aborted else 200)
+
+@app.route("/stats/events", methods=["GET"])
+def event_stats():
+    return jsonify(events.stats())
+
+# ---- Health ----
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # Liveness: the process answers; never touches the database
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # Readiness: database reachable and pool warmed
+    ready, detail = readiness.check()
+    return jsonify(detail), (200 if ready else 503)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Prometheus scrape endpoint (aggregates all gunicorn workers)
+    return metrics_response()
+
+@app.route("/stats/traces", methods=["GET"])
+def trace_stats():
+    # Spans kept by this process (TRACE_EXPORT=memory); filter with ?trace_id= or ?request_id=
+    return jsonify(tracing.find_spans(trace_id=request.args.get("trace_id"),
+                                      request_id=request.args.get("request_id"),
+                                      limit=request.args.get("limit", 200, type=int)))
+
+@app.route("/stats/pool", methods=["GET"])
+def db_pool_stats():
+    return jsonify(pool_stats(engine))
+
+@app.route("/stats/requests", methods=["GET"])
+def serving_stats():
+    # Counters of the worker process that answers this request
+    return jsonify(request_stats.stats())
+
+# ---- CLI ----
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Create the database and tables (run before starting the server)."""
+    migrate(engine, DB_NAME, Base.metadata)
+    session = Session()
+    try:
+        indexed = product_search.ensure_built(session, echo=click.echo)  # dữ liệu có sẵn trước khi có search index
+        catalog_version.ensure(session)
+    finally:
+        session.close()
+    if indexed:
+        click.echo(f"search index built for {indexed} products")
+    click.echo(f"schema for {DB_NAME} is up to date")
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Re-index every product for ?search= (after bulk loads or switching backends)."""
+    session = Session()
+    try:
+        count = product_search.rebuild(session, echo=click.echo)
+        click.echo(f"search index rebuilt: {count} products")
+    finally:
+        session.close()
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.getenv("PRODUCTS_PORT", 5002)), debug=True)
\ No newline at end of file
+    # Dev server only (FLASK_DEBUG=0 to turn off the reloader); production: gunicorn -c common/gunicorn_conf.py
+    app.run(host="0.0.0.0", port=int(os.getenv("PRODUCTS_PORT", 5002)), debug=os.getenv("FLASK_DEBUG", "1") == "1")
\ No newline at end of file
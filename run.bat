@@ -17,16 +17,16 @@ if not exist "%VENV_PATH%" (
 
 REM === Khởi động từng service trong cửa sổ riêng ===
 echo 🔹 Starting User Service (port 5001)...
-start cmd /k "cd C:\Users\Dell\foodfast\users && call %VENV_PATH% && python users.py"
+start cmd /k "cd C:\Users\Dell\foodfast\users && call %VENV_PATH% && flask --app users migrate && python users.py"
 
 echo 🔹 Starting Product Service (port 5003)...
-start cmd /k "cd C:\Users\Dell\foodfast\orders && call %VENV_PATH% && python orders.py"
+start cmd /k "cd C:\Users\Dell\foodfast\orders && call %VENV_PATH% && flask --app orders migrate && python orders.py"
 
 echo 🔹 Starting Order Service (port 5002)...
-start cmd /k "cd C:\Users\Dell\foodfast\products && call %VENV_PATH% && python products.py"
+start cmd /k "cd C:\Users\Dell\foodfast\products && call %VENV_PATH% && flask --app products migrate && python products.py"
 
 echo 🔹 Starting Payment Service (port 5004)...
-start cmd /k "cd C:\Users\Dell\foodfast\payments && call %VENV_PATH% && python payments.py"
+start cmd /k "cd C:\Users\Dell\foodfast\payments && call %VENV_PATH% && flask --app payments migrate && python payments.py"
 
 echo.
 echo ✅ Tất cả các service đã được khởi động trong các cửa sổ riêng biệt!
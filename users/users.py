@@ -1,71 +1,118 @@
 from flask import Flask, request, jsonify
-from sqlalchemy import create_engine, Column, Integer, String, text, exc
+from sqlalchemy import Column, Index, Integer, String, Unicode, func, text, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import declarative_base, sessionmaker
 from flask_cors import CORS
 from dotenv import load_dotenv
+import click
 import os
 import re
-import time
+import sys
+
+# Cho phép import package "common" khi chạy trực tiếp từ thư mục service
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import make_engine, migrate, pool_stats, identity_insert, violated_constraint
+from common.health import Readiness
+from common.request_stats import RequestStats
+from common.metrics import instrument_app, metrics_response
+from common import tracing
+from common import responses
+from common.pagination import parse_page_args, is_paginated, apply_keyset, page_payload, stream_json_array
+from common.projection import parse_fields, select_columns, pick
+from common.events import publisher_from_env
+from common.search import SearchIndex
+from common.bulk_import import ImportFormatError, read_records, insert_rows, run_import
 
 # Load env
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:3000"])
+request_stats = RequestStats(app)
+instrument_app(app)
+tracing.init_app(app, "users")
+# Có email -> private: chỉ browser được cache, gateway / proxy dùng chung thì không
+responses.init_app(app, cache_paths=("/users/",), shared=False)
 
-DB_USER = os.getenv("DB_USER")
-DB_PASS = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("USERS_DB") # Đọc USERS_DB từ .env
 
-# === LOGIC TỰ TẠO DATABASE ===
-def init_db():
-    # 1. Kết nối đến 'master' db trước
-    master_engine = create_engine(
-        f"mssql+pymssql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/master",
-        isolation_level="AUTOCOMMIT"
-    )
-    
-    # SỬA: Tăng số lần thử lên 15
-    retries = 30
-    while retries > 0:
-        try:
-            with master_engine.connect() as conn:
-                conn.execute(text(f"IF NOT EXISTS (SELECT name FROM sys.databases WHERE name = N'{DB_NAME}') CREATE DATABASE [{DB_NAME}]"))
-            print(f"Database '{DB_NAME}' is ready.")
-            break # Thành công, thoát vòng lặp
-        except exc.SQLAlchemyError as e:
-            print(f"Error creating database (hoặc DB chưa sẵn sàng): {e}")
-            retries -= 1
-            time.sleep(5) # Chờ 5 giây rồi thử lại
-    
-    master_engine.dispose()
-    if retries == 0:
-        raise Exception(f"Không thể tạo hoặc kết nối đến database {DB_NAME}")
-
-    # 3. Bây giờ mới tạo engine chính kết nối đến database của service
-    db_engine = create_engine(f"mssql+pymssql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
-    return db_engine
-# ===============================
-
-engine = init_db() # Chạy logic init
+engine = make_engine(DB_NAME) # Chưa kết nối DB; tạo DB + bảng bằng `flask migrate`
 Base = declarative_base()
 Session = sessionmaker(bind=engine)
+readiness = Readiness(engine)
 
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(100))
     email = Column(String(100))
+    # Unique email: tra cứu theo index, đăng ký đồng thời không tạo trùng (NULL cũ được bỏ qua)
+    __table_args__ = (
+        Index("uq_users_email", "email", unique=True,
+              mssql_where=text("email IS NOT NULL"), sqlite_where=text("email IS NOT NULL")),
+    )
+
+class UserSearchGram(Base):
+    """N-gram postings for name/email search (see common/search.py)."""
+    __tablename__ = "users_search"
+    gram = Column(Unicode(3), primary_key=True)
+    entity_id = Column(Integer, primary_key=True, index=True)  # = users.id
+
+# SEARCH_BACKEND=sql (bảng users_search) hoặc memory (index trong process)
+user_search = SearchIndex(Session, User, ("name", "email"), UserSearchGram)
+
+
+# ---- Batch lookup limits ----
+MAX_BATCH_IDS = 1000   # max ids accepted by GET /users/?ids=...
+IN_CHUNK_SIZE = 500    # ids per IN (...) clause (SQL Server allows ~2100 params)
+
+def parse_ids_param(raw):
+    """Parse "1,2,3" into a de-duplicated list of positive ints (order kept)."""
+    ids = []
+    seen = set()
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        value = int(part)
+        if value <= 0:
+            raise ValueError("ids must be positive")
+        if value not in seen:
+            seen.add(value)
+            ids.append(value)
+    return ids
+
+USER_FIELDS = ("id", "name", "email")
+
+def user_to_dict(u, fields=USER_FIELDS):
+    return pick(u, fields)
 
-Base.metadata.create_all(engine) # Tạo bảng
+# ---- Change notifications (consumed by the orders read model) ----
+events = publisher_from_env()
+
+def publish_user_upserted(u):
+    events.publish({"type": "user.upserted", **user_to_dict(u)})
+
+def publish_user_deleted(user_id):
+    events.publish({"type": "user.deleted", "id": user_id})
+
+def serialize_users(users, fields=USER_FIELDS):
+    return [user_to_dict(u, fields) for u in users]
 
 def validate_email(email):
     """Validate email format"""
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+def conflict_message(error, id_message="ID already exists"):
+    """Which unique constraint was violated: the email index or the primary key."""
+    if violated_constraint(error, "uq_users_email", "users.email"):
+        return "Email already exists"
+    return id_message
+
+def conflict_response(error, id_message="ID already exists"):
+    return jsonify({"error": conflict_message(error, id_message)}), 409
+
 @app.route("/users/", methods=["POST"])
 def create_user():
     session = Session()
@@ -78,42 +125,31 @@ def create_user():
         
         custom_id = data.get("id")
         
+        # Không kiểm tra trước: PK + uq_users_email chặn trùng, IntegrityError -> 409
         if custom_id:
             custom_id = int(custom_id)
             if custom_id <= 0:
                 return jsonify({"error": "ID must be positive"}), 400
-                
-            existing_user = session.query(User).filter(User.id == custom_id).first()
-            if existing_user:
-                return jsonify({"error": "ID already exists"}), 409
             
-            existing_email = session.query(User).filter(User.email == email).first()
-            if existing_email:
-                return jsonify({"error": "Email already exists"}), 409
-            
-            try:
-                session.execute(text("SET IDENTITY_INSERT users ON"))
+            with identity_insert(session, "users"):
                 user = User(id=custom_id, name=data["name"], email=email)
                 session.add(user)
-                session.commit()
-                session.execute(text("SET IDENTITY_INSERT users OFF"))
-                session.commit()
-                return jsonify({"message": "User created with custom ID", "id": user.id}), 201
-            except Exception as e:
-                session.rollback()
-                session.execute(text("SET IDENTITY_INSERT users OFF"))
-                session.commit()
-                raise e
+            user_search.index(session, user)
+            session.commit()
+            publish_user_upserted(user)
+            return jsonify({"message": "User created with custom ID", "id": user.id}), 201
         else:
-            existing_email = session.query(User).filter(User.email == email).first()
-            if existing_email:
-                return jsonify({"error": "Email already exists"}), 409
-                
             user = User(name=data["name"], email=email)
             session.add(user)
+            session.flush()  # id cho search index
+            user_search.index(session, user)
             session.commit()
+            publish_user_upserted(user)
             return jsonify({"message": "User created", "id": user.id}), 201
             
+    except IntegrityError as e:
+        session.rollback()
+        return conflict_response(e)
     except ValueError:
         return jsonify({"error": "Invalid data format"}), 400
     except Exception as e:
@@ -124,19 +160,81 @@ def create_user():
 
 @app.route("/users/", methods=["GET"])
 def list_users():
+    try:
+        page = parse_page_args(request.args)
+    except ValueError:
+        return jsonify({"error": "limit and after must be integers (limit > 0)"}), 400
+    try:
+        fields = parse_fields(request.args, USER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # ?search= rỗng hoặc chỉ có khoảng trắng = không lọc (trả cả danh sách, như trước khi có search index)
+    search = request.args.get('search', '').strip()
+    serialize = lambda rows: serialize_users(rows, fields)
+    if search and page.after is not None:
+        return jsonify({"error": "after is not supported with search (results are ranked)"}), 400
+
+    if page.stream and not search and request.args.get('ids') is None:
+        return stream_json_array(
+            Session,
+            lambda s: apply_keyset(select_columns(s.query(User), User, fields), User.id, page, probe=False),
+            serialize,
+        )
+
     session = Session()
     try:
-        search = request.args.get('search', '').strip()
-        query = session.query(User)
-        
+        ids_param = request.args.get('ids')
+        if ids_param is not None:
+            # Batch lookup: GET /users/?ids=1,2,3 (used by the orders service)
+            try:
+                ids = parse_ids_param(ids_param)
+            except ValueError:
+                return jsonify({"error": "ids must be a comma-separated list of positive integers"}), 400
+            if len(ids) > MAX_BATCH_IDS:
+                return jsonify({"error": f"Too many ids (max {MAX_BATCH_IDS})"}), 400
+
+            users = []
+            for i in range(0, len(ids), IN_CHUNK_SIZE):
+                chunk = ids[i:i + IN_CHUNK_SIZE]
+                users.extend(select_columns(session.query(User), User, fields).filter(User.id.in_(chunk)).all())
+            return jsonify(serialize(users))
+
         if search:
-            query = query.filter(
-                (User.name.like(f"%{search}%")) | 
-                (User.email.like(f"%{search}%"))
-            )
-        
+            # Ranked n-gram search: best matches first, ?limit=N keeps the top N
+            users = serialize(user_search.search(session, search, limit=page.limit))
+            return jsonify({"items": users, "next_cursor": None} if page.limit is not None else users)
+
+        query = select_columns(session.query(User), User, fields)
+        if is_paginated(page):
+            rows = apply_keyset(query, User.id, page).all()
+            return jsonify(page_payload(rows, page, serialize))
+
         users = query.all()
-        return jsonify([{"id": u.id, "name": u.name, "email": u.email} for u in users])
+        return jsonify(serialize(users))
+    finally:
+        session.close()
+
+@app.route("/users/count", methods=["GET"])
+def count_users():
+    # Dashboard: COUNT(*) thay vì tải cả danh sách (GET cache ở gateway vài giây)
+    session = Session()
+    try:
+        return jsonify({"count": session.query(func.count(User.id)).scalar()})
+    finally:
+        session.close()
+
+@app.route("/users/<int:id>/", methods=["GET"])
+def get_user(id):
+    try:
+        fields = parse_fields(request.args, USER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    session = Session()
+    try:
+        user = select_columns(session.query(User), User, fields).filter(User.id == id).first()
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        return jsonify(user_to_dict(user, fields))
     finally:
         session.close()
 
@@ -148,22 +246,13 @@ def update_user(id):
             return jsonify({"error": "Invalid user ID"}), 400
             
         data = request.json
-        user = session.query(User).filter(User.id == id).first()
-        
-        if not user:
-            return jsonify({"error": "User not found"}), 404
-        
+        values = {}
+        if "name" in data:
+            values["name"] = data["name"]
         if "email" in data:
-            email = data["email"].strip()
-            if not validate_email(email):
+            values["email"] = data["email"].strip()
+            if not validate_email(values["email"]):
                 return jsonify({"error": "Invalid email format. Email must contain @ and domain (e.g., user@gmail.com)"}), 400
-            
-            existing_email = session.query(User).filter(
-                User.email == email,
-                User.id != id
-            ).first()
-            if existing_email:
-                return jsonify({"error": "Email already exists"}), 409
         
         new_id = data.get("id")
         
@@ -171,49 +260,54 @@ def update_user(id):
             new_id = int(new_id)
             if new_id <= 0:
                 return jsonify({"error": "ID must be positive"}), 400
-                
-            existing_user = session.query(User).filter(User.id == new_id).first()
-            if existing_user:
-                return jsonify({"error": "New ID already exists"}), 409
             
+            user = session.query(User).filter(User.id == id).first()
+            if not user:
+                return jsonify({"error": "User not found"}), 404
             old_name = user.name
             old_email = user.email
             
             session.delete(user)
-            session.commit()
+            session.flush()
             
-            try:
-                session.execute(text("SET IDENTITY_INSERT users ON"))
-                
+            with identity_insert(session, "users"):
                 new_user = User(
                     id=new_id,
-                    name=data.get("name", old_name),
-                    email=data.get("email", old_email)
+                    name=values.get("name", old_name),
+                    email=values.get("email", old_email)
                 )
                 session.add(new_user)
-                session.commit()
-                
-                session.execute(text("SET IDENTITY_INSERT users OFF"))
-                session.commit()
-                
-                return jsonify({
-                    "message": "User updated with new ID",
-                    "old_id": id,
-                    "new_id": new_id
-                }), 200
-                
-            except Exception as e:
-                session.rollback()
-                session.execute(text("SET IDENTITY_INSERT users OFF"))
-                session.commit()
-                raise e
+            user_search.remove(session, id)
+            user_search.index(session, new_user)
+            session.commit()
+            publish_user_deleted(id)
+            publish_user_upserted(new_user)
+            
+            return jsonify({
+                "message": "User updated with new ID",
+                "old_id": id,
+                "new_id": new_id
+            }), 200
+            
         else:
-            user.name = data.get("name", user.name)
-            if "email" in data:
-                user.email = data["email"].strip()
+            # Một câu UPDATE ... RETURNING: không đọc trước, email trùng -> IntegrityError
+            if values:
+                stmt = (update(User).where(User.id == id).values(**values)
+                        .returning(User.id, User.name, User.email)
+                        .execution_options(synchronize_session=False))
+                user = session.execute(stmt).first()
+            else:
+                user = session.query(User.id, User.name, User.email).filter(User.id == id).first()
+            if not user:
+                return jsonify({"error": "User not found"}), 404
+            user_search.index(session, user)
             session.commit()
+            publish_user_upserted(user)
             return jsonify({"message": "User updated"}), 200
             
+    except IntegrityError as e:
+        session.rollback()
+        return conflict_response(e, "New ID already exists")
     except ValueError:
         return jsonify({"error": "Invalid data format"}), 400
     except Exception as e:
@@ -230,7 +324,9 @@ def delete_user(id):
         if not user:
             return jsonify({"error": "User not found"}), 404
         session.delete(user)
+        user_search.remove(session, id)
         session.commit()
+        publish_user_deleted(id)
         return jsonify({"message": "User deleted"}), 200
     except Exception as e:
         session.rollback()
@@ -238,5 +334,115 @@ def delete_user(id):
     finally:
         session.close()
 
+# ---- Bulk import ----
+
+def validate_import_row(record):
+    """Values to insert for one import row (same rules as POST /users/)."""
+    name = record.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("name is required")
+    email = str(record.get("email") or "").strip()
+    if not validate_email(email):
+        raise ValueError("Invalid email format")
+    if len(name) > 100 or len(email) > 100:
+        raise ValueError("name and email must be at most 100 characters")
+    values = {"name": name, "email": email}
+    custom_id = record.get("id")
+    if custom_id not in (None, ""):
+        try:
+            values["id"] = int(custom_id)
+        except (TypeError, ValueError):
+            raise ValueError("ID must be a positive integer")
+        if values["id"] <= 0:
+            raise ValueError("ID must be a positive integer")
+    return values
+
+def write_import_chunk(session, rows):
+    users = insert_rows(session, User, rows, (User.id, User.name, User.email))
+    user_search.index_many(session, users)
+    # Event chỉ cho id tự chọn (có thể là id đã xoá, còn trong cache của orders);
+    # id autoincrement mới chưa nằm trong cache nào
+    explicit = {row["id"] for row in rows if "id" in row}
+    return [user for user in users if user.id in explicit]
+
+def publish_imported(users):
+    for user in users:
+        publish_user_upserted(user)
+
+@app.route("/users/import", methods=["POST"])
+def import_users():
+    """Bulk create from an NDJSON / CSV body (name, email, optional id); per-row error report."""
+    try:
+        records = read_records(request)
+    except ImportFormatError as e:
+        return jsonify({"error": str(e)}), 415
+    report = run_import(Session, records, validate_import_row, write_import_chunk, conflict_message,
+                        after_commit=publish_imported)
+    return jsonify(report.to_dict()), (500 if report.aborted else 200)
+
+@app.route("/stats/events", methods=["GET"])
+def event_stats():
+    return jsonify(events.stats())
+
+# ---- Health ----
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # Liveness: the process answers; never touches the database
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # Readiness: database reachable and pool warmed
+    ready, detail = readiness.check()
+    return jsonify(detail), (200 if ready else 503)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Prometheus scrape endpoint (aggregates all gunicorn workers)
+    return metrics_response()
+
+@app.route("/stats/traces", methods=["GET"])
+def trace_stats():
+    # Spans kept by this process (TRACE_EXPORT=memory); filter with ?trace_id= or ?request_id=
+    return jsonify(tracing.find_spans(trace_id=request.args.get("trace_id"),
+                                      request_id=request.args.get("request_id"),
+                                      limit=request.args.get("limit", 200, type=int)))
+
+@app.route("/stats/pool", methods=["GET"])
+def db_pool_stats():
+    return jsonify(pool_stats(engine))
+
+@app.route("/stats/requests", methods=["GET"])
+def serving_stats():
+    # Counters of the worker process that answers this request
+    return jsonify(request_stats.stats())
+
+# ---- CLI ----
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Create the database and tables (run before starting the server)."""
+    migrate(engine, DB_NAME, Base.metadata)
+    session = Session()
+    try:
+        indexed = user_search.ensure_built(session, echo=click.echo)  # dữ liệu có sẵn trước khi có search index
+    finally:
+        session.close()
+    if indexed:
+        click.echo(f"search index built for {indexed} users")
+    click.echo(f"schema for {DB_NAME} is up to date")
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Re-index every user for ?search= (after bulk loads or switching backends)."""
+    session = Session()
+    try:
+        count = user_search.rebuild(session, echo=click.echo)
+        click.echo(f"search index rebuilt: {count} users")
+    finally:
+        session.close()
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.getenv("USERS_PORT", 5001)), debug=True)
\ No newline at end of file
+    # Dev server only (FLASK_DEBUG=0 to turn off the reloader); production: gunicorn -c common/gunicorn_conf.py
+    app.run(host="0.0.0.0", port=int(os.getenv("USERS_PORT", 5001)), debug=os.getenv("FLASK_DEBUG", "1") == "1")
\ No newline at end of file